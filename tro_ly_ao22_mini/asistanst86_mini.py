@@ -1,70 +1,1715 @@
 import os
+import io
+import math
+import atexit
+import itertools
+import sys
+import ast
+import json
+import time
+import asyncio
+import argparse
+import contextlib
+import contextvars
+import threading
+import importlib.abc
 import importlib.util
-from typing import Dict, Any, List, Callable, TypedDict, Optional
+import shlex
+import queue
+import pickle
+import builtins
+import multiprocessing
+import inspect
+import re
+from collections import deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Dict, Any, List, Callable, TypedDict, Optional, Iterable, Iterator, TextIO, Tuple
+
+# context riêng của session hiện tại (server mode); None = dùng context chung
+_session_context: contextvars.ContextVar[Optional[Dict[str, Any]]] = contextvars.ContextVar(
+    'asi86_session_context', default=None)
+# Luồng nhận output print của lệnh hiện tại (server mode); None = stdout gốc
+_output_target: contextvars.ContextVar[Optional[TextIO]] = contextvars.ContextVar(
+    'asi86_output_target', default=None)
+# Trạng thái lệnh vừa chạy, tách riêng theo thread/session
+_last_status: contextvars.ContextVar[str] = contextvars.ContextVar('asi86_last_status', default='ok')
+# Stage pipeline của lệnh đang chạy (kênh vào/ra); None = không chạy trong pipeline
+_pipe_stage: contextvars.ContextVar[Optional['_PipeStage']] = contextvars.ContextVar(
+    'asi86_pipe_stage', default=None)
+# Tài nguyên pipeline đã khóa sẵn cho các stage của nó (stage chạy trên thread khác)
+_held_resources: contextvars.ContextVar[frozenset] = contextvars.ContextVar(
+    'asi86_held_resources', default=frozenset())
 
 # Định nghĩa cấu trúc plugin_info
 class PluginInfo(TypedDict, total=False):
     enabled: bool
     register: Callable[[Any], None]
     command_handle: Optional[List[str]]
+    lazy: bool
+    defer: bool             # plugin không có lệnh, chỉ có tác dụng phụ lúc register (chế độ lazy: chạy ở lệnh đầu tiên)
+    process: int            # số worker process chạy plugin (0 = chạy trong process chính; >1 chỉ khi handler stateless)
+    timeout: Optional[float]  # worker quá số giây này không trả lời -> coi là treo, khởi động lại
+
+class HandlerList(list):
+    """list handler có đánh số phiên bản, tăng mỗi khi plugin append/insert/xóa handler"""
+    version = 0
+
+    def _touch(self):
+        self.version += 1
+
+    def append(self, item):
+        super().append(item)
+        self._touch()
+
+    def insert(self, index, item):
+        super().insert(index, item)
+        self._touch()
+
+    def extend(self, items):
+        super().extend(items)
+        self._touch()
+
+    def remove(self, item):
+        super().remove(item)
+        self._touch()
+
+    def pop(self, *args):
+        item = super().pop(*args)
+        self._touch()
+        return item
+
+    def clear(self):
+        super().clear()
+        self._touch()
+
+    def sort(self, *args, **kwargs):
+        super().sort(*args, **kwargs)
+        self._touch()
+
+    def reverse(self):
+        super().reverse()
+        self._touch()
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self._touch()
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self._touch()
+
+    def __iadd__(self, items):
+        result = super().__iadd__(items)
+        self._touch()
+        return result
+
+class CommandIndex:
+    """
+    Chỉ mục tiền tố (trie) để định tuyến lệnh thẳng tới handler.
+    - Handler khai báo thuộc tính command_prefixes (tuple các tiền tố) sẽ được đưa vào trie
+    - Handler không khai báo vẫn được hỏi can_handle như cũ (fallback)
+    - Kết quả giữ đúng thứ tự ưu tiên của danh sách handlers
+    """
+    _END = ''  # key đánh dấu node kết thúc một tiền tố (không trùng ký tự nào)
+
+    def __init__(self):
+        self.root: Dict[str, Any] = {}
+        self.fallback: List[int] = []
+        self.version = -1
+
+    def build(self, handlers: List[Any]) -> None:
+        # Dựng trên biến cục bộ rồi mới gán, để thread khác không đọc phải trie dở dang
+        root: Dict[str, Any] = {}
+        fallback: List[int] = []
+        for pos, handler in enumerate(handlers):
+            if not hasattr(handler, 'can_handle'):
+                continue
+            prefixes = getattr(handler, 'command_prefixes', None)
+            if not prefixes:
+                fallback.append(pos)
+                continue
+            for prefix in prefixes:
+                node = root
+                for ch in prefix:
+                    node = node.setdefault(ch, {})
+                node.setdefault(self._END, []).append(pos)
+        self.root, self.fallback = root, fallback
+
+    def candidates(self, command: str) -> List[int]:
+        """Vị trí các handler có thể xử lý lệnh, theo thứ tự trong danh sách handlers"""
+        positions = list(self.fallback)
+        node = self.root
+        i = 0
+        while node is not None:
+            ends = node.get(self._END)
+            if ends:
+                positions.extend(ends)
+            if i == len(command):
+                break
+            node = node.get(command[i])
+            i += 1
+        return sorted(set(positions))
+
+# Handler giữ chỗ (lazy) trả về giá trị này khi plugin thật không nhận lệnh
+NOT_HANDLED = object()
+
+class CommandResult:
+    """
+    Kết quả có cấu trúc của một lệnh.
+    - status: 'ok' | 'error' | 'unknown' (không handler nào nhận) | 'exit'
+    - data: dữ liệu trả về (dùng cho macro, batch, server)
+    - message: thông báo cho người dùng, được in ra output sink hiện tại
+    Handler tạo bằng assistant.result(...); handler cũ chỉ print và trả None vẫn chạy như trước.
+    """
+    __slots__ = ('status', 'data', 'message')
+
+    def __init__(self, status: str = 'ok', data: Any = None, message: Optional[str] = None):
+        self.status = status
+        self.data = data
+        self.message = message
+
+    def value(self):
+        """
+        Giá trị trả về kiểu cũ của process_command: False = thoát, None -> True, còn lại là data.
+        data có thể falsy ([], 0): chỉ đúng giá trị False mới có nghĩa là thoát.
+        """
+        if self.status == 'exit':
+            return False
+        return True if self.data is None else self.data
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {'status': self.status, 'data': self.data, 'message': self.message}
+
+    def __repr__(self) -> str:
+        return f"CommandResult(status={self.status!r}, data={self.data!r}, message={self.message!r})"
+
+# ---------- Output sink: nơi nhận print của handler và message của CommandResult ----------
+class NullSink(io.TextIOBase):
+    """Bỏ qua mọi output (--quiet)"""
+
+    def write(self, text: str) -> int:
+        return len(text)
+
+class BufferSink(io.StringIO):
+    """Gom output trong bộ nhớ, lấy ra bằng drain()"""
+
+    def drain(self) -> str:
+        text = self.getvalue()
+        self.seek(0)
+        self.truncate()
+        return text
+
+class TaggedSink(io.TextIOBase):
+    """Gắn nhãn (vd '[job 3] ') vào đầu mỗi dòng, ghi cả dòng dưới một khóa chung"""
+
+    def __init__(self, stream: TextIO, tag: str, lock: Optional[Any] = None):
+        self.stream = stream
+        self.tag = tag
+        self.lock = lock or threading.Lock()
+        self._pending = ''
+
+    def write(self, text: str) -> int:
+        self._pending += text
+        if '\n' in self._pending:
+            *lines, self._pending = self._pending.split('\n')
+            with self.lock:
+                self.stream.write(''.join(f"{self.tag}{line}\n" for line in lines))
+        return len(text)
+
+    def flush(self) -> None:
+        if self._pending:
+            self.write('\n')
+        with self.lock:
+            self.stream.flush()
+
+class _ContextStdout(io.TextIOBase):
+    """sys.stdout thay thế: print ghi vào sink của context (thread/session) hiện tại nếu có"""
+
+    def __init__(self, default: TextIO):
+        self.default = default
+
+    def write(self, text: str) -> int:
+        target = _output_target.get()
+        return (self.default if target is None else target).write(text)
+
+    def flush(self) -> None:
+        target = _output_target.get()
+        (self.default if target is None else target).flush()
+
+def _install_context_stdout() -> None:
+    if not isinstance(sys.stdout, _ContextStdout):
+        sys.stdout = _ContextStdout(sys.stdout)
+
+def _real_stdout() -> TextIO:
+    """stdout thật (bỏ qua lớp _ContextStdout) để ghi kết quả không đi qua sink"""
+    out = sys.stdout
+    return out.default if isinstance(out, _ContextStdout) else out
+
+class LatencyHistogram:
+    """
+    Histogram độ trễ chi phí thấp: bucket log-tuyến tính (16 bucket cho mỗi lũy thừa 2,
+    sai số ~3%), chỉ lưu số đếm nên bộ nhớ cố định dù ghi hàng triệu lệnh.
+    """
+    SUB_BUCKETS = 16
+
+    def __init__(self):
+        self.buckets: Dict[int, int] = {}
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds: float) -> None:
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+        key = self._bucket(seconds)
+        self.buckets[key] = self.buckets.get(key, 0) + 1
+
+    def _bucket(self, seconds: float) -> int:
+        if seconds <= 0:
+            return -(1 << 30)
+        mantissa, exponent = math.frexp(seconds)  # seconds = mantissa * 2**exponent, 0.5 <= mantissa < 1
+        return exponent * self.SUB_BUCKETS + int((mantissa - 0.5) * 2 * self.SUB_BUCKETS)
+
+    def _upper(self, key: int) -> float:
+        if key == -(1 << 30):
+            return 0.0
+        exponent, sub = divmod(key, self.SUB_BUCKETS)
+        return math.ldexp(0.5 + (sub + 1) / (2 * self.SUB_BUCKETS), exponent)
+
+    def percentile(self, q: float) -> float:
+        """Giá trị tại phân vị q (0-100), lấy cận trên của bucket và không vượt quá max"""
+        if not self.count:
+            return 0.0
+        rank = max(1, math.ceil(self.count * q / 100))
+        seen = 0
+        for key in sorted(self.buckets):
+            seen += self.buckets[key]
+            if seen >= rank:
+                return min(self._upper(key), self.max)
+        return self.max
+
+    def summary(self) -> Dict[str, float]:
+        return {
+            'count': self.count,
+            'sum': self.total,
+            'p50': self.percentile(50),
+            'p95': self.percentile(95),
+            'p99': self.percentile(99),
+            'max': self.max,
+        }
+
+class CommandStats:
+    """
+    Thống kê thời gian match (tìm handler) và run (handler.handle) của từng lệnh,
+    theo lớp handler và theo token đầu tiên của lệnh.
+    """
+
+    def __init__(self):
+        self.by_handler: Dict[str, Dict[str, LatencyHistogram]] = {}
+        self.by_token: Dict[str, Dict[str, LatencyHistogram]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, handler_name: str, token: str, match: float, run: float) -> None:
+        with self._lock:
+            for table, key in ((self.by_handler, handler_name), (self.by_token, token)):
+                hists = table.get(key)
+                if hists is None:
+                    hists = table[key] = {'match': LatencyHistogram(), 'run': LatencyHistogram()}
+                hists['match'].record(match)
+                hists['run'].record(run)
+
+    def reset(self) -> None:
+        with self._lock:
+            self.by_handler = {}
+            self.by_token = {}
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'handler': {k: {p: h.summary() for p, h in v.items()} for k, v in self.by_handler.items()},
+                'token': {k: {p: h.summary() for p, h in v.items()} for k, v in self.by_token.items()},
+            }
+
+    def print_report(self) -> None:
+        data = self.to_dict()
+        if not data['handler']:
+            print("⚠️ Chưa có lệnh nào được ghi nhận")
+            return
+        for title, group in (("Theo handler", data['handler']), ("Theo lệnh", data['token'])):
+            print(f"📈 {title}:")
+            print(f"   {'':<28}{'count':>7}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}  (ms, run | match p50)")
+            ordered = sorted(group.items(), key=lambda kv: kv[1]['run']['sum'], reverse=True)
+            for name, phases in ordered:
+                run = phases['run']
+                print(f"   {name[:28]:<28}{run['count']:>7}"
+                      f"{run['p50'] * 1000:>10.2f}{run['p95'] * 1000:>10.2f}"
+                      f"{run['p99'] * 1000:>10.2f}{run['max'] * 1000:>10.2f}"
+                      f"  | {phases['match']['p50'] * 1000:.3f}")
+
+    def to_prometheus(self) -> str:
+        def esc(value: str) -> str:
+            return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+        data = self.to_dict()
+        lines = []
+        for phase in ('run', 'match'):
+            metric = f"asi86_command_{phase}_seconds"
+            lines.append(f"# HELP {metric} Thời gian {phase} của lệnh")
+            lines.append(f"# TYPE {metric} summary")
+            for label, group in (('handler', data['handler']), ('token', data['token'])):
+                for name, phases in group.items():
+                    h = phases[phase]
+                    tag = f'{label}="{esc(name)}"'
+                    for q, key in (('0.5', 'p50'), ('0.95', 'p95'), ('0.99', 'p99')):
+                        lines.append(f'{metric}{{{tag},quantile="{q}"}} {h[key]:.9f}')
+                    lines.append(f'{metric}_sum{{{tag}}} {h["sum"]:.9f}')
+                    lines.append(f'{metric}_count{{{tag}}} {h["count"]}')
+        return '\n'.join(lines) + '\n'
+
+    def save(self, path: str) -> None:
+        """Ghi thống kê ra file: .json -> JSON, còn lại -> Prometheus text format"""
+        with open(path, 'w', encoding='utf-8') as f:
+            if path.endswith('.json'):
+                json.dump(self.to_dict(), f, indent=4, ensure_ascii=False)
+            else:
+                f.write(self.to_prometheus())
+
+class LazyPluginHandler:
+    """
+    Handler giữ chỗ cho plugin chưa được import (chế độ lazy).
+    Khai báo tiền tố lấy từ manifest; lần đầu có lệnh khớp mới import plugin thật,
+    thay chính nó bằng các handler thật rồi chuyển lệnh sang.
+    Nếu handler thật không nhận lệnh thì trả NOT_HANDLED để dispatch dò tiếp handler sau,
+    giống hệt khi không bật lazy.
+    """
+    # Bản thân không giữ trạng thái (load_lazy có khóa riêng); khóa tài nguyên áp cho handler thật
+    thread_safe = True
+
+    def __init__(self, loader: 'PluginLoader', assistant: Any, filename: str, entry: Dict[str, Any]):
+        self.loader = loader
+        self.assistant = assistant
+        self.filename = filename
+        # Mục manifest lúc khởi động, dùng lại khi nạp thật (không quét lại thư mục plugin)
+        self.entry = entry
+        self.command_prefixes = tuple(entry['prefixes'])
+        self.pipe_inputs = tuple(entry.get('pipe_inputs', ()))
+        self.loaded: Optional[List[Any]] = None
+        # Lần chạy đầu (gồm cả thời gian import) được thống kê riêng
+        self.stats_name = f"lazy:{filename}"
+
+    def can_handle(self, command: str) -> bool:
+        return command.startswith(self.command_prefixes)
+
+    def handle(self, command: str):
+        handlers = self.loader.load_lazy(self, self.assistant)
+        for handler in handlers:
+            if hasattr(handler, 'can_handle') and handler.can_handle(command) and hasattr(handler, 'handle'):
+                return self.assistant.run_handler(handler, command)
+        return NOT_HANDLED
+
+class _TimedLoader(importlib.abc.Loader):
+    """Bọc loader gốc để đo thời gian exec_module (tính cả các import con)"""
+
+    def __init__(self, loader: Any, name: str, timings: Dict[str, float]):
+        self.loader = loader
+        self.name = name
+        self.timings = timings
+
+    def create_module(self, spec):
+        return self.loader.create_module(spec)
+
+    def exec_module(self, module) -> None:
+        t0 = time.perf_counter()
+        try:
+            self.loader.exec_module(module)
+        finally:
+            self.timings[self.name] = time.perf_counter() - t0
+
+    def __getattr__(self, name: str):
+        return getattr(self.loader, name)
+
+class ImportTimer(importlib.abc.MetaPathFinder):
+    """
+    Meta path finder ghi lại thời gian import từng module phụ thuộc (giống -X importtime),
+    gắn vào plugin đang được import trên thread hiện tại.
+    """
+
+    def __init__(self):
+        self.local = threading.local()
+
+    def find_spec(self, fullname, path, target=None):
+        timings = getattr(self.local, 'timings', None)
+        if timings is None or getattr(self.local, 'busy', False):
+            return None
+        self.local.busy = True
+        try:
+            for finder in sys.meta_path:
+                if finder is self or not hasattr(finder, 'find_spec'):
+                    continue
+                spec = finder.find_spec(fullname, path, target)
+                if spec is not None:
+                    break
+            else:
+                return None
+        finally:
+            self.local.busy = False
+        if spec.loader is not None and hasattr(spec.loader, 'exec_module'):
+            spec.loader = _TimedLoader(spec.loader, fullname, timings)
+        return spec
+
+    def track(self, timings: Optional[Dict[str, float]]) -> None:
+        self.local.timings = timings
+
+# ---------- Plugin chạy trong worker process ----------
+def _context_delta(context: Dict[str, Any], snapshot: Dict[str, bytes]) -> Tuple[Dict[str, bytes], List[str]]:
+    """
+    Phần context thay đổi so với bên kia đã biết (snapshot: key -> bytes pickle đã đồng bộ).
+    Giá trị không pickle được (hàm, file đang mở...) chỉ ở lại process hiện tại.
+    """
+    changed: Dict[str, bytes] = {}
+    for key, value in list(context.items()):
+        try:
+            data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        except Exception:
+            continue
+        if snapshot.get(key) != data:
+            changed[key] = data
+            snapshot[key] = data
+    removed = [key for key in snapshot if key not in context]
+    for key in removed:
+        del snapshot[key]
+    return changed, removed
+
+def _apply_delta(context: Dict[str, Any], snapshot: Dict[str, bytes],
+                 changed: Dict[str, bytes], removed: List[str]) -> None:
+    for key, data in changed.items():
+        context[key] = pickle.loads(data)
+        snapshot[key] = data
+    for key in removed:
+        context.pop(key, None)
+        snapshot.pop(key, None)
+
+def _pack_value(value: Any) -> Tuple:
+    """Giá trị trả về của handler -> tuple gửi qua pipe (CommandResult tách thành field)"""
+    if isinstance(value, CommandResult):
+        data = value.data
+        packed = ('result', value.status, data, value.message)
+    else:
+        data = value
+        packed = ('value', value)
+    try:
+        pickle.dumps(data, pickle.HIGHEST_PROTOCOL)
+    except Exception:
+        return packed[:-2] + (repr(data), packed[-1]) if packed[0] == 'result' else ('value', repr(data))
+    return packed
+
+def _unpack_value(packed: Tuple) -> Any:
+    if packed[0] == 'result':
+        return CommandResult(packed[1], packed[2], packed[3])
+    if packed[0] == 'error':
+        raise RuntimeError(packed[1])
+    if packed[0] == 'eof':
+        raise EOFError()
+    return packed[1]
+
+class _WorkerOutput(io.TextIOBase):
+    """stdout trong worker: gom output và gửi về process chính (theo khối, trước khi chờ trả lời)"""
+
+    def __init__(self, conn: Any):
+        self.conn = conn
+        self.parts: List[str] = []
+        self.size = 0
+
+    def write(self, text: str) -> int:
+        self.parts.append(text)
+        self.size += len(text)
+        if self.size > 4096:
+            self.flush()
+        return len(text)
+
+    def flush(self) -> None:
+        if self.parts:
+            self.conn.send(('out', ''.join(self.parts), {}, []))
+            self.parts, self.size = [], 0
+
+class _WorkerAssistant:
+    """
+    Trợ lý giả bên trong worker: giữ handler của plugin và bản sao context (đồng bộ theo delta).
+    process_command và input được chuyển ngược về process chính.
+    """
+    # Plugin đọc cờ này để không giữ trạng thái chỉ có trong worker tới lúc thoát (vd excel lưu file ngay)
+    worker_process = True
+
+    def __init__(self, conn: Any):
+        self.conn = conn
+        self.handlers = HandlerList()
+        self.context_id = 0
+        self._contexts: Dict[int, Dict[str, Any]] = {}
+        self._snapshots: Dict[int, Dict[str, bytes]] = {}
+
+    @property
+    def context(self) -> Dict[str, Any]:
+        return self._contexts.setdefault(self.context_id, {})
+
+    @property
+    def snapshot(self) -> Dict[str, bytes]:
+        return self._snapshots.setdefault(self.context_id, {})
+
+    def result(self, status: str = 'ok', data: Any = None, message: Optional[str] = None) -> CommandResult:
+        return CommandResult(status, data, message)
+
+    def process_command(self, command: str):
+        return self._request('call', command)
+
+    def pipe_input(self) -> None:
+        # Pipeline chưa đi qua worker process: stage chạy trong worker nhận/gửi qua giá trị trả về
+        return None
+
+    def emit(self, item: Any) -> bool:
+        return False
+
+    def input(self, prompt: str = '') -> str:
+        return self._request('input', prompt)
+
+    def _request(self, op: str, arg: str):
+        sys.stdout.flush()
+        changed, removed = _context_delta(self.context, self.snapshot)
+        self.conn.send((op, arg, changed, removed))
+        while True:
+            msg = self.conn.recv()
+            if msg[0] != 'reply':
+                self.serve(msg)  # lệnh lồng nhau quay lại chính plugin này
+                continue
+            _, packed, changed, removed = msg
+            _apply_delta(self.context, self.snapshot, changed, removed)
+            return _unpack_value(packed)
+
+    def serve(self, msg: Tuple) -> None:
+        op, index, arg, context_id, changed, removed = msg
+        outer = self.context_id
+        self.context_id = context_id
+        try:
+            _apply_delta(self.context, self.snapshot, changed, removed)
+            handler = self.handlers[index]
+            try:
+                if op == 'can':
+                    packed = ('value', bool(handler.can_handle(arg)))
+                elif op == 'resources':
+                    packed = ('value', list(handler.resources(arg)))
+                elif op == 'pure':
+                    packed = ('value', bool(handler.is_pure(arg)))
+                else:
+                    packed = _pack_value(handler.handle(arg))
+            except Exception as e:
+                packed = ('error', f"{type(e).__name__}: {e}")
+            sys.stdout.flush()
+            changed, removed = _context_delta(self.context, self.snapshot) if op == 'run' else ({}, [])
+            self.conn.send(('done', packed, changed, removed))
+        finally:
+            self.context_id = outer
+
+def _plugin_worker_main(conn: Any, plugins_folder: str, filename: str) -> None:
+    """Hàm chạy trong worker process: import plugin, báo danh sách handler rồi phục vụ lệnh"""
+    sys.stdout = _WorkerOutput(conn)
+    assistant = _WorkerAssistant(conn)
+    builtins.input = assistant.input
+    try:
+        plugin_path = os.path.join(plugins_folder, filename)
+        spec = importlib.util.spec_from_file_location(f"plugin_{filename[:-3]}", plugin_path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        plugin_info = getattr(module, 'plugin_info', {})
+        if 'register' in plugin_info and callable(plugin_info['register']):
+            plugin_info['register'](assistant)
+    except Exception as e:
+        sys.stdout.flush()
+        conn.send(('failed', f"{type(e).__name__}: {e}", {}, []))
+        return
+    sys.stdout.flush()
+    conn.send(('ready', [{
+        'name': type(h).__name__,
+        'prefixes': list(getattr(h, 'command_prefixes', None) or ()),
+        'resources': hasattr(h, 'resources'),
+        'pure': hasattr(h, 'is_pure'),
+        'stateless': bool(getattr(h, 'stateless', False)),
+    } for h in assistant.handlers], {}, []))
+    while True:
+        try:
+            msg = conn.recv()
+        except (EOFError, OSError):
+            break
+        if msg[0] == 'close':
+            break
+        assistant.serve(msg)
+    # Process con thoát bằng os._exit (không chạy atexit): cho handler dọn dẹp ở đây
+    for handler in assistant.handlers:
+        if hasattr(handler, 'shutdown'):
+            try:
+                handler.shutdown()
+            except Exception as e:
+                print(f"⚠️ Lỗi khi đóng {type(handler).__name__}: {e}")
+    sys.stdout.flush()
+
+class _PluginWorker:
+    """Một worker process của plugin, nói chuyện với process chính qua Pipe"""
+
+    def __init__(self, pool: 'PluginWorkerPool'):
+        self.pool = pool
+        self.process: Any = None
+        self.conn: Any = None
+        self.snapshots: Dict[int, Dict[str, bytes]] = {}
+
+    def start(self) -> List[Dict[str, Any]]:
+        mp = multiprocessing.get_context('spawn')  # không fork process đang có nhiều thread
+        parent, child = mp.Pipe()
+        self.process = mp.Process(target=_plugin_worker_main, name=f"asi86-{self.pool.filename}",
+                                  args=(child, self.pool.plugins_folder, self.pool.filename), daemon=True)
+        self.process.start()
+        child.close()
+        self.conn = parent
+        self.snapshots = {}
+        while True:
+            try:
+                kind, payload, _, _ = self.conn.recv()
+            except (EOFError, OSError):
+                self.stop()
+                raise RuntimeError(f"worker của {self.pool.filename} thoát khi đang khởi động")
+            if kind == 'out':
+                sys.stdout.write(payload)
+            elif kind == 'failed':
+                self.stop()
+                raise RuntimeError(payload)
+            else:
+                return payload
+
+    def stop(self, graceful: bool = True) -> None:
+        """graceful: báo worker đóng và chờ nó dọn dẹp (vd lưu file); ngược lại kill ngay"""
+        if self.process is None:
+            return
+        if graceful:
+            try:
+                self.conn.send(('close',))
+                while self.conn.poll(60):
+                    kind, payload, _, _ = self.conn.recv()
+                    if kind == 'out':
+                        sys.stdout.write(payload)
+            except (EOFError, OSError, ValueError):
+                pass
+            self.process.join(2)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.conn.close()
+        self.process = None
+
+    def call(self, op: str, index: int, arg: str, assistant: Any, timeout: Optional[float]):
+        context = assistant.context
+        snapshot = self.snapshots.setdefault(id(context), {})
+        changed, removed = _context_delta(context, snapshot) if op == 'run' else ({}, [])
+        self.conn.send((op, index, arg, id(context), changed, removed))
+        while True:
+            if timeout is not None and not self.conn.poll(timeout):
+                raise TimeoutError(f"quá {timeout}s")
+            kind, payload, changed, removed = self.conn.recv()
+            if kind == 'out':
+                sys.stdout.write(payload)
+                continue
+            _apply_delta(context, snapshot, changed, removed)
+            if kind == 'done':
+                return _unpack_value(payload)
+            # Plugin gọi ngược lại trợ lý: chạy ở process chính rồi trả lời
+            try:
+                if kind == 'input':
+                    packed = ('value', input(payload))
+                else:
+                    packed = _pack_value(assistant.execute(payload).value())
+            except EOFError:
+                packed = ('eof',)
+            except Exception as e:
+                packed = ('error', f"{type(e).__name__}: {e}")
+            changed, removed = _context_delta(context, snapshot)
+            self.conn.send(('reply', packed, changed, removed))
+
+class PluginWorkerPool:
+    """
+    Nhóm worker process cho một plugin (plugin_info['process'] = số worker).
+    Lệnh lấy một worker rảnh; worker chết hoặc treo quá timeout sẽ bị kill và khởi động lại.
+    Trạng thái riêng của handler (vd file mặc định, workbook đang mở của excel) nằm trong từng worker.
+    Mỗi lần gọi (can_handle, resources, handle) lấy worker riêng, nên can_handle và handle của
+    cùng một lệnh có thể rơi vào hai worker khác nhau: chỉ plugin mà mọi handler khai báo
+    stateless = True (không giữ trạng thái giữa các lệnh) mới được chạy trên nhiều worker,
+    plugin khác luôn chạy một worker.
+    """
+
+    def __init__(self, plugins_folder: str, filename: str, size: int = 1, timeout: Optional[float] = None):
+        self.plugins_folder = plugins_folder
+        self.filename = filename
+        self.timeout = timeout
+        self.restarts = 0
+        self._idle: 'queue.Queue[_PluginWorker]' = queue.Queue()
+        self._held = threading.local()
+        self.workers: List[_PluginWorker] = []
+        self.handlers: List[Dict[str, Any]] = []
+        try:
+            self.handlers = self._add_worker()
+            stateful = [h['name'] for h in self.handlers if not h['stateless']]
+            if size > 1 and stateful:
+                print(f"⚠️ {filename}: {', '.join(stateful)} giữ trạng thái giữa các lệnh, "
+                      f"chỉ chạy 1 worker process thay vì {size}")
+                size = 1
+            for _ in range(size - 1):
+                self._add_worker()
+        except Exception:
+            self.shutdown()
+            raise
+
+    def _add_worker(self) -> List[Dict[str, Any]]:
+        worker = _PluginWorker(self)
+        self.workers.append(worker)
+        handlers = worker.start()
+        self._idle.put(worker)
+        return handlers
+
+    @contextlib.contextmanager
+    def _checkout(self):
+        held = getattr(self._held, 'worker', None)
+        if held is not None:
+            # Lệnh lồng nhau (plugin gọi lại chính nó) chạy trên worker đang giữ
+            yield held
+            return
+        worker = self._idle.get()
+        self._held.worker = worker
+        try:
+            yield worker
+        finally:
+            self._held.worker = None
+            self._idle.put(worker)
+
+    def call(self, op: str, index: int, arg: str, assistant: Any):
+        with self._checkout() as worker:
+            try:
+                return worker.call(op, index, arg, assistant, self.timeout if op == 'run' else None)
+            except (EOFError, OSError, TimeoutError) as e:
+                reason = f"treo ({e})" if isinstance(e, TimeoutError) else "bị dừng đột ngột"
+                worker.stop(graceful=False)
+                worker.start()
+                self.restarts += 1
+                raise RuntimeError(f"Worker của {self.filename} {reason}, đã khởi động lại") from e
+
+    def shutdown(self) -> None:
+        for worker in self.workers:
+            worker.stop()
+
+class RemoteHandler:
+    """Handler ở process chính, chuyển lệnh sang handler thật trong worker process"""
+    # Mỗi lệnh chạy trên một worker riêng, không chia sẻ bộ nhớ với process chính
+    thread_safe = True
+
+    def __init__(self, pool: PluginWorkerPool, index: int, info: Dict[str, Any], assistant: Any):
+        self.pool = pool
+        self.index = index
+        self.info = info
+        self.assistant = assistant
+        self.command_prefixes = tuple(info['prefixes'])
+        self.stats_name = f"{info['name']}@worker"
+
+    def can_handle(self, command: str) -> bool:
+        if self.command_prefixes and not command.startswith(self.command_prefixes):
+            return False
+        try:
+            return self.pool.call('can', self.index, command, self.assistant)
+        except RuntimeError as e:
+            print(f"⚠️ {e}")
+            return False
+
+    def resources(self, command: str) -> List[str]:
+        if not self.info['resources']:
+            return []
+        return self.pool.call('resources', self.index, command, self.assistant)
+
+    def is_pure(self, command: str) -> bool:
+        return self.info['pure'] and self.pool.call('pure', self.index, command, self.assistant)
+
+    def handle(self, command: str):
+        try:
+            return self.pool.call('run', self.index, command, self.assistant)
+        except RuntimeError as e:
+            return self.assistant.result('error', message=f"⚠️ {e}")
 
 class PluginLoader:
-    def __init__(self, plugins_folder: str = "plugins"):
+    MANIFEST_FILE = "_manifest.json"
+
+    def __init__(self, plugins_folder: str = "plugins", lazy: bool = False,
+                 parallel: bool = False, profile_imports: bool = False,
+                 process: Optional[Dict[str, int]] = None):
         self.plugins_folder = plugins_folder
+        self.lazy = lazy
+        self.parallel = parallel
+        # Ghi đè số worker process theo tên plugin (không đuôi .py), vd {'excel_crud': 2}
+        self.process = process or {}
+        self.pools: Dict[str, PluginWorkerPool] = {}
+        # Thời gian import/register của từng plugin (luôn đo, rất rẻ)
+        self.profile: Dict[str, Dict[str, Any]] = {}
+        self.import_timer = ImportTimer() if profile_imports else None
+        self._lazy_lock = threading.Lock()
+        # Plugin 'defer' chưa register (chế độ lazy), nạp ở lệnh đầu tiên qua load_deferred
+        self.deferred: List[Tuple[str, Dict[str, Any]]] = []
         os.makedirs(plugins_folder, exist_ok=True)
 
+    def _plugin_files(self) -> List[str]:
+        return [f for f in os.listdir(self.plugins_folder)
+                if f.endswith('.py') and not f.startswith('_')]
+
+    def _import_plugin(self, filename: str):
+        """Import module plugin và trả về plugin_info"""
+        record = self.profile.setdefault(filename, {'import': 0.0, 'register': 0.0, 'modules': {}})
+        if self.import_timer is not None:
+            self.import_timer.track(record['modules'])
+        t0 = time.perf_counter()
+        try:
+            plugin_path = os.path.join(self.plugins_folder, filename)
+            spec = importlib.util.spec_from_file_location(f"plugin_{filename[:-3]}", plugin_path)
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+        finally:
+            record['import'] = time.perf_counter() - t0
+            if self.import_timer is not None:
+                self.import_timer.track(None)
+        plugin_info: PluginInfo = getattr(module, 'plugin_info', {})
+        return plugin_info
+
+    def _process_count(self, filename: str, entry: Optional[Dict[str, Any]]) -> int:
+        name = filename[:-3]
+        if name in self.process:
+            return self.process[name]
+        return (entry or {}).get('process', 0) or 0
+
+    def _start_workers(self, filename: str, entry: Dict[str, Any], assistant: Any) -> None:
+        """Chạy plugin trong worker process, đăng ký RemoteHandler thay cho handler thật"""
+        record = self.profile.setdefault(filename, {'import': 0.0, 'register': 0.0, 'modules': {}})
+        t0 = time.perf_counter()
+        try:
+            pool = PluginWorkerPool(self.plugins_folder, filename, self._process_count(filename, entry),
+                                    entry.get('timeout'))
+        finally:
+            record['import'] = time.perf_counter() - t0
+        record['workers'] = len(pool.workers)
+        if not self.pools:
+            atexit.register(self.shutdown_workers)
+        self.pools[filename] = pool
+        for index, info in enumerate(pool.handlers):
+            assistant.handlers.append(RemoteHandler(pool, index, info, assistant))
+
+    def shutdown_workers(self) -> None:
+        while self.pools:
+            _, pool = self.pools.popitem()
+            pool.shutdown()
+
+    def _register(self, filename: str, plugin_info: PluginInfo, assistant: Any) -> None:
+        if not plugin_info.get('enabled', True):
+            return
+        # Gọi hàm register của plugin
+        if 'register' in plugin_info and callable(plugin_info['register']):
+            t0 = time.perf_counter()
+            plugin_info['register'](assistant)
+            self.profile[filename]['register'] = time.perf_counter() - t0
+
     def load_plugins(self, assistant: Any) -> None:
-        """Tải tất cả plugin từ thư mục plugins"""
-        for filename in os.listdir(self.plugins_folder):
-            if not filename.endswith('.py') or filename.startswith('_'):
+        """
+        Tải tất cả plugin từ thư mục plugins.
+        - lazy: plugin có tiền tố trong manifest chỉ được import khi có lệnh đầu tiên;
+          plugin 'defer' (watcher, hash file... không có lệnh) được import khi có lệnh bất kỳ đầu tiên
+        - parallel: import các plugin còn lại trên thread pool, register vẫn theo thứ tự cố định
+        """
+        # Manifest (quét AST, không import) cho biết plugin nào lazy / chạy trong worker process
+        manifest = self.load_manifest()
+        plan = []
+        for filename in self._plugin_files():
+            entry = manifest.get(filename)
+            if self.lazy and entry is not None and not entry['enabled']:
                 continue
-                
-            plugin_path = os.path.join(self.plugins_folder, filename)
+            if self.lazy and entry is not None and entry['prefixes'] and entry['lazy']:
+                plan.append((filename, entry, 'lazy'))
+            elif self.lazy and entry is not None and entry.get('defer') and not self._process_count(filename, entry):
+                self.deferred.append((filename, entry))
+            elif self._process_count(filename, entry) > 0 and (entry is None or entry['enabled']):
+                plan.append((filename, entry or {}, 'process'))
+            else:
+                plan.append((filename, entry, 'import'))
+
+        if self.import_timer is not None and self.import_timer not in sys.meta_path:
+            sys.meta_path.insert(0, self.import_timer)
+        pool = None
+        futures = {}
+        if self.parallel:
+            pool = ThreadPoolExecutor(thread_name_prefix="plugin-import")
+            futures = {f: pool.submit(self._import_plugin, f) for f, _, mode in plan if mode == 'import'}
+        try:
+            for filename, entry, mode in plan:
+                try:
+                    if mode == 'process':
+                        self._start_workers(filename, entry, assistant)
+                        continue
+                    if mode == 'lazy':
+                        assistant.handlers.append(
+                            LazyPluginHandler(self, assistant, filename, entry))
+                        continue
+                    if filename in futures:
+                        plugin_info = futures[filename].result()
+                    else:
+                        plugin_info = self._import_plugin(filename)
+                    self._register(filename, plugin_info, assistant)
+                except Exception as e:
+                    print(f"⚠️ Lỗi khi tải plugin {filename}: {e}")
+        finally:
+            if pool is not None:
+                pool.shutdown(wait=True)
+
+    def print_profile(self) -> None:
+        """Báo cáo thời gian khởi động: import, register và các import nặng nhất của từng plugin"""
+        if not self.profile:
+            print("⚠️ Chưa có plugin nào được tải")
+            return
+        total = sum(r['import'] + r['register'] for r in self.profile.values())
+        print(f"⏱️ Hồ sơ khởi động (tổng {total * 1000:.1f} ms):")
+        ordered = sorted(self.profile.items(), key=lambda kv: kv[1]['import'] + kv[1]['register'], reverse=True)
+        for filename, record in ordered:
+            lazy = " (lazy)" if record.get('lazy') else ""
+            if record.get('workers'):
+                lazy += f" ({record['workers']} worker process)"
+            print(f"   {filename}{lazy}: import {record['import'] * 1000:.1f} ms | "
+                  f"register {record['register'] * 1000:.1f} ms")
+            heaviest = sorted(record['modules'].items(), key=lambda kv: kv[1], reverse=True)[:5]
+            for name, seconds in heaviest:
+                print(f"      ↳ {name}: {seconds * 1000:.1f} ms")
+        if self.import_timer is None:
+            print("   (chạy với --profile-startup để xem các import phụ thuộc)")
+
+    def load_lazy(self, placeholder: LazyPluginHandler, assistant: Any) -> List[Any]:
+        """Import plugin thật, đặt các handler của nó vào đúng vị trí của handler giữ chỗ"""
+        with self._lazy_lock:
+            # Lệnh khác (thread khác) có thể đã nạp plugin này trong lúc chờ khóa
+            if placeholder.loaded is not None:
+                return placeholder.loaded
+            before = list(assistant.handlers)
+            entry = placeholder.entry
+            if self._process_count(placeholder.filename, entry) > 0:
+                self._start_workers(placeholder.filename, entry, assistant)
+            else:
+                plugin_info = self._import_plugin(placeholder.filename)
+                self._register(placeholder.filename, plugin_info, assistant)
+            self.profile[placeholder.filename]['lazy'] = True
+            added = [h for h in assistant.handlers if not any(h is b for b in before)]
+            for handler in added:
+                assistant.handlers.remove(handler)
+            pos = next(i for i, h in enumerate(assistant.handlers) if h is placeholder)
+            assistant.handlers[pos:pos + 1] = added
+            placeholder.loaded = added
+            return added
+
+    def load_deferred(self, assistant: Any) -> None:
+        """Import và register các plugin 'defer' còn chờ (gọi trước lệnh đầu tiên)"""
+        with self._lazy_lock:
+            pending, self.deferred = self.deferred, []
+            for filename, _ in pending:
+                try:
+                    self._register(filename, self._import_plugin(filename), assistant)
+                    self.profile[filename]['lazy'] = True
+                except Exception as e:
+                    print(f"⚠️ Lỗi khi tải plugin {filename}: {e}")
+
+    # ---------- Manifest cho chế độ lazy ----------
+    def load_manifest(self) -> Dict[str, Any]:
+        """
+        Đọc manifest (tên, tiền tố, mtime của từng plugin).
+        File nào đổi mtime/size hoặc chưa có trong manifest thì quét lại bằng AST (không import),
+        manifest được ghi lại nếu có thay đổi.
+        """
+        path = os.path.join(self.plugins_folder, self.MANIFEST_FILE)
+        manifest: Dict[str, Any] = {}
+        if os.path.exists(path):
             try:
-                # Load plugin module
-                spec = importlib.util.spec_from_file_location(f"plugin_{filename[:-3]}", plugin_path)
-                module = importlib.util.module_from_spec(spec)
-                spec.loader.exec_module(module)
-                
-                # Lấy thông tin plugin
-                plugin_info: PluginInfo = getattr(module, 'plugin_info', {})
-                if not plugin_info.get('enabled', True):
-                    continue
-                    
-                # Gọi hàm register của plugin
-                if 'register' in plugin_info and callable(plugin_info['register']):
-                    plugin_info['register'](assistant)
+                with open(path, 'r', encoding='utf-8') as f:
+                    manifest = json.load(f)
+            except Exception:
+                manifest = {}
+        fresh: Dict[str, Any] = {}
+        changed = False
+        for filename in self._plugin_files():
+            st = os.stat(os.path.join(self.plugins_folder, filename))
+            entry = manifest.get(filename)
+            if entry and entry.get('mtime') == st.st_mtime_ns and entry.get('size') == st.st_size:
+                fresh[filename] = entry
+                continue
+            try:
+                fresh[filename] = self.scan_plugin(filename, st)
             except Exception as e:
-                print(f"⚠️ Lỗi khi tải plugin {filename}: {e}")
+                print(f"⚠️ Không quét được plugin {filename}: {e}")
+                continue
+            changed = True
+        if changed or set(fresh) != set(manifest):
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(fresh, f, indent=4, ensure_ascii=False)
+        return fresh
+
+    def scan_plugin(self, filename: str, st: os.stat_result) -> Dict[str, Any]:
+        """Lấy command_prefixes, pipe_inputs và plugin_info['enabled'/'lazy'/'defer'/'process'/'timeout'] từ mã nguồn mà không chạy plugin"""
+        with open(os.path.join(self.plugins_folder, filename), 'r', encoding='utf-8') as f:
+            tree = ast.parse(f.read(), filename)
+        prefixes: List[str] = []
+        pipe_inputs: List[str] = []
+        info: Dict[str, Any] = {}
+        for node in ast.walk(tree):
+            if isinstance(node, ast.ClassDef):
+                for stmt in node.body:
+                    if not isinstance(stmt, ast.Assign):
+                        continue
+                    names = {t.id for t in stmt.targets if isinstance(t, ast.Name)}
+                    if 'command_prefixes' in names:
+                        prefixes.extend(ast.literal_eval(stmt.value))
+                    elif 'pipe_inputs' in names:
+                        pipe_inputs.extend(ast.literal_eval(stmt.value))
+            elif (isinstance(node, ast.Assign) and isinstance(node.value, ast.Dict)
+                    and any(isinstance(t, ast.Name) and t.id == 'plugin_info' for t in node.targets)):
+                for key, value in zip(node.value.keys, node.value.values):
+                    if isinstance(key, ast.Constant) and key.value in ('enabled', 'lazy', 'defer', 'process', 'timeout'):
+                        info[key.value] = ast.literal_eval(value)
+        return {
+            'name': filename[:-3],
+            'mtime': st.st_mtime_ns,
+            'size': st.st_size,
+            'prefixes': prefixes,
+            'pipe_inputs': pipe_inputs,
+            'enabled': info.get('enabled', True),
+            'lazy': info.get('lazy', True),
+            'defer': info.get('defer', False),
+            'process': info.get('process', 0),
+            'timeout': info.get('timeout'),
+        }
+
+class ResourceLockManager:
+    """
+    Khóa theo tên tài nguyên (vd 'file:/abs/a.xlsx', 'macro:demo').
+    Lệnh chỉ phải chờ nhau khi đụng cùng tài nguyên; nhiều khóa được lấy theo thứ tự
+    tên đã sắp xếp để tránh deadlock. RLock cho phép lệnh lồng nhau (macro gọi excel).
+    """
 
-class VirtualAssistant:
     def __init__(self):
-        self.handlers: List[Any] = []
-        self.loader = PluginLoader()
-        self.context: Dict[str, Any] = {}
+        self._locks: Dict[str, Any] = {}
+        self._guard = threading.Lock()
+
+    def _lock(self, name: str):
+        lock = self._locks.get(name)
+        if lock is None:
+            with self._guard:
+                lock = self._locks.setdefault(name, threading.RLock())
+        return lock
+
+    @contextlib.contextmanager
+    def hold(self, names: Iterable[str]):
+        acquired = []
+        try:
+            for name in sorted(set(names) - _held_resources.get()):
+                lock = self._lock(name)
+                lock.acquire()
+                acquired.append(lock)
+            yield
+        finally:
+            for lock in reversed(acquired):
+                lock.release()
+
+class PipeChannel:
+    """
+    Hàng đợi có giới hạn nối hai stage của pipeline.
+    Stage sau xong sớm thì đóng kênh: item gửi tiếp bị bỏ, stage trước không bị chặn.
+    """
+    _END = object()
+
+    def __init__(self, maxsize: int):
+        self.queue: 'queue.Queue[Any]' = queue.Queue(maxsize)
+        self.closed = False
+
+    def put(self, item: Any) -> None:
+        if not self.closed:
+            self.queue.put(item)
+
+    def finish(self) -> None:
+        self.put(self._END)
+
+    def close(self) -> None:
+        self.closed = True
+        # Giải phóng bên gửi nếu nó đang chờ hàng đợi đầy
+        try:
+            while True:
+                self.queue.get_nowait()
+        except queue.Empty:
+            pass
+
+    def __iter__(self) -> Iterator[Any]:
+        while True:
+            item = self.queue.get()
+            if item is self._END:
+                return
+            yield item
+
+class _PipeStage:
+    def __init__(self, source: Optional[PipeChannel], sink: Optional[PipeChannel]):
+        self.source = source
+        self.sink = sink
+        self.emitted = False
+
+def _split_pipeline(command: str) -> List[str]:
+    """Tách 'a | b | c' theo dấu | có khoảng trắng hai bên và nằm ngoài dấu nháy"""
+    stages = []
+    quote = None
+    start = 0
+    for i, ch in enumerate(command):
+        if quote:
+            if ch == quote:
+                quote = None
+        elif ch in '"\'':
+            quote = ch
+        elif (ch == '|' and 0 < i < len(command) - 1
+              and command[i - 1].isspace() and command[i + 1].isspace()):
+            stages.append(command[start:i].strip())
+            start = i + 1
+    stages.append(command[start:].strip())
+    return stages
+
+def _pipe_items(data: Any) -> Iterable[Any]:
+    """Giá trị trả về của stage không tự emit -> các item gửi sang stage sau"""
+    if data is None or isinstance(data, bool):
+        return ()
+    if isinstance(data, list) or inspect.isgenerator(data):
+        return data
+    return (data,)
+
+class JobRunner:
+    """
+    Chạy lệnh song song trên thread pool. Mỗi lệnh là một job có id;
+    output của job được gắn nhãn '[job <id>] ' để phân biệt khi chạy đồng thời.
+    """
+
+    def __init__(self, assistant: 'VirtualAssistant', workers: Optional[int] = None,
+                 stream: Optional[TextIO] = None):
+        self.assistant = assistant
+        assistant.enable_concurrency()
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="asi86-job")
+        self.stream = stream or _real_stdout()
+        self.running: Dict[int, str] = {}
+        self._ids = itertools.count(1)
+        self._write_lock = threading.Lock()
+
+    def submit(self, command: str, sink: Optional[TextIO] = None) -> Tuple[int, Future]:
+        """Đưa lệnh vào pool; sink mặc định là TaggedSink ra stream của runner"""
+        job_id = next(self._ids)
+        self.running[job_id] = command
+        ctx = contextvars.copy_context()
+        return job_id, self.pool.submit(ctx.run, self._run, job_id, command, sink)
+
+    def _run(self, job_id: int, command: str, sink: Optional[TextIO]) -> Tuple[CommandResult, float]:
+        if sink is None:
+            sink = TaggedSink(self.stream, f"[job {job_id}] ", self._write_lock)
+        try:
+            t0 = time.perf_counter()
+            with self.assistant.output_to(sink):
+                result = self.assistant.execute(command)
+            elapsed = time.perf_counter() - t0
+            sink.flush()
+            return result, elapsed
+        finally:
+            self.running.pop(job_id, None)
+
+    def shutdown(self, wait: bool = True) -> None:
+        self.pool.shutdown(wait=wait)
+
+def _approx_size(value: Any, depth: int = 2) -> int:
+    """Ước lượng bộ nhớ của kết quả (đi sâu tối đa depth cấp list/tuple/dict)"""
+    size = sys.getsizeof(value)
+    if depth > 0:
+        if isinstance(value, dict):
+            size += sum(_approx_size(k, depth - 1) + _approx_size(v, depth - 1) for k, v in value.items())
+        elif isinstance(value, (list, tuple, set)):
+            size += sum(_approx_size(v, depth - 1) for v in value)
+        elif isinstance(value, CommandResult):
+            size += _approx_size(value.data, depth)
+    return size
+
+class ResultCache:
+    """
+    Cache kết quả lệnh thuần (chỉ đọc), bật bằng 'cache on' hoặc --cache.
+    - Handler đánh dấu lệnh thuần qua is_pure(command)
+    - Khóa = lệnh đã chuẩn hóa + (mtime, size) của các file trong resources(command)
+    - Lưu cả giá trị trả về, output đã in và các key context lệnh đặt -> cache hit phát lại y hệt
+    - LRU, giới hạn số mục và tổng dung lượng ước lượng
+    - Lệnh không thuần đụng tới file nào thì bỏ hết kết quả đã cache của file đó
+    """
+
+    def __init__(self, max_entries: int = 256, max_bytes: int = 64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: 'OrderedDict[Any, Tuple[Any, str, Dict[str, Any], int]]' = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key(command: str, resources: Iterable[str]) -> Any:
+        try:
+            words = tuple(shlex.split(command))
+        except ValueError:
+            words = tuple(command.split())
+        files = []
+        for name in sorted(set(resources)):
+            if not name.startswith('file:'):
+                continue
+            try:
+                st = os.stat(name[5:])
+                files.append((name, st.st_mtime_ns, st.st_size))
+            except OSError:
+                files.append((name, None, None))
+        return words, tuple(files)
+
+    def get(self, key: Any) -> Optional[Tuple[Any, str, Dict[str, Any]]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[:3]
+
+    def put(self, key: Any, value: Any, output: str, context_updates: Dict[str, Any]) -> None:
+        size = len(output) + _approx_size(value) + _approx_size(context_updates)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[3]
+            self._entries[key] = (value, output, context_updates, size)
+            self._bytes += size
+            while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted[3]
+                self.evictions += 1
+
+    def invalidate(self, resources: Iterable[str]) -> None:
+        files = {name for name in resources if name.startswith('file:')}
+        if not files:
+            return
+        with self._lock:
+            for key in [k for k in self._entries if any(f[0] in files for f in k[1])]:
+                self._bytes -= self._entries.pop(key)[3]
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {'entries': len(self._entries), 'bytes': self._bytes, 'max_entries': self.max_entries,
+                    'max_bytes': self.max_bytes, 'hits': self.hits, 'misses': self.misses,
+                    'evictions': self.evictions}
+
+    def print_report(self) -> None:
+        info = self.to_dict()
+        total = info['hits'] + info['misses']
+        rate = info['hits'] / total * 100 if total else 0.0
+        print(f"🗃️ Cache: {info['entries']}/{info['max_entries']} mục, ~{info['bytes'] / 1024:.1f} KB")
+        print(f"   hit {info['hits']} | miss {info['misses']} ({rate:.1f}% hit) | bỏ {info['evictions']}")
+
+class VirtualAssistant:
+    # Số item tối đa nằm chờ giữa hai stage của pipeline
+    PIPE_BUFFER = 1024
+
+    def __init__(self, lazy_plugins: bool = False, parallel_plugins: bool = False,
+                 profile_imports: bool = False, process_plugins: Optional[Dict[str, int]] = None):
+        self._handlers = HandlerList()
+        self.index = CommandIndex()
+        self.loader = PluginLoader(lazy=lazy_plugins, parallel=parallel_plugins,
+                                   profile_imports=profile_imports, process=process_plugins)
+        self._context: Dict[str, Any] = {}
+        self.stats = CommandStats()
+        # Khóa tài nguyên, chỉ bật khi có chế độ chạy đồng thời (server, job nền, batch --jobs)
+        self.locks: Optional[ResourceLockManager] = None
+        self.jobs: Optional[JobRunner] = None
+        # Cache kết quả lệnh thuần, tắt mặc định
+        self.cache: Optional[ResultCache] = None
+        # Handler có shutdown() (vd excel lưu workbook đang mở) được gọi khi thoát
+        self._closed = False
+        atexit.register(self.shutdown)
+
+    @property
+    def last_status(self) -> str:
+        """Trạng thái lệnh vừa chạy: 'ok' hoặc 'unknown' (không handler nào nhận)"""
+        return _last_status.get()
+
+    @last_status.setter
+    def last_status(self, value: str) -> None:
+        _last_status.set(value)
+
+    @property
+    def context(self) -> Dict[str, Any]:
+        """context của session đang chạy lệnh (server mode), ngược lại là context chung"""
+        session = _session_context.get()
+        return self._context if session is None else session
+
+    @context.setter
+    def context(self, value: Dict[str, Any]) -> None:
+        self._context = value
+
+    @property
+    def handlers(self) -> HandlerList:
+        return self._handlers
+
+    @handlers.setter
+    def handlers(self, value: List[Any]) -> None:
+        self._handlers = HandlerList(value)
+        self.index.version = -1
+
+    def match_handlers(self, command: str):
+        """Duyệt các handler nhận lệnh, dùng chỉ mục tiền tố thay vì quét toàn bộ"""
+        handlers = self._handlers
+        if self.index.version != handlers.version:
+            self.index.build(handlers)
+            self.index.version = handlers.version
+        for pos in self.index.candidates(command):
+            handler = handlers[pos]
+            if handler.can_handle(command):
+                yield handler
+
+    def shutdown(self) -> None:
+        # Batch gọi trực tiếp rồi atexit gọi lại: chỉ dọn dẹp một lần
+        if self._closed:
+            return
+        self._closed = True
+        for handler in list(self._handlers):
+            if hasattr(handler, 'shutdown'):
+                try:
+                    handler.shutdown()
+                except Exception as e:
+                    print(f"⚠️ Lỗi khi đóng {type(handler).__name__}: {e}")
+
+    def enable_concurrency(self) -> None:
+        if self.locks is None:
+            self.locks = ResourceLockManager()
+
+    def resources_for(self, handler: Any, command: str) -> List[str]:
+        """
+        Tài nguyên lệnh sẽ đụng tới:
+        - handler có resources(command) -> dùng danh sách đó
+        - handler thread_safe = True -> không cần khóa
+        - còn lại -> một khóa riêng cho handler (chạy tuần tự như trước)
+        """
+        if hasattr(handler, 'resources'):
+            return list(handler.resources(command))
+        if getattr(handler, 'thread_safe', False):
+            return []
+        return [f"handler:{type(handler).__name__}:{id(handler)}"]
+
+    def run_handler(self, handler: Any, command: str):
+        """Gọi handler.handle, giữ khóa tài nguyên nếu đang ở chế độ đồng thời, dùng cache nếu bật"""
+        if self.locks is None and self.cache is None:
+            return handler.handle(command)
+        resources = self.resources_for(handler, command)
+        if self.locks is None:
+            return self._run_cached(handler, command, resources)
+        with self.locks.hold(resources):
+            return self._run_cached(handler, command, resources)
+
+    def _run_cached(self, handler: Any, command: str, resources: List[str]):
+        cache = self.cache
+        if cache is None:
+            return handler.handle(command)
+        is_pure = getattr(handler, 'is_pure', None)
+        if is_pure is None or not is_pure(command):
+            # Lệnh có thể ghi -> kết quả cũ của các file nó đụng tới không còn tin được
+            cache.invalidate(resources)
+            return handler.handle(command)
+        if _pipe_stage.get() is not None:
+            # Trong pipeline giá trị đi qua kênh, không phát lại được từ cache
+            return handler.handle(command)
+
+        key = cache.key(command, resources)
+        hit = cache.get(key)
+        if hit is not None:
+            value, output, context_updates = hit
+            if output:
+                sys.stdout.write(output)
+            self.context.update(context_updates)
+            return value
+
+        context = self.context
+        before = dict(context)
+        buffer = BufferSink()
+        try:
+            with self.output_to(buffer):
+                value = handler.handle(command)
+        finally:
+            output = buffer.getvalue()
+            if output:
+                sys.stdout.write(output)
+        if isinstance(value, CommandResult) and value.status != 'ok':
+            return value
+        context_updates = {k: v for k, v in context.items() if k not in before or before[k] is not v}
+        cache.put(key, value, output, context_updates)
+        return value
+
+    def result(self, status: str = 'ok', data: Any = None, message: Optional[str] = None) -> CommandResult:
+        """Tạo CommandResult cho handler (plugin không cần import module chính)"""
+        return CommandResult(status, data, message)
+
+    def pipe_input(self) -> Optional[Iterator[Any]]:
+        """Các giá trị stage trước gửi sang (lệnh đứng sau '|'), None nếu lệnh không nhận pipeline"""
+        stage = _pipe_stage.get()
+        if stage is None or stage.source is None:
+            return None
+        return iter(stage.source)
+
+    def emit(self, item: Any) -> bool:
+        """
+        Gửi một giá trị sang stage sau của pipeline.
+        Trả về False nếu không có stage sau -> handler tự in / trả về như bình thường.
+        """
+        stage = _pipe_stage.get()
+        if stage is None or stage.sink is None:
+            return False
+        stage.emitted = True
+        stage.sink.put(item)
+        return True
+
+    @contextlib.contextmanager
+    def output_to(self, sink: TextIO):
+        """Chuyển output (print của handler, message của kết quả) sang sink, chỉ trong context hiện tại"""
+        _install_context_stdout()
+        token = _output_target.set(sink)
+        try:
+            yield sink
+        finally:
+            _output_target.reset(token)
 
     def process_command(self, command: str):
+        """Chạy lệnh, trả về giá trị kiểu cũ (False = thoát, True/giá trị của handler)"""
+        return self.dispatch(command).value()
+
+    def execute(self, command: str) -> CommandResult:
+        """Chạy lệnh, luôn trả về CommandResult (exception -> status 'error')"""
+        try:
+            return self.dispatch(command)
+        except Exception as e:
+            self.last_status = 'error'
+            result = CommandResult('error', message=f"⚠️ Lỗi: {e}")
+            print(result.message)
+            return result
+
+    def dispatch(self, command: str) -> CommandResult:
         command = command.strip().lower()
-        
+        result = self._dispatch(command)
+        self.last_status = result.status
+        if result.message:
+            print(result.message)
+        return result
+
+    def _dispatch(self, command: str) -> CommandResult:
+        if self.loader.deferred:
+            self.loader.load_deferred(self)
+
         if command in ['exit', 'quit', 'thoát']:
-            print("👋 Tạm biệt!")
-            return False
-            
-        for handler in self.handlers:
-            if hasattr(handler, 'can_handle') and handler.can_handle(command):
-                if hasattr(handler, 'handle'):
-                    result = handler.handle(command)
-    
-                    # ✅ Nếu plugin KHÔNG return → giữ behavior cũ
-                    if result is None:
-                        return True
-    
-                    # ✅ Nếu plugin có return → dùng cho macro
+            return CommandResult('exit', message="👋 Tạm biệt!")
+
+        if command == 'startup profile':
+            self.loader.print_profile()
+            return CommandResult()
+
+        if command == 'stats' or command.startswith('stats '):
+            return self._stats_command(command[6:].strip())
+
+        if command.startswith('& '):
+            if self.jobs is None:
+                self.jobs = JobRunner(self)
+            job_id, _ = self.jobs.submit(command[2:])
+            return CommandResult(data=job_id, message=f"🧵 [job {job_id}] chạy nền: {command[2:].strip()}")
+
+        if command == 'cache' or command.startswith('cache '):
+            return self._cache_command(command[6:].strip())
+
+        if command == 'jobs':
+            running = dict(self.jobs.running) if self.jobs else {}
+            for job_id, cmd in sorted(running.items()):
+                print(f"🧵 [job {job_id}] {cmd}")
+            if not running:
+                print("Không có job nào đang chạy")
+            return CommandResult(data=running)
+
+        if '|' in command:
+            stages = self._pipeline_stages(command)
+            if stages is not None:
+                return self._run_pipeline(stages)
+
+        token = command.split(' ', 1)[0]
+        t0 = time.perf_counter()
+        for handler in self.match_handlers(command):
+            if hasattr(handler, 'handle'):
+                t1 = time.perf_counter()
+                try:
+                    result = self.run_handler(handler, command)
+                finally:
+                    self.stats.record(getattr(handler, 'stats_name', type(handler).__name__), token, t1 - t0, time.perf_counter() - t1)
+
+                if result is NOT_HANDLED:
+                    # Plugin lazy vừa nạp không nhận lệnh: danh sách handler đã đổi, dò lại từ đầu
+                    return self._dispatch(command)
+                if isinstance(result, CommandResult):
                     return result
-                    
-        print("🤷 Tôi không hiểu lệnh đó")
-        return True
+                # ✅ Nếu plugin KHÔNG return → giữ behavior cũ (None -> True)
+                # ✅ Nếu plugin có return → dùng cho macro
+                return CommandResult('ok', data=result)
+                
+        self.stats.record('<unknown>', token, time.perf_counter() - t0, 0.0)
+        return CommandResult('unknown', message="🤷 Tôi không hiểu lệnh đó")
+
+    def _run_pipeline(self, stages: List[str]) -> CommandResult:
+        """
+        Chạy 'a | b | c': mỗi stage một thread, nối bằng PipeChannel có giới hạn.
+        Stage gửi giá trị qua emit() (hoặc giá trị trả về nếu không emit), stage sau đọc pipe_input().
+        Kết quả: data của stage cuối, trạng thái lỗi đầu tiên nếu có stage lỗi.
+        """
+        if any(not stage for stage in stages):
+            return CommandResult('error', message="⚠️ Pipeline có stage rỗng")
+        channels = [PipeChannel(self.PIPE_BUFFER) for _ in stages[1:]]
+        pipe = [_PipeStage(channels[i - 1] if i > 0 else None, channels[i] if i < len(channels) else None)
+                for i in range(len(stages))]
+        results: List[Optional[CommandResult]] = [None] * len(stages)
+        # Khóa trước tài nguyên của mọi stage, theo thứ tự, để hai stage đụng cùng file không chờ nhau mãi
+        names = self._pipeline_resources(stages) if self.locks is not None else []
+        with (self.locks.hold(names) if self.locks is not None else contextlib.nullcontext()):
+            token = _held_resources.set(_held_resources.get() | frozenset(names))
+            try:
+                threads = []
+                for i in range(len(stages) - 1):
+                    ctx = contextvars.copy_context()
+                    thread = threading.Thread(target=ctx.run, name=f"asi86-pipe-{i}",
+                                              args=(self._run_stage, stages[i], pipe[i], results, i))
+                    thread.start()
+                    threads.append(thread)
+                contextvars.copy_context().run(self._run_stage, stages[-1], pipe[-1], results, len(stages) - 1)
+                for thread in threads:
+                    thread.join()
+            finally:
+                _held_resources.reset(token)
+        status = next((r.status for r in results if r is not None and r.status not in ('ok', 'exit')), 'ok')
+        last = results[-1]
+        return CommandResult(status, last.data if last is not None else None)
+
+    def _run_stage(self, command: str, stage: _PipeStage, results: List[Optional[CommandResult]],
+                   pos: int) -> None:
+        _pipe_stage.set(stage)
+        try:
+            result = self.execute(command)
+            results[pos] = result
+            if stage.sink is not None and not stage.emitted:
+                for item in _pipe_items(result.data):
+                    stage.sink.put(item)
+        finally:
+            if stage.source is not None:
+                stage.source.close()
+            if stage.sink is not None:
+                stage.sink.finish()
+
+    def _stage_handler(self, command: str) -> Any:
+        """Handler sẽ chạy command (nạp plugin lazy nếu cần), None nếu không có"""
+        for handler in self.match_handlers(command):
+            if not hasattr(handler, 'handle'):
+                continue
+            if isinstance(handler, LazyPluginHandler):
+                loaded = self.loader.load_lazy(handler, self)
+                handler = next((h for h in loaded if hasattr(h, 'handle') and h.can_handle(command)), handler)
+            return handler
+        return None
+
+    def _pipeline_stages(self, command: str) -> Optional[List[str]]:
+        """
+        Các stage nếu command là pipeline: mọi lệnh sau dấu | phải nhận dữ liệu từ pipeline
+        (_accepts_pipe, vd 'excel add -'). Ngược lại None -> cả dòng là một lệnh,
+        dấu | là dữ liệu (vd 'excel add a | b' thêm ba ô 'a', '|', 'b').
+        """
+        stages = _split_pipeline(command)
+        if len(stages) < 2:
+            return None
+        if not all(stage and self._accepts_pipe(stage) for stage in stages[1:]):
+            return None
+        return stages
+
+    def _accepts_pipe(self, command: str) -> bool:
+        """
+        Handler nhận command có đọc dữ liệu từ stage trước không: một trong các regex pipe_inputs của nó
+        khớp với lệnh. Plugin lazy chưa nạp dùng pipe_inputs trong manifest, không import chỉ để tách lệnh.
+        """
+        for handler in self.match_handlers(command):
+            if hasattr(handler, 'handle'):
+                return any(re.search(pattern, command) for pattern in getattr(handler, 'pipe_inputs', ()))
+        return False
+
+    def _pipeline_resources(self, stages: List[str]) -> List[str]:
+        names: List[str] = []
+        for command in stages:
+            handler = self._stage_handler(command)
+            if handler is not None:
+                names.extend(self.resources_for(handler, command))
+        return names
+
+    def _stats_command(self, args: str) -> CommandResult:
+        """stats | stats reset | stats save <file.json|file.prom>"""
+        if not args:
+            self.stats.print_report()
+            return CommandResult(data=self.stats.to_dict())
+        if args == 'reset':
+            self.stats.reset()
+            return CommandResult(message="🧹 Đã xóa thống kê")
+        if args.startswith('save '):
+            path = args[5:].strip()
+            self.stats.save(path)
+            return CommandResult(message=f"💾 Đã lưu thống kê vào {path}")
+        return CommandResult('error', message="⚠️ Cú pháp: stats | stats reset | stats save <file.json|file.prom>")
         
+    def enable_cache(self, max_entries: int = 256) -> ResultCache:
+        if self.cache is None:
+            self.cache = ResultCache(max_entries)
+        else:
+            self.cache.max_entries = max_entries
+        return self.cache
+
+    def _cache_command(self, args: str) -> CommandResult:
+        """cache | cache on [số_mục] | cache off | cache clear"""
+        if not args:
+            if self.cache is None:
+                return CommandResult(data=None, message="🗃️ Cache đang tắt (dùng 'cache on')")
+            self.cache.print_report()
+            return CommandResult(data=self.cache.to_dict())
+        if args == 'on' or args.startswith('on '):
+            try:
+                size = int(args[3:]) if args[3:].strip() else 256
+            except ValueError:
+                return CommandResult('error', message="⚠️ Cú pháp: cache on [số_mục]")
+            self.enable_cache(size)
+            return CommandResult(message=f"🗃️ Đã bật cache ({size} mục)")
+        if args == 'off':
+            self.cache = None
+            return CommandResult(message="🗃️ Đã tắt cache")
+        if args == 'clear':
+            if self.cache is not None:
+                self.cache.clear()
+            return CommandResult(message="🧹 Đã xóa cache")
+        return CommandResult('error', message="⚠️ Cú pháp: cache | cache on [số_mục] | cache off | cache clear")
+
     def run(self) -> None:
         """Vòng lặp chính"""
         print("🤖 Xin chào, tôi là trợ lý ảo (Asi-86)")
@@ -73,19 +1718,306 @@ class VirtualAssistant:
         while True:
             try:
                 user_input = input("Bạn: ")
-                if not self.process_command(user_input):
+                if self.process_command(user_input) is False:
                     break
-            except KeyboardInterrupt:
+            except (KeyboardInterrupt, EOFError):
+                # Ctrl+C / hết input (stdin được pipe vào): thoát thay vì lặp lại lỗi mãi
                 print("\n👋 Tạm biệt!")
                 break
             except Exception as e:
                 print(f"⚠️ Lỗi: {e}")
 
-def start():
+class BatchRunner:
+    """
+    Chạy lệnh không tương tác từ file hoặc stdin qua process_command.
+    - Không có lời chào/prompt; dòng trống và dòng bắt đầu bằng '#' bị bỏ qua
+    - quiet: bỏ output của handler; jsonl: mỗi lệnh một dòng JSON kết quả
+    - keep_going: lỗi (status 'error' hoặc 'unknown') không dừng batch
+    - jobs > 1: chạy đồng thời qua JobRunner (khóa theo tài nguyên), kết quả vẫn báo theo
+      thứ tự dòng; output thường được gắn nhãn '[job <id>]'. exit/quit dừng đọc thêm lệnh.
+    - Tổng kết số lệnh, số lỗi, thời gian và tốc độ ghi ra stderr
+    """
+
+    def __init__(self, assistant: 'VirtualAssistant', quiet: bool = False, jsonl: bool = False,
+                 keep_going: bool = False, out: Optional[TextIO] = None, err: Optional[TextIO] = None,
+                 jobs: int = 1):
+        self.assistant = assistant
+        self.quiet = quiet
+        self.jsonl = jsonl
+        self.keep_going = keep_going
+        self.out = out or _real_stdout()
+        self.err = err or sys.stderr
+        self.jobs = jobs
+        self.errors = 0
+
+    @staticmethod
+    def _commands(lines: Iterable[str]):
+        for lineno, raw in enumerate(lines, start=1):
+            command = raw.strip()
+            if command and not command.startswith('#'):
+                yield lineno, command
+
+    def _report(self, lineno: int, command: str, result: CommandResult, elapsed: float,
+                output: Optional[str] = None, job: Optional[int] = None) -> bool:
+        """Ghi kết quả một lệnh, trả về True nếu batch phải dừng"""
+        if self.jsonl:
+            record = {'line': lineno, 'command': command, 'status': result.status,
+                      'result': result.data, 'elapsed_ms': round(elapsed * 1000, 3)}
+            if job is not None:
+                record['job'] = job
+            if output is not None:
+                record['output'] = output
+            if result.status == 'error':
+                record['error'] = result.message
+            self.out.write(json.dumps(record, ensure_ascii=False, default=str) + '\n')
+        if result.status not in ('ok', 'exit'):
+            self.errors += 1
+            if not self.keep_going:
+                return True
+        return result.value() is False
+
+    def run(self, lines: Iterable[str]) -> int:
+        """Chạy toàn bộ lệnh, trả về số lệnh lỗi"""
+        self.errors = 0
+        t_start = time.perf_counter()
+        sink = NullSink() if self.quiet else self.out
+        with self.assistant.output_to(sink):
+            if self.jobs > 1:
+                count = self._run_jobs(self._commands(lines))
+            else:
+                count = self._run_serial(self._commands(lines))
+        total = time.perf_counter() - t_start
+        rate = count / total if total > 0 else 0.0
+        self.err.write(f"📊 Batch: {count} lệnh, {self.errors} lỗi, {total:.3f} s ({rate:.0f} lệnh/s)\n")
+        self.out.flush()
+        return self.errors
+
+    def _run_serial(self, commands) -> int:
+        count = 0
+        buffer = BufferSink() if self.jsonl and not self.quiet else None
+        for lineno, command in commands:
+            count += 1
+            t0 = time.perf_counter()
+            if buffer is not None:
+                with self.assistant.output_to(buffer):
+                    result = self.assistant.execute(command)
+            else:
+                result = self.assistant.execute(command)
+            elapsed = time.perf_counter() - t0
+            if self._report(lineno, command, result, elapsed, buffer.drain() if buffer else None):
+                break
+        return count
+
+    def _run_jobs(self, commands) -> int:
+        count = 0
+        runner = JobRunner(self.assistant, workers=self.jobs, stream=self.out)
+        pending: deque = deque()
+        stop = False
+
+        def collect() -> bool:
+            lineno, command, job_id, sink, future = pending.popleft()
+            result, elapsed = future.result()
+            output = sink.getvalue() if isinstance(sink, BufferSink) else None
+            return self._report(lineno, command, result, elapsed, output, job_id)
+
+        try:
+            for lineno, command in commands:
+                if command.lower() in ('exit', 'quit', 'thoát'):
+                    break
+                count += 1
+                if self.quiet:
+                    sink = NullSink()
+                elif self.jsonl:
+                    sink = BufferSink()
+                else:
+                    sink = None  # TaggedSink mặc định của JobRunner
+                job_id, future = runner.submit(command, sink)
+                pending.append((lineno, command, job_id, sink, future))
+                # Giới hạn số lệnh đang chờ để không đọc hết input vào bộ nhớ
+                while pending and (len(pending) > self.jobs * 4 or pending[0][4].done()):
+                    if collect():
+                        stop = True
+                        break
+                if stop:
+                    break
+            while pending:
+                collect()
+        finally:
+            runner.shutdown()
+        return count
+
+class AssistantServer:
+    """
+    Server asyncio giữ một VirtualAssistant đã nạp plugin, nhận lệnh theo dòng qua
+    Unix domain socket (hoặc TCP localhost) và trả về mỗi lệnh một dòng JSON.
+    - Mỗi kết nối có context riêng (assistant.context trỏ về context của session)
+    - Lệnh chạy trên thread pool nên lệnh chậm (excel...) không chặn client khác
+    - Xung đột được chặn bằng khóa tài nguyên (xem VirtualAssistant.resources_for)
+    """
+
+    def __init__(self, assistant: 'VirtualAssistant', path: Optional[str] = None,
+                 host: str = '127.0.0.1', port: Optional[int] = None, workers: Optional[int] = None):
+        self.assistant = assistant
+        self.path = path
+        self.host = host
+        self.port = port
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="asi86-worker")
+        assistant.enable_concurrency()
+
+    def _execute(self, session: Dict[str, Any], command: str) -> Dict[str, Any]:
+        """Chạy trong worker, bên trong một bản sao contextvars riêng cho lệnh này"""
+        buffer = BufferSink()
+        _session_context.set(session)
+        t0 = time.perf_counter()
+        with self.assistant.output_to(buffer):
+            result = self.assistant.execute(command)
+        record: Dict[str, Any] = {'command': command, 'status': result.status, 'result': result.data,
+                                  'elapsed_ms': round((time.perf_counter() - t0) * 1000, 3)}
+        if result.status == 'error':
+            record['error'] = result.message
+        record['output'] = buffer.getvalue()
+        return record
+
+    async def _handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        loop = asyncio.get_running_loop()
+        session: Dict[str, Any] = {}
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                command = line.decode('utf-8', errors='replace').strip()
+                if not command:
+                    continue
+                ctx = contextvars.copy_context()
+                record = await loop.run_in_executor(self.pool, ctx.run, self._execute, session, command)
+                writer.write((json.dumps(record, ensure_ascii=False, default=str) + '\n').encode('utf-8'))
+                await writer.drain()
+                # exit/quit chỉ đóng kết nối này, server vẫn chạy
+                if record['status'] == 'exit' or record['result'] is False:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self) -> None:
+        if self.port is not None:
+            server = await asyncio.start_server(self._handle_client, self.host, self.port)
+            where = f"{self.host}:{self.port}"
+        else:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            server = await asyncio.start_unix_server(self._handle_client, path=self.path)
+            where = self.path
+        print(f"🛰️ Server Asi-86 đang lắng nghe tại {where}", file=sys.stderr)
+        async with server:
+            await server.serve_forever()
+
+    def run(self) -> None:
+        _install_context_stdout()
+        try:
+            asyncio.run(self.serve())
+        except KeyboardInterrupt:
+            print("\n👋 Dừng server", file=sys.stderr)
+        finally:
+            self.pool.shutdown(wait=False)
+            if self.port is None and self.path and os.path.exists(self.path):
+                os.remove(self.path)
+
+def start(lazy_plugins: bool = False, parallel_plugins: bool = False, profile_imports: bool = False,
+          stats_file: Optional[str] = None, cache_size: Optional[int] = None,
+          process_plugins: Optional[Dict[str, int]] = None):
     """Tạo và khởi động trợ lý ảo"""
-    assistant = VirtualAssistant()
+    assistant = VirtualAssistant(lazy_plugins, parallel_plugins, profile_imports, process_plugins)
+    if stats_file:
+        atexit.register(assistant.stats.save, stats_file)
+    if cache_size:
+        assistant.enable_cache(cache_size)
     assistant.loader.load_plugins(assistant)
     assistant.run()
 
+class _ProcessArgAction(argparse.Action):
+    """--process excel_crud=2 -> {'excel_crud': 2}"""
+
+    def __call__(self, parser, namespace, values, option_string=None):
+        name, _, count = values.partition('=')
+        try:
+            workers = int(count) if count else 1
+        except ValueError:
+            parser.error(f"{option_string}: số worker không hợp lệ: {count}")
+        mapping = dict(getattr(namespace, self.dest) or {})
+        mapping[name[:-3] if name.endswith('.py') else name] = workers
+        setattr(namespace, self.dest, mapping)
+
+def build_arg_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        description="Trợ lý ảo Asi-86",
+        epilog="Pipeline: 'lệnh1 | lệnh2' (| có khoảng trắng hai bên, ngoài dấu nháy) chỉ chạy thành pipeline "
+               "khi mọi lệnh sau | nhận dữ liệu từ pipeline (pipe_inputs của handler), vd: "
+               "excel -f a.xlsx find X | excel -f b.xlsx add -. "
+               "Nếu không, cả dòng là một lệnh và | được giữ nguyên như dữ liệu.")
+    parser.add_argument('--lazy', action='store_true', help="chỉ import plugin khi có lệnh đầu tiên")
+    parser.add_argument('--parallel', action='store_true', help="import plugin song song")
+    parser.add_argument('--profile-startup', action='store_true', help="đo thời gian các import phụ thuộc")
+    parser.add_argument('--batch', nargs='?', const='-', metavar='FILE',
+                        help="chạy lệnh từ FILE (hoặc stdin nếu bỏ trống / '-') không tương tác")
+    parser.add_argument('--quiet', action='store_true', help="batch: ẩn output của handler")
+    parser.add_argument('--jsonl', action='store_true', help="batch: ghi kết quả mỗi lệnh dạng JSON lines")
+    parser.add_argument('--keep-going', action='store_true', help="batch: không dừng khi gặp lỗi")
+    parser.add_argument('--jobs', type=int, default=1, metavar='N',
+                        help="batch: chạy đồng thời N lệnh (khóa theo tài nguyên)")
+    parser.add_argument('--serve', nargs='?', const='asi86.sock', metavar='SOCKET',
+                        help="chạy server nhận lệnh qua Unix socket (mặc định asi86.sock)")
+    parser.add_argument('--port', type=int, help="server: dùng TCP 127.0.0.1:PORT thay cho Unix socket")
+    parser.add_argument('--workers', type=int, help="server: số thread xử lý lệnh")
+    parser.add_argument('--process', action=_ProcessArgAction, default={}, metavar='PLUGIN[=N]',
+                        help="chạy plugin trong N worker process (mặc định 1), lặp lại được; "
+                             "plugin giữ trạng thái (vd excel_crud) chỉ chạy 1 worker")
+    parser.add_argument('--cache', nargs='?', type=int, const=256, metavar='N',
+                        help="cache kết quả lệnh chỉ đọc (tối đa N mục, mặc định 256)")
+    parser.add_argument('--stats-file', metavar='FILE',
+                        help="ghi thống kê độ trễ khi thoát (.json hoặc Prometheus text)")
+    return parser
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = build_arg_parser().parse_args(argv)
+    if args.serve is not None or args.port is not None:
+        assistant = VirtualAssistant(args.lazy, args.parallel, args.profile_startup, args.process)
+        if args.stats_file:
+            atexit.register(assistant.stats.save, args.stats_file)
+        if args.cache:
+            assistant.enable_cache(args.cache)
+        assistant.loader.load_plugins(assistant)
+        AssistantServer(assistant, path=args.serve or 'asi86.sock', port=args.port,
+                        workers=args.workers).run()
+        return 0
+    if args.batch is None:
+        start(args.lazy, args.parallel, args.profile_startup, args.stats_file, args.cache, args.process)
+        return 0
+    # Mở nguồn lệnh trước khi nạp plugin (plugin macro bọc lại sys.stdin)
+    source = sys.stdin if args.batch == '-' else open(args.batch, 'r', encoding='utf-8')
+    try:
+        assistant = VirtualAssistant(args.lazy, args.parallel, args.profile_startup, args.process)
+        if args.stats_file:
+            atexit.register(assistant.stats.save, args.stats_file)
+        if args.cache:
+            assistant.enable_cache(args.cache)
+        # Output lúc nạp plugin không được lẫn vào luồng JSONL
+        startup_sink = NullSink() if args.quiet else (sys.stderr if args.jsonl else _real_stdout())
+        with assistant.output_to(startup_sink):
+            assistant.loader.load_plugins(assistant)
+        runner = BatchRunner(assistant, quiet=args.quiet, jsonl=args.jsonl, keep_going=args.keep_going,
+                             jobs=args.jobs)
+        errors = runner.run(source)
+        # Dọn dẹp (lưu workbook...) ngay tại đây để output không lẫn vào luồng JSONL
+        with assistant.output_to(startup_sink):
+            assistant.loader.shutdown_workers()
+            assistant.shutdown()
+    finally:
+        if source is not sys.stdin:
+            source.close()
+    return 1 if errors else 0
+
 if __name__ == "__main__":
-    start()
+    sys.exit(main())
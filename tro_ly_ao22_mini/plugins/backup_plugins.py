@@ -95,4 +95,5 @@ def register(assistant):
     assistant.handlers.append(BackupPluginHandler(assistant))
 
 
-plugin_info = {'enabled': True, 'register': register}
+# defer: không có lệnh nào; chế độ lazy chỉ hash file và chạy watcher khi có lệnh đầu tiên
+plugin_info = {'enabled': True, 'register': register, 'defer': True}
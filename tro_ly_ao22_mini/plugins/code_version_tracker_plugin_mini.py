@@ -57,6 +57,7 @@ def track_code_changes(filepath):
             f.write(current_hash)
 
 
-plugin_info = {'enabled': True, 'register': plugin_register, 'methods': [],
+# defer: không có lệnh nào; chế độ lazy chỉ hash mã chính khi có lệnh đầu tiên
+plugin_info = {'enabled': True, 'register': plugin_register, 'defer': True, 'methods': [],
     'classes': [], 'description':
     'Lưu trữ bản sao của mã chính phục vụ fallback'}
@@ -3,35 +3,2159 @@
 # thêm chức năng 
 # thêm chức năng ghi công thức cho ô
 import os
+import bisect
+import contextlib
+import copy
+import csv
+import datetime
+import glob
+import io
+import json
+import heapq
+import math
+import pickle
+import re
+import sys
 import shlex
+import hashlib
+import importlib.util
+import shutil
+import tempfile
+import functools
+import itertools
+import threading
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import openpyxl
 from openpyxl import Workbook, load_workbook
+from openpyxl.cell.cell import Cell
 from openpyxl.comments import Comment
 from openpyxl.styles import PatternFill
-import matplotlib.pyplot as plt
+from openpyxl.utils import column_index_from_string, get_column_letter
 
 def with_worksheet(func):
     """
     Decorator tự động:
-    - Load workbook từ self.file (nếu chưa có thì báo lỗi)
+    - Lấy workbook của self.file từ WorkbookCache (chỉ load khi chưa mở hoặc file đổi trên đĩa)
     - Lấy active worksheet
     - Gọi func với tham số ws đầu tiên
-    - Tự động save workbook sau khi func chạy (nếu không có lỗi)
+    - Đánh dấu workbook cần save sau khi func chạy (nếu không có lỗi), trừ lệnh @pure;
+      việc save thật diễn ra khi excel flush, khi workbook bị đẩy khỏi cache hoặc khi thoát
+      (trong worker process: save ngay sau lệnh, xem WorkbookCache.write_through)
+    - Trong transaction (excel begin): lệnh lỗi làm hỏng cả transaction, chỉ còn rollback được
     """
+    @functools.wraps(func)
     def wrapper(self, *args, **kwargs):
         if not self.file:
             raise Exception("Chưa chỉ định file. Dùng -f <file> hoặc lệnh setfile")
         if not os.path.exists(self.file):
             raise Exception(f"File không tồn tại: {self.file}")
-        wb = load_workbook(self.file)
+        tx = self.books.tx_state(self.file)
+        if tx == 'aborted':
+            raise Exception(f"Transaction trên {self.file} đã hỏng do lệnh lỗi, dùng excel rollback")
+        was_dirty = self.books.is_dirty(self.file)
+        wb = self.books.get(self.file)
         ws = wb.active
         try:
             result = func(self, ws, *args, **kwargs)
-            wb.save(self.file)
-            return result
+        except Exception:
+            if getattr(func, 'pure', False):
+                raise
+            if tx == 'active':
+                self.books.abort(self.file)
+                print(f"⚠️ Lệnh lỗi trong transaction: mọi thay đổi trên {self.file} sẽ bị rollback")
+            elif was_dirty:
+                self.books.mark_dirty(self.file, wb)
+                print(f"⚠️ Lệnh lỗi, workbook {self.file} có thể đã bị sửa một phần (chưa lưu)")
+            else:
+                # Không save nếu có lỗi: bỏ bản trong bộ nhớ, lần sau load lại từ file
+                self.books.discard(self.file)
+            raise
+        if not getattr(func, 'pure', False):
+            self.books.mark_dirty(self.file, wb, incremental=getattr(func, 'incremental', False))
+        return result
+    return wrapper
+
+def _check_readable(self):
+    if not self.file:
+        raise Exception("Chưa chỉ định file. Dùng -f <file> hoặc lệnh setfile")
+    if not os.path.exists(self.file):
+        raise Exception(f"File không tồn tại: {self.file}")
+    if self.books.tx_state(self.file) == 'aborted':
+        raise Exception(f"Transaction trên {self.file} đã hỏng do lệnh lỗi, dùng excel rollback")
+
+def read_worksheet(func):
+    """
+    Decorator cho lệnh chỉ đọc dữ liệu theo dòng (read, find, chart):
+    - Workbook đang mở trong cache (có thể có thay đổi chưa lưu / transaction) -> đọc bản trong bộ nhớ
+    - Ngược lại stream từ file bằng load_workbook(read_only=True): bộ nhớ không phụ thuộc số dòng.
+      Ô công thức trả về chuỗi công thức như bản trong cache (không dùng data_only: file do openpyxl
+      ghi không lưu giá trị đã tính, ô sẽ thành None)
+    - Không bao giờ save, mtime của file giữ nguyên
+    Trong lệnh chỉ dùng ws.iter_rows(...), không dùng ws.cell() (rất chậm ở chế độ read_only).
+    """
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        _check_readable(self)
+        wb = self.books.peek(self.file)
+        if wb is not None:
+            return func(self, wb.active, *args, **kwargs)
+        wb = load_workbook(self.file, read_only=True)
+        try:
+            return func(self, wb.active, *args, **kwargs)
+        finally:
+            wb.close()
+    return wrapper
+
+def with_columns(func):
+    """
+    Decorator cho lệnh tính toán số (stat, avg, median...): gọi func với SheetColumns
+    của sheet hiện tại thay cho ws. Cột được trích một lần và dùng lại tới khi workbook thay đổi.
+    """
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        _check_readable(self)
+        return func(self, self.books.columns(self.file), *args, **kwargs)
+    return wrapper
+
+def pure(func):
+    """
+    Đánh dấu lệnh chỉ đọc: không save lại file, kết quả được cache
+    khi trợ lý bật cache (chỉ phụ thuộc nội dung file và tham số).
+    Đặt dưới @with_worksheet / @read_worksheet.
+    """
+    func.pure = True
+    return func
+
+def incremental(func):
+    """
+    Đánh dấu lệnh sửa ô tự báo từng ô đã ghi cho SheetIndex và FormulaEngine
+    (qua self.books.trackers), để workbook không phải bỏ chúng sau lệnh.
+    Lệnh sửa khác (xóa dòng, sort...) làm index / công thức dựng lại ở lần dùng sau.
+    """
+    func.incremental = True
+    return func
+
+def atomic_save(wb, path):
+    """Ghi ra file tạm cùng thư mục rồi rename đè file gốc: file trên đĩa không bao giờ bị ghi dở"""
+    path = os.path.abspath(path)
+    directory, name = os.path.split(path)
+    fd, tmp = tempfile.mkstemp(prefix=f".{name}.", suffix=".tmp", dir=directory)
+    os.close(fd)
+    try:
+        wb.save(tmp)
+        if os.path.exists(path):
+            shutil.copymode(path, tmp)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+
+def sidecar_path(path):
+    """File sidecar của workbook: .<tên>.cols.npz cùng thư mục (cột số đã trích, dùng lại giữa các lần chạy)"""
+    directory, name = os.path.split(os.path.abspath(path))
+    return os.path.join(directory, f".{name}.cols.npz")
+
+def file_digest(path):
+    """Hash nội dung file (blake2b), để nhận ra sidecar còn đúng khi file chỉ đổi mtime (copy, checkout...)"""
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+# Khoảng phiên bản openpyxl đã kiểm thử (như requirements.txt). Trong khoảng này các thao tác dời ô
+# (compact_sheet, transpose_sheet, sort trong bộ nhớ) sửa thẳng ws._cells / ws._current_row cho nhanh;
+# ngoài khoảng đó chỉ dùng API công khai (delete_rows, _relocate): chậm hơn nhưng không phụ thuộc cấu trúc nội bộ.
+OPENPYXL_TESTED = ((3, 1), (3, 2))
+
+def _version_tuple(text):
+    return tuple(int(x) for x in re.findall(r'\d+', text)[:2])
+
+FAST_CELLS = OPENPYXL_TESTED[0] <= _version_tuple(openpyxl.__version__) < OPENPYXL_TESTED[1]
+
+# Thuộc tính định dạng (công khai) của ô, chép sang ô mới khi dời ô bằng _relocate
+STYLE_ATTRS = ('font', 'fill', 'border', 'alignment', 'number_format', 'protection')
+
+def sheet_cells(ws):
+    """(hàng, cột) -> Cell của các ô đã có trong ws, không tạo thêm ô như ws.cell / iter_rows"""
+    if FAST_CELLS:
+        return ws._cells
+    return {(cell.row, cell.column): cell for row in ws.iter_rows() for cell in row}
+
+def coordinate_features(ws):
+    """
+    Những thứ trong ws ghi theo tọa độ mà việc dời ô thẳng trong ws._cells không sửa theo:
+    merged cell, conditional formatting, data validation, bảng (table), công thức.
+    Hyperlink và comment đi theo ô nên không tính. Danh sách rỗng -> dời ô thẳng được.
+    """
+    found = []
+    if ws.merged_cells.ranges:
+        found.append('merged cell')
+    if ws.conditional_formatting:
+        found.append('conditional formatting')
+    if ws.data_validations.dataValidation:
+        found.append('data validation')
+    if ws.tables:
+        found.append('table')
+    if any(cell.data_type == 'f' for cell in sheet_cells(ws).values()):
+        found.append('công thức')
+    return found
+
+def _index_runs(indices):
+    """Các khoảng liên tiếp (đầu, số lượng) của dãy chỉ số đã sắp xếp, khoảng cuối trước"""
+    runs = []
+    for i in indices:
+        if runs and runs[-1][0] + runs[-1][1] == i:
+            runs[-1][1] += 1
+        else:
+            runs.append([i, 1])
+    return reversed(runs)
+
+def _sync_hyperlinks(cells):
+    """Hyperlink giữ tọa độ lúc gán (Hyperlink.ref), không tự đi theo ô khi ô bị dời"""
+    for cell in cells:
+        if cell.hyperlink is not None:
+            cell.hyperlink.ref = cell.coordinate
+
+def _relocate(ws, target):
+    """
+    Dời ô chỉ bằng API công khai: target(hàng, cột) -> (hàng, cột) mới, hoặc None để bỏ ô.
+    Chép giá trị, định dạng, hyperlink, comment sang ô mới rồi xóa mọi ô cũ bằng delete_rows.
+    """
+    moved = []
+    for (r, c), cell in list(sheet_cells(ws).items()):
+        comment = cell.comment
+        if comment is not None:
+            cell.comment = None   # comment chỉ gắn được vào một ô
+        to = target(r, c)
+        if to is not None:
+            style = [(name, copy.copy(getattr(cell, name))) for name in STYLE_ATTRS] if cell.has_style else []
+            moved.append((to, cell.value, style, cell.hyperlink, comment))
+    if ws.max_row:
+        ws.delete_rows(1, ws.max_row)
+    for (r, c), value, style, hyperlink, comment in moved:
+        cell = ws.cell(row=r, column=c)
+        cell.value = value
+        for name, v in style:
+            setattr(cell, name, v)
+        if hyperlink is not None:
+            cell.hyperlink = hyperlink   # setter đặt lại hyperlink.ref theo ô mới
+        if comment is not None:
+            cell.comment = comment
+
+def _place(ws, cells):
+    """Thay ws._cells bằng dict ô đã dời (đường nhanh FAST_CELLS), cập nhật hyperlink.ref và dòng append"""
+    _sync_hyperlinks(cells.values())
+    ws._cells = cells
+    ws._current_row = ws.max_row if cells else 0   # append() ghi tiếp sau dòng này
+
+def compact_sheet(ws, rows=(), cols=()):
+    """
+    Xóa nhiều dòng/cột của ws trong một lượt, chỉ số tính theo sheet trước khi xóa.
+    Mỗi ô còn lại được dời đúng một lần, thay cho gọi delete_rows/delete_cols từng cái
+    (mỗi lần gọi dời mọi ô phía sau -> O(n²) khi xóa nhiều).
+    Ô mang theo giá trị/style/comment/hyperlink. Sheet có coordinate_features (merged cell, công thức...)
+    hoặc openpyxl ngoài khoảng đã kiểm thử: xóa bằng delete_rows/delete_cols của openpyxl như trước,
+    mỗi khoảng liên tiếp một lần, từ cuối lên (merged cell và công thức vẫn không được sửa, như openpyxl).
+    Trả về (số dòng, số cột) đã xóa.
+    """
+    drop_rows = sorted(set(rows))
+    drop_cols = sorted(set(cols))
+    if not drop_rows and not drop_cols:
+        return 0, 0
+    if not FAST_CELLS or coordinate_features(ws):
+        for start, count in _index_runs(drop_rows):
+            ws.delete_rows(start, count)
+        for start, count in _index_runs(drop_cols):
+            ws.delete_cols(start, count)
+        _sync_hyperlinks(sheet_cells(ws).values())
+        return len(drop_rows), len(drop_cols)
+    row_set, col_set = set(drop_rows), set(drop_cols)
+    new_row, new_col = {}, {}
+
+    def target(r, c):
+        if r in row_set or c in col_set:
+            return None
+        nr = new_row.get(r)
+        if nr is None:
+            nr = new_row[r] = r - bisect.bisect_left(drop_rows, r)
+        nc = new_col.get(c)
+        if nc is None:
+            nc = new_col[c] = c - bisect.bisect_left(drop_cols, c)
+        return nr, nc
+
+    cells = {}
+    # ws._cells: (hàng, cột) -> Cell, cấu trúc mà delete_rows/_move_cell của openpyxl cũng dời
+    for (r, c), cell in ws._cells.items():
+        to = target(r, c)
+        if to is None:
+            continue
+        if to != (r, c):
+            cell.row, cell.column = to
+        cells[to] = cell
+    _place(ws, cells)
+    return len(drop_rows), len(drop_cols)
+
+def transpose_sheet(ws):
+    """
+    Chuyển vị ws trong một lượt: đổi (hàng, cột) của từng ô có sẵn, không đọc/ghi lại từng ô và không tạo ô mới.
+    Ô mang theo giá trị và định dạng; độ rộng cột / chiều cao dòng giữ nguyên.
+    Sheet có coordinate_features (merged cell, công thức...): như transpose trước đây, đọc giá trị,
+    xóa hết dòng rồi ghi lại giá trị đã chuyển vị (định dạng và các vùng theo tọa độ không đi theo).
+    """
+    if coordinate_features(ws):
+        data = [list(row) for row in ws.iter_rows(values_only=True)]
+        ws.delete_rows(1, ws.max_row)
+        for r, row in enumerate(data, start=1):
+            for c, value in enumerate(row, start=1):
+                if value is not None:
+                    ws.cell(row=c, column=r).value = value
+        return
+    if not FAST_CELLS:
+        _relocate(ws, lambda r, c: (c, r))
+        return
+    cells = {}
+    for (r, c), cell in ws._cells.items():
+        cell.row, cell.column = c, r
+        cells[c, r] = cell
+    _place(ws, cells)
+
+def filled_rows(ws):
+    """Tập các dòng có ít nhất một ô khác None"""
+    return {r for (r, _), cell in sheet_cells(ws).items() if cell.value is not None}
+
+def parse_index_ranges(args, pairs=False):
+    """
+    Danh sách chỉ số từ tham số dạng N, A-B hoặc A:B (vd: 3 7-9 -> 3,7,8,9).
+    pairs=True: các số đơn đi theo cặp <đầu> <cuối> (cú pháp cũ của delrows).
+    """
+    result = []
+    singles = []
+    for arg in args:
+        for sep in ('-', ':'):
+            if sep in arg.strip(sep):
+                a, b = arg.split(sep, 1)
+                start, end = int(a), int(b)
+                if start > end:
+                    start, end = end, start
+                result.extend(range(start, end + 1))
+                break
+        else:
+            singles.append(int(arg))
+    if pairs:
+        if len(singles) % 2:
+            raise ValueError("số đầu/cuối phải đi theo cặp")
+        for start, end in zip(singles[::2], singles[1::2]):
+            result.extend(range(min(start, end), max(start, end) + 1))
+    else:
+        result.extend(singles)
+    if any(i < 1 for i in result):
+        raise ValueError("chỉ số phải >= 1")
+    return result
+
+def _sort_value(v):
+    """
+    Khóa so sánh có kiểu của một ô (thứ tự như Excel): số < ngày giờ < giờ < chữ (không phân biệt
+    hoa thường) < TRUE/FALSE < loại khác. Ô trống (None, '') trả về None, luôn xếp cuối.
+    """
+    if v is None or v == '':
+        return None
+    if isinstance(v, bool):
+        return (4, v)
+    if isinstance(v, (int, float)):
+        return (0, v)
+    if isinstance(v, datetime.datetime):
+        return (1, v)
+    if isinstance(v, datetime.date):
+        return (1, datetime.datetime.combine(v, datetime.time()))
+    if isinstance(v, datetime.time):
+        return (2, v)
+    if isinstance(v, datetime.timedelta):
+        return (0, v.total_seconds() / 86400)   # Excel lưu khoảng thời gian dạng số ngày
+    if isinstance(v, str):
+        return (3, v.casefold())
+    return (5, str(v))
+
+def _item_value(item, index):
+    return item[index] if index < len(item) else None
+
+def sort_rows(items, keys):
+    """
+    Sắp xếp tại chỗ (ổn định) các dòng theo nhiều khóa keys = [(vị trí, desc), ...], khóa đầu ưu tiên nhất.
+    Mỗi khóa một lượt list.sort từ khóa cuối lên (sort của Python ổn định), so sánh tuple trong C.
+    """
+    for index, desc in reversed(keys):
+        if desc:
+            # reverse=True đảo cả thứ tự ô trống -> đánh dấu ô có dữ liệu = 1 để ô trống vẫn ở cuối
+            def key(item, index=index):
+                v = _sort_value(_item_value(item, index))
+                return (0, 0, 0) if v is None else (1, *v)
+        else:
+            def key(item, index=index):
+                v = _sort_value(_item_value(item, index))
+                return (1, 0, 0) if v is None else (0, *v)
+        items.sort(key=key, reverse=desc)
+    return items
+
+class _RowKey:
+    """Khóa của một dòng khi merge các run: cùng thứ tự với sort_rows (asc/desc riêng từng khóa, ô trống cuối)"""
+    __slots__ = ('parts', 'keys')
+
+    def __init__(self, item, keys):
+        self.parts = [_sort_value(_item_value(item, index)) for index, _ in keys]
+        self.keys = keys
+
+    def __eq__(self, other):
+        # heapq.merge so sánh [khóa, số thứ tự run, ...]: khóa bằng nhau thì run trước ra trước (ổn định)
+        return self.parts == other.parts
+
+    def __lt__(self, other):
+        for a, b, (_, desc) in zip(self.parts, other.parts, self.keys):
+            if a == b:
+                continue
+            if a is None:
+                return False
+            if b is None:
+                return True
+            return a > b if desc else a < b
+        return False
+
+def external_sort(rows, keys, run_rows):
+    """
+    Sắp xếp ngoài: chia rows thành các run run_rows dòng, sort từng run rồi ghi ra file tạm (pickle),
+    sau đó merge các run (heapq.merge). Bộ nhớ ~ một run + một dòng mỗi run. Generator, ổn định.
+    """
+    runs = []
+    try:
+        while True:
+            chunk = list(itertools.islice(rows, run_rows))
+            if not chunk:
+                break
+            sort_rows(chunk, keys)
+            f = tempfile.TemporaryFile(prefix='excel_sort_')
+            runs.append(f)
+            pickler = pickle.Pickler(f, pickle.HIGHEST_PROTOCOL)
+            for item in chunk:
+                pickler.dump(item)
+            f.seek(0)
+            del chunk
+        yield from heapq.merge(*(_read_run(f) for f in runs), key=lambda item: _RowKey(item, keys))
+    finally:
+        for f in runs:
+            f.close()
+
+def _read_run(f):
+    unpickler = pickle.Unpickler(f)
+    while True:
+        try:
+            yield unpickler.load()
+        except EOFError:
+            return
+
+# Số dòng đầu dùng để đoán kiểu từng cột khi import
+IMPORT_SAMPLE_ROWS = 200
+
+def _text_rows(lines, sep):
+    """Dòng văn bản -> list ô: sep None = tách theo khoảng trắng, ngược lại dùng csv (hiểu dấu ngoặc kép)"""
+    if sep is None:
+        return (line.split() for line in lines if line.strip())
+    return (row for row in csv.reader(lines, delimiter=sep) if row)
+
+def _guess_separator(first_line, path=None):
+    """Đoán dấu phân cách: theo đuôi file (.csv/.tsv), không thì theo dòng đầu; None = khoảng trắng"""
+    ext = os.path.splitext(path or '')[1].lower()
+    if ext == '.csv':
+        return ','
+    if ext == '.tsv' or '\t' in first_line:
+        return '\t'
+    if ';' in first_line and ',' not in first_line:
+        return ';'
+    if ',' in first_line:
+        return ','
+    return None
+
+def _cell_kind(text):
+    """Kiểu của một ô chữ: 'int' | 'float' | 'str' (nan/inf coi là chữ)"""
+    try:
+        int(text)
+        return 'int'
+    except ValueError:
+        pass
+    try:
+        return 'float' if math.isfinite(float(text)) else 'str'
+    except ValueError:
+        return 'str'
+
+def _infer_column_kinds(rows):
+    """
+    Kiểu từng cột ('int' | 'float' | 'str') từ các dòng mẫu, theo đa số ô không trống: vài dòng
+    lạc (header, ghi chú đầu file) không kéo cả cột thành chữ, converter giữ nguyên các ô đó.
+    Dòng đầu (có thể là header) không dùng để đoán khi có dòng khác; cột không có ô nào là chữ.
+    """
+    n_cols = max((len(row) for row in rows), default=0)
+    counts = [{'int': 0, 'float': 0, 'str': 0} for _ in range(n_cols)]
+    for row in (rows[1:] if len(rows) > 1 else rows):
+        for j, text in enumerate(row):
+            if text:
+                counts[j][_cell_kind(text)] += 1
+    kinds = []
+    for c in counts:
+        if c['int'] + c['float'] <= c['str']:
+            kinds.append('str')
+        else:
+            kinds.append('float' if c['float'] else 'int')
+    return kinds
+
+def _column_converter(kind):
+    """Hàm đổi chuỗi -> giá trị ô cho một cột, chọn một lần theo kiểu đã đoán"""
+    if kind == 'str':
+        return None
+    cast = int if kind == 'int' else float
+
+    def convert(text):
+        try:
+            return cast(text)
+        except ValueError:   # ô lạc kiểu (header, ghi chú...): giữ nguyên chuỗi/số thực
+            kind = _cell_kind(text)
+            return float(text) if kind == 'float' else text
+    return convert
+
+
+class SheetColumns:
+    """
+    Dữ liệu sheet dạng mảng NumPy (n_dòng x n_cột), trích một lần cho các lệnh tính toán:
+    - values: float64, NaN nếu ô không đổi được float()
+    - numeric: ô đổi được float() (kể cả chuỗi số); native: ô vốn là int/float
+    - null: ô trống; text = không trống nhưng không phải số
+    - header: nội dung dòng 1 dạng chữ (None nếu trống), để tìm cột theo tên (vd Close)
+    Ô công thức lấy giá trị đã tính (formulas: hàm trả về FormulaEngine, chỉ gọi khi gặp công thức).
+    Dòng i của mảng là dòng i+1 của sheet.
+    """
+    # Phiên bản định dạng sidecar, tăng khi đổi cách trích để sidecar cũ bị bỏ qua
+    SIDECAR_VERSION = 4
+
+    def __init__(self, ws, formulas=None):
+        self._extract(list(ws.iter_rows(values_only=True)), formulas)
+
+    @classmethod
+    def from_rows(cls, rows):
+        """Từ các dòng giá trị đã có sẵn (vd: sheet_values)"""
+        self = cls.__new__(cls)
+        self._extract(rows, None)
+        return self
+
+    def _extract(self, rows, formulas):
+        engine = None
+        self.header = [None if v is None else str(v) for v in rows[0]] if rows else []
+        n_rows = len(rows)
+        n_cols = max((len(r) for r in rows), default=0)
+        self.values = np.full((n_rows, n_cols), np.nan)
+        self.numeric = np.zeros((n_rows, n_cols), dtype=bool)
+        self.native = np.zeros((n_rows, n_cols), dtype=bool)
+        self.null = np.ones((n_rows, n_cols), dtype=bool)
+        values, numeric, native, null = self.values, self.numeric, self.native, self.null
+        for i, row in enumerate(rows):
+            for j, val in enumerate(row):
+                if val is None:
+                    continue
+                if formulas is not None and is_formula(val):
+                    if engine is None:
+                        engine = formulas()
+                    val = engine.value(i + 1, j + 1)
+                    if val is None:
+                        continue
+                null[i, j] = False
+                if isinstance(val, (int, float)):
+                    native[i, j] = True
+                try:
+                    values[i, j] = float(val)
+                    numeric[i, j] = True
+                except (ValueError, TypeError, OverflowError):
+                    pass
+
+    @classmethod
+    def from_arrays(cls, values, flags, header=()):
+        """Dựng lại từ values + flags (bit 0 numeric, bit 1 native, bit 2 null) đọc từ sidecar"""
+        self = cls.__new__(cls)
+        self.header = list(header)
+        self.values = values
+        self.numeric = (flags & 1).astype(bool)
+        self.native = (flags & 2).astype(bool)
+        self.null = (flags & 4).astype(bool)
+        return self
+
+    def save_sidecar(self, path, meta: dict) -> None:
+        """Ghi sidecar (npz không nén) kèm meta (hash, mtime_ns, size của file nguồn); ghi atomic"""
+        flags = (self.numeric.astype(np.uint8) | (self.native.astype(np.uint8) << 1)
+                 | (self.null.astype(np.uint8) << 2))
+        meta = dict(meta, version=self.SIDECAR_VERSION, header=self.header)
+        directory, name = os.path.split(path)
+        fd, tmp = tempfile.mkstemp(prefix=f"{name}.", suffix=".tmp", dir=directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(f, values=self.values, flags=flags, meta=np.array(json.dumps(meta)))
+            os.replace(tmp, path)
+        except BaseException:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            raise
+
+    @classmethod
+    def read_sidecar_meta(cls, path):
+        """Meta của sidecar, None nếu không có / hỏng / khác phiên bản"""
+        try:
+            with np.load(path) as data:
+                meta = json.loads(str(data['meta']))
+        except Exception:   # không có file, zip hỏng, thiếu meta... -> coi như không có sidecar
+            return None
+        return meta if meta.get('version') == cls.SIDECAR_VERSION else None
+
+    @classmethod
+    def load_sidecar(cls, path):
+        with np.load(path) as data:
+            meta = json.loads(str(data['meta']))
+            return cls.from_arrays(data['values'], data['flags'], meta.get('header', ()))
+
+    @property
+    def text(self):
+        return ~self.null & ~self.numeric
+
+    def column(self, col: int, start: int = 1, end: int = None):
+        """(values, numeric, native, null) của cột col (từ 1), dòng start..end của sheet"""
+        n_rows, n_cols = self.values.shape
+        start = max(start, 1)
+        end = n_rows if end is None else min(end, n_rows)
+        rows = slice(start - 1, max(end, start - 1))
+        if 1 <= col <= n_cols:
+            c = col - 1
+            return self.values[rows, c], self.numeric[rows, c], self.native[rows, c], self.null[rows, c]
+        length = max(end - start + 1, 0)
+        return (np.full(length, np.nan), np.zeros(length, dtype=bool),
+                np.zeros(length, dtype=bool), np.ones(length, dtype=bool))
+
+
+_TOKEN_RE = re.compile(r'\w+')
+
+def text_matches(text, keyword, mode='substring'):
+    """Ô (đã str) có khớp từ khóa không: exact = cả ô, prefix = ô hoặc một từ trong ô bắt đầu bằng từ khóa"""
+    if mode == 'exact':
+        return text == keyword
+    if mode == 'prefix':
+        return text.startswith(keyword) or any(tok.startswith(keyword) for tok in _TOKEN_RE.findall(text))
+    return keyword in text
+
+
+class SheetIndex:
+    """
+    Chỉ mục ngược của sheet cho find / find_replace (phân biệt hoa thường như find):
+    - exact: nội dung ô -> các ô; tokens: từ (\\w+) -> các ô; grams: chuỗi 3 ký tự -> các ô
+    - Truy vấn chỉ duyệt danh sách ô của từ khóa (giao các 3-gram với substring), rồi kiểm tra lại
+      bằng text_matches, nên thời gian theo số ô khớp chứ không theo kích thước sheet
+    - set() cập nhật từng ô khi add / update / find_replace sửa ô
+    Ô được giữ theo khóa (hàng, cột).
+    """
+    GRAM = 3
+
+    def __init__(self, ws):
+        self.texts = {}     # (hàng, cột) -> str(giá trị)
+        self.exact = {}
+        self.tokens = {}
+        self.grams = {}
+        self._sorted_texts = None    # danh sách đã sắp xếp cho prefix, dựng lại khi có khóa mới
+        self._sorted_tokens = None
+        for key, cell in sheet_cells(ws).items():
+            if cell.value is not None:
+                self._link(key, str(cell.value))
+
+    def _grams_of(self, text):
+        n = self.GRAM
+        return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+    @staticmethod
+    def _post(table, term, key):
+        keys = table.get(term)
+        if keys is None:
+            table[term] = keys = set()
+        keys.add(key)
+
+    @staticmethod
+    def _unpost(table, term, key):
+        keys = table.get(term)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del table[term]
+
+    def _link(self, key, text):
+        self.texts[key] = text
+        if text not in self.exact:
+            self._sorted_texts = None
+        self._post(self.exact, text, key)
+        for tok in set(_TOKEN_RE.findall(text)):
+            if tok not in self.tokens:
+                self._sorted_tokens = None
+            self._post(self.tokens, tok, key)
+        for gram in self._grams_of(text):
+            self._post(self.grams, gram, key)
+
+    def _unlink(self, key, text):
+        self._unpost(self.exact, text, key)
+        for tok in set(_TOKEN_RE.findall(text)):
+            self._unpost(self.tokens, tok, key)
+        for gram in self._grams_of(text):
+            self._unpost(self.grams, gram, key)
+
+    def set(self, row, col, value):
+        """Cập nhật chỉ mục cho ô (row, col) vừa được ghi value (None = xóa)"""
+        key = (row, col)
+        old = self.texts.pop(key, None)
+        if old is not None:
+            self._unlink(key, old)
+        if value is not None:
+            self._link(key, str(value))
+
+    @staticmethod
+    def _with_prefix(sorted_terms, table, prefix):
+        found = set()
+        for i in range(bisect.bisect_left(sorted_terms, prefix), len(sorted_terms)):
+            term = sorted_terms[i]
+            if not term.startswith(prefix):
+                break
+            found |= table.get(term, set())   # từ đã bị xóa hết ô vẫn có thể còn trong danh sách
+        return found
+
+    def candidates(self, keyword, mode='substring'):
+        """Các ô có thể khớp (tập cha của kết quả, chưa kiểm tra lại)"""
+        if mode == 'exact':
+            return set(self.exact.get(keyword, ()))
+        if mode == 'prefix':
+            if self._sorted_texts is None:
+                self._sorted_texts = sorted(self.exact)
+            if self._sorted_tokens is None:
+                self._sorted_tokens = sorted(self.tokens)
+            return (self._with_prefix(self._sorted_texts, self.exact, keyword)
+                    | self._with_prefix(self._sorted_tokens, self.tokens, keyword))
+        if len(keyword) < self.GRAM:
+            # Từ khóa ngắn hơn một gram: duyệt các nội dung khác nhau thay vì từng ô
+            found = set()
+            for text, keys in self.exact.items():
+                if keyword in text:
+                    found |= keys
+            return found
+        postings = sorted((self.grams.get(gram, set()) for gram in self._grams_of(keyword)), key=len)
+        return set(postings[0]).intersection(*postings[1:])
+
+    def find(self, keyword, mode='substring'):
+        """Các ô (hàng, cột) khớp từ khóa, sắp xếp theo hàng rồi cột"""
+        return sorted(key for key in self.candidates(keyword, mode)
+                      if text_matches(self.texts[key], keyword, mode))
+
+
+# ================== CÔNG THỨC ==================
+
+class XlError(str):
+    """Giá trị lỗi của công thức (#DIV/0!, #VALUE!...): truyền qua phép tính như Excel, không phải số"""
+
+
+DIV0, VALUE_ERR, NAME_ERR, CIRC_ERR = XlError('#DIV/0!'), XlError('#VALUE!'), XlError('#NAME?'), XlError('#CIRC!')
+
+_FORMULA_TOKEN = re.compile(r'''\s*(?:
+    (?P<num>(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)
+  | (?P<str>"(?:[^"]|"")*")
+  | (?P<ref>\$?[A-Za-z]{1,3}\$?\d+(?::\$?[A-Za-z]{1,3}\$?\d+)?(?![\w(])|\$?[A-Za-z]{1,3}:\$?[A-Za-z]{1,3}(?![\w(]))
+  | (?P<name>[A-Za-z_][\w.]*)
+  | (?P<op><>|<=|>=|[-+*/^&=<>(),%])
+)''', re.X)
+_CELL_RE = re.compile(r'\$?([A-Za-z]{1,3})\$?(\d+)?$')
+
+
+class FormulaSyntaxError(Exception):
+    pass
+
+
+def _parse_ref(text):
+    """'A1' -> (1, 1); 'A' (cả cột) -> (None, 1)"""
+    letters, digits = _CELL_RE.match(text).groups()
+    return (int(digits) if digits else None), column_index_from_string(letters.upper())
+
+
+class _FormulaParser:
+    """
+    Phân tích công thức thành cây tuple, thứ tự ưu tiên như Excel:
+    so sánh < & < + - < * / < ^ < dấu âm < % < hằng/ô/vùng/hàm/(...)
+    """
+    COMPARE = ('=', '<>', '<', '>', '<=', '>=')
+
+    def __init__(self, text):
+        self.tokens = []
+        pos = 0
+        text = text.strip()
+        while pos < len(text):
+            m = _FORMULA_TOKEN.match(text, pos)
+            if not m or m.end() == pos:
+                raise FormulaSyntaxError(f"không hiểu '{text[pos:]}'")
+            kind = m.lastgroup
+            self.tokens.append((kind, m.group(kind)))
+            pos = m.end()
+            while pos < len(text) and text[pos].isspace():
+                pos += 1
+        self.pos = 0
+
+    def parse(self):
+        node = self.compare()
+        if self.pos != len(self.tokens):
+            raise FormulaSyntaxError(f"thừa '{self.tokens[self.pos][1]}'")
+        return node
+
+    def peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else (None, None)
+
+    def take(self, value=None):
+        kind, text = self.peek()
+        if kind is None or (value is not None and text != value):
+            raise FormulaSyntaxError(f"cần '{value}'" if value else "công thức bị cụt")
+        self.pos += 1
+        return kind, text
+
+    def _binary(self, ops, sub):
+        node = sub()
+        while self.peek()[0] == 'op' and self.peek()[1] in ops:
+            op = self.take()[1]
+            node = ('bin', op, node, sub())
+        return node
+
+    def compare(self):
+        return self._binary(self.COMPARE, self.concat)
+
+    def concat(self):
+        return self._binary(('&',), self.additive)
+
+    def additive(self):
+        return self._binary(('+', '-'), self.term)
+
+    def term(self):
+        return self._binary(('*', '/'), self.power)
+
+    def power(self):
+        return self._binary(('^',), self.unary)
+
+    def unary(self):
+        if self.peek() in (('op', '-'), ('op', '+')):
+            op = self.take()[1]
+            node = self.unary()
+            return ('neg', node) if op == '-' else node
+        return self.percent()
+
+    def percent(self):
+        node = self.primary()
+        while self.peek() == ('op', '%'):
+            self.take()
+            node = ('bin', '/', node, ('num', 100))
+        return node
+
+    def primary(self):
+        kind, text = self.take()
+        if kind == 'num':
+            value = float(text)
+            return ('num', int(value) if value.is_integer() and 'e' not in text.lower() and '.' not in text else value)
+        if kind == 'str':
+            return ('str', text[1:-1].replace('""', '"'))
+        if kind == 'ref':
+            if ':' in text:
+                (r1, c1), (r2, c2) = (_parse_ref(part) for part in text.split(':'))
+                if (r1 is None) != (r2 is None):
+                    raise FormulaSyntaxError(f"vùng không hợp lệ '{text}'")
+                if r1 is None:
+                    r1, r2 = 1, None       # cả cột A:B, chặn dưới theo dòng cuối có dữ liệu
+                return ('range', min(r1, r2 or r1), min(c1, c2), r2 if r2 is None else max(r1, r2), max(c1, c2))
+            r, c = _parse_ref(text)
+            return ('ref', r, c)
+        if kind == 'name':
+            name = text.upper()
+            if self.peek() == ('op', '('):
+                self.take('(')
+                args = []
+                if self.peek() != ('op', ')'):
+                    args.append(self.compare())
+                    while self.peek() == ('op', ','):
+                        self.take(',')
+                        args.append(self.compare())
+                self.take(')')
+                return ('call', name, args)
+            if name in ('TRUE', 'FALSE'):
+                return ('bool', name == 'TRUE')
+            return ('err', NAME_ERR)
+        if (kind, text) == ('op', '('):
+            node = self.compare()
+            self.take(')')
+            return node
+        raise FormulaSyntaxError(f"không mong đợi '{text}'")
+
+
+def parse_formula(text):
+    """'=SUM(A1:A3)*2' -> cây tuple; lỗi cú pháp -> FormulaSyntaxError"""
+    return _FormulaParser(text[1:] if text.startswith('=') else text).parse()
+
+
+def _formula_refs(node, out):
+    """Gom các ('ref', ...) và ('range', ...) trong cây"""
+    kind = node[0]
+    if kind in ('ref', 'range'):
+        out.append(node)
+    elif kind == 'bin':
+        _formula_refs(node[2], out)
+        _formula_refs(node[3], out)
+    elif kind == 'neg':
+        _formula_refs(node[1], out)
+    elif kind == 'call':
+        for arg in node[2]:
+            _formula_refs(arg, out)
+    return out
+
+
+# Ô tham chiếu tương đối trong công thức (bỏ qua chuỗi "..." và tên hàm như LOG10)
+_RELATIVE_REF_RE = re.compile(r'"(?:[^"]|"")*"|(?<![\w.$])([A-Za-z]{1,3})(\d+)(?![\w(])')
+
+
+def _shift_formula(node, dr, dc):
+    """Cây công thức dời đi dr hàng, dc cột (mọi tham chiếu đều tương đối)"""
+    kind = node[0]
+    if kind == 'ref':
+        return ('ref', node[1] + dr, node[2] + dc)
+    if kind == 'range':
+        _, r1, c1, r2, c2 = node
+        if r2 is None:
+            return node     # cả cột (A:A) nằm nguyên văn trong dạng R1C1, không dời
+        return ('range', r1 + dr, c1 + dc, r2 + dr, c2 + dc)
+    if kind == 'bin':
+        return ('bin', node[1], _shift_formula(node[2], dr, dc), _shift_formula(node[3], dr, dc))
+    if kind == 'neg':
+        return ('neg', _shift_formula(node[1], dr, dc))
+    if kind == 'call':
+        return ('call', node[1], [_shift_formula(arg, dr, dc) for arg in node[2]])
+    return node
+
+
+def is_formula(value):
+    return isinstance(value, str) and len(value) > 1 and value.startswith('=')
+
+
+def sheet_values(path):
+    """
+    Các dòng giá trị của sheet active trong file (đọc read_only), ô công thức thay bằng kết quả
+    FormulaEngine, giống hệt khi workbook đang mở trong cache (WorkbookCache.columns).
+    Công thức dùng hàm engine chưa hỗ trợ cho #NAME? ở cả hai đường.
+    """
+    wb = load_workbook(path, read_only=True)
+    try:
+        rows = [list(row) for row in wb.active.iter_rows(values_only=True)]
+    finally:
+        wb.close()
+    engine = FormulaEngine.from_rows(rows)
+    if not engine.formulas:
+        return rows
+    engine.recalc()
+    for (r, c) in engine.formulas:
+        rows[r - 1][c - 1] = engine.values.get((r, c))
+    return rows
+
+
+def _xl_number(v):
+    """Giá trị -> số cho phép tính (ô trống = 0, TRUE = 1, chuỗi số được đổi), không được -> #VALUE!"""
+    if isinstance(v, XlError):
+        return v
+    if v is None:
+        return 0
+    if isinstance(v, (int, float)):
+        return v
+    if isinstance(v, str):
+        try:
+            return float(v)
+        except ValueError:
+            return VALUE_ERR
+    return VALUE_ERR
+
+
+def _xl_text(v):
+    if v is None:
+        return ''
+    if isinstance(v, bool):
+        return 'TRUE' if v else 'FALSE'
+    if isinstance(v, float) and v.is_integer():
+        return str(int(v))
+    return str(v)
+
+
+def _xl_bool(v):
+    if isinstance(v, XlError):
+        return v
+    if v is None:
+        return False
+    if isinstance(v, (int, float)):
+        return v != 0
+    if isinstance(v, str) and v.upper() in ('TRUE', 'FALSE'):
+        return v.upper() == 'TRUE'
+    return VALUE_ERR
+
+
+def _xl_compare_key(v):
+    # Excel: số < chữ (không phân biệt hoa thường) < TRUE/FALSE
+    if isinstance(v, bool):
+        return (2, v)
+    if isinstance(v, (int, float)):
+        return (0, v)
+    return (1, str(v).casefold())
+
+
+def _xl_round(x, digits):
+    """ROUND như Excel: .5 làm tròn ra xa số 0"""
+    factor = 10 ** digits
+    return math.copysign(math.floor(abs(x) * factor + 0.5), x) / factor
+
+
+class FormulaEngine:
+    """
+    Tính công thức của một sheet trong bộ nhớ (openpyxl chỉ lưu chuỗi công thức, không tính).
+    - Hàm: SUM, AVERAGE, MIN, MAX, COUNT, COUNTA, IF, IFERROR, AND, OR, NOT, ROUND, ABS;
+      + - * / ^ & %, so sánh, ô (A1, $A$1), vùng (A1:B10, A:A)
+    - Đồ thị phụ thuộc: ô -> công thức dùng ô đó; vùng được chia theo cột để tra nhanh
+    - set() chỉ đánh dấu ô đổi; lần đọc giá trị sau tính lại đúng các công thức bị ảnh hưởng
+      theo thứ tự topo (vòng lặp -> #CIRC!)
+    get_raw(hàng, cột) trả về giá trị gốc của ô (hằng hoặc chuỗi công thức).
+    """
+
+    def __init__(self, get_raw, max_row=0):
+        self.get_raw = get_raw
+        self.max_row = max_row
+        self.formulas = {}      # (hàng, cột) -> cây công thức
+        self.refs = {}          # (hàng, cột) -> các ref/range của công thức
+        self.values = {}        # (hàng, cột) -> giá trị đã tính
+        self._cell_deps = {}    # ô -> các công thức tham chiếu trực tiếp
+        self._col_ranges = {}   # cột -> [(hàng_đầu, hàng_cuối|None, công thức)]
+        self._pending = set()   # ô đã đổi, chưa tính lại phần phụ thuộc
+        # Dạng R1C1 của công thức -> (cây, hàng, cột) đã parse: công thức kéo xuống cả cột
+        # (=A2*2, =A3*2...) chỉ parse một lần, các ô sau dời cây đã có
+        self._templates = {}
+
+    @classmethod
+    def from_worksheet(cls, ws):
+        """Engine đọc thẳng ô của worksheet đang mở (kể cả sau khi ô bị sửa)"""
+        if FAST_CELLS:
+            def get_raw(r, c):
+                cell = ws._cells.get((r, c))
+                return None if cell is None else cell.value
+        else:
+            def get_raw(r, c):
+                # ws.cell tạo ô nếu chưa có: chỉ đọc trong vùng đã có dữ liệu
+                if r > ws.max_row or c > ws.max_column:
+                    return None
+                return ws.cell(row=r, column=c).value
+        engine = cls(get_raw)
+        for (r, c), cell in sheet_cells(ws).items():
+            if cell.value is not None:
+                engine.max_row = max(engine.max_row, r)
+                if is_formula(cell.value):
+                    engine._register((r, c), cell.value)
+        return engine
+
+    @classmethod
+    def from_rows(cls, rows):
+        """Engine trên các dòng giá trị (iter_rows values_only) đã đọc sẵn"""
+        def get_raw(r, c):
+            if 1 <= r <= len(rows):
+                row = rows[r - 1]
+                if 1 <= c <= len(row):
+                    return row[c - 1]
+            return None
+        engine = cls(get_raw, len(rows))
+        for i, row in enumerate(rows, start=1):
+            for j, value in enumerate(row, start=1):
+                if is_formula(value):
+                    engine._register((i, j), value)
+        return engine
+
+    # ---------- Đồ thị phụ thuộc ----------
+    def _parse(self, key, text):
+        template = None
+        if '$' not in text:
+            row, col = key
+
+            def relative(m):
+                if m.group(1) is None:
+                    return m.group(0)
+                return f"R[{int(m.group(2)) - row}]C[{column_index_from_string(m.group(1).upper()) - col}]"
+            template = _RELATIVE_REF_RE.sub(relative, text)
+            hit = self._templates.get(template)
+            if hit is not None:
+                tree, r0, c0 = hit
+                return _shift_formula(tree, row - r0, col - c0)
+        try:
+            tree = parse_formula(text)
+        except FormulaSyntaxError:
+            tree = ('err', NAME_ERR)
+        if template is not None:
+            self._templates[template] = (tree, key[0], key[1])
+        return tree
+
+    def _register(self, key, text):
+        tree = self._parse(key, text)
+        refs = _formula_refs(tree, [])
+        self.formulas[key] = tree
+        self.refs[key] = refs
+        for ref in refs:
+            if ref[0] == 'ref':
+                self._cell_deps.setdefault((ref[1], ref[2]), set()).add(key)
+            else:
+                _, r1, c1, r2, c2 = ref
+                for c in range(c1, c2 + 1):
+                    self._col_ranges.setdefault(c, []).append((r1, r2, key))
+        self._pending.add(key)
+
+    def _unregister(self, key):
+        self.formulas.pop(key, None)
+        self.values.pop(key, None)
+        for ref in self.refs.pop(key, ()):
+            if ref[0] == 'ref':
+                deps = self._cell_deps.get((ref[1], ref[2]))
+                if deps is not None:
+                    deps.discard(key)
+                    if not deps:
+                        del self._cell_deps[ref[1], ref[2]]
+            else:
+                for c in range(ref[2], ref[4] + 1):
+                    ranges = self._col_ranges.get(c)
+                    if ranges:
+                        ranges[:] = [item for item in ranges if item[2] != key]
+
+    def dependents(self, key):
+        """Các công thức đọc trực tiếp ô key"""
+        r, c = key
+        found = set(self._cell_deps.get(key, ()))
+        for r1, r2, formula in self._col_ranges.get(c, ()):
+            if r1 <= r and (r2 is None or r <= r2):
+                found.add(formula)
+        return found
+
+    def set(self, row, col, value):
+        """Ô (row, col) vừa được ghi value (hằng, chuỗi công thức hoặc None)"""
+        key = (row, col)
+        if key in self.formulas:
+            self._unregister(key)
+        if is_formula(value):
+            self._register(key, value)
+        if value is not None:
+            self.max_row = max(self.max_row, row)
+        self._pending.add(key)
+
+    def recalc(self):
+        """Tính lại các công thức bị ảnh hưởng bởi ô đã đổi (chỉ phần đó), trả về số công thức đã tính"""
+        if not self._pending:
+            return 0
+        start, self._pending = self._pending, set()
+        edges = {}
+        seen = set(start)
+        queue = list(start)
+        while queue:
+            key = queue.pop()
+            targets = self.dependents(key)
+            if targets:
+                edges[key] = targets
+            for target in targets:
+                if target not in seen:
+                    seen.add(target)
+                    queue.append(target)
+        dirty = {key for key in seen if key in self.formulas}
+        indegree = dict.fromkeys(dirty, 0)
+        for key in dirty:
+            for target in edges.get(key, ()):
+                indegree[target] += 1
+        ready = [key for key, n in indegree.items() if n == 0]
+        done = 0
+        while ready:
+            key = ready.pop()
+            self.values[key] = self._value(self.formulas[key])
+            done += 1
+            for target in edges.get(key, ()):
+                indegree[target] -= 1
+                if indegree[target] == 0:
+                    ready.append(target)
+        for key, n in indegree.items():
+            if n > 0:
+                self.values[key] = CIRC_ERR    # nằm trong (hoặc phụ thuộc vào) vòng tham chiếu
+        return done
+
+    def value(self, row, col):
+        """Giá trị của ô: kết quả công thức (đã tính lại nếu cần) hoặc giá trị gốc"""
+        self.recalc()
+        key = (row, col)
+        if key in self.formulas:
+            return self.values.get(key)
+        return self.get_raw(row, col)
+
+    # ---------- Tính ----------
+    def _cell(self, r, c):
+        if (r, c) in self.formulas:
+            return self.values.get((r, c))
+        return self.get_raw(r, c)
+
+    def _range_values(self, node):
+        _, r1, c1, r2, c2 = node
+        for r in range(r1, (self.max_row if r2 is None else r2) + 1):
+            for c in range(c1, c2 + 1):
+                yield self._cell(r, c)
+
+    def _value(self, node):
+        kind = node[0]
+        if kind in ('num', 'str', 'bool'):
+            return node[1]
+        if kind == 'err':
+            return node[1]
+        if kind == 'ref':
+            return self._cell(node[1], node[2])
+        if kind == 'range':
+            return VALUE_ERR     # vùng chỉ dùng được làm tham số hàm
+        if kind == 'neg':
+            v = _xl_number(self._value(node[1]))
+            return v if isinstance(v, XlError) else -v
+        if kind == 'bin':
+            return self._binary(node[1], self._value(node[2]), self._value(node[3]))
+        return self._call(node[1], node[2])
+
+    def _binary(self, op, a, b):
+        for v in (a, b):
+            if isinstance(v, XlError):
+                return v
+        if op == '&':
+            return _xl_text(a) + _xl_text(b)
+        if op in _FormulaParser.COMPARE:
+            if a is None:
+                a = '' if isinstance(b, str) else 0
+            if b is None:
+                b = '' if isinstance(a, str) else 0
+            ka, kb = _xl_compare_key(a), _xl_compare_key(b)
+            return {'=': ka == kb, '<>': ka != kb, '<': ka < kb,
+                    '>': ka > kb, '<=': ka <= kb, '>=': ka >= kb}[op]
+        a, b = _xl_number(a), _xl_number(b)
+        for v in (a, b):
+            if isinstance(v, XlError):
+                return v
+        if op == '+':
+            return a + b
+        if op == '-':
+            return a - b
+        if op == '*':
+            return a * b
+        if op == '/':
+            return DIV0 if b == 0 else a / b
+        try:
+            return float(a) ** b
+        except (OverflowError, ZeroDivisionError):
+            return DIV0 if a == 0 else VALUE_ERR
+
+    @staticmethod
+    def _cell_number(v):
+        """Số trong ô của vùng/ref, None nếu không tính (ô trống, chữ, TRUE/FALSE).
+        Khác Excel: chuỗi số cũng được tính, vì update lưu giá trị dạng chữ (như stat/avg)."""
+        if isinstance(v, bool) or v is None:
+            return None
+        if isinstance(v, (int, float)):
+            return v
+        try:
+            return float(v)
+        except ValueError:
+            return None
+
+    def _numbers(self, args):
+        """
+        Số từ tham số hàm: ô trong vùng/ref qua _cell_number, tham số trực tiếp đổi bằng _xl_number.
+        Trả về (list số, lỗi đầu tiên hoặc None).
+        """
+        nums = []
+        for arg in args:
+            values = self._range_values(arg) if arg[0] == 'range' else [self._value(arg)]
+            for v in values:
+                if isinstance(v, XlError):
+                    return nums, v
+                if arg[0] in ('range', 'ref'):
+                    v = self._cell_number(v)
+                    if v is not None:
+                        nums.append(v)
+                    continue
+                v = _xl_number(v)
+                if isinstance(v, XlError):
+                    return nums, v
+                nums.append(v)
+        return nums, None
+
+    def _call(self, name, args):
+        if name in ('SUM', 'AVERAGE', 'MIN', 'MAX'):
+            nums, err = self._numbers(args)
+            if err is not None:
+                return err
+            if name == 'SUM':
+                return sum(nums)
+            if name == 'AVERAGE':
+                return sum(nums) / len(nums) if nums else DIV0
+            return (min(nums) if name == 'MIN' else max(nums)) if nums else 0
+        if name == 'COUNT':
+            total = 0
+            for arg in args:
+                values = self._range_values(arg) if arg[0] == 'range' else [self._value(arg)]
+                for v in values:
+                    if isinstance(v, XlError):
+                        continue
+                    if arg[0] in ('range', 'ref'):
+                        total += self._cell_number(v) is not None
+                    elif v is not None and not isinstance(_xl_number(v), XlError):
+                        total += 1
+            return total
+        if name == 'COUNTA':
+            total = 0
+            for arg in args:
+                values = self._range_values(arg) if arg[0] == 'range' else [self._value(arg)]
+                total += sum(1 for v in values if v is not None and v != '')
+            return total
+        if name == 'IF':
+            if not 1 <= len(args) <= 3:
+                return VALUE_ERR
+            cond = _xl_bool(self._value(args[0]))
+            if isinstance(cond, XlError):
+                return cond
+            if cond:
+                return self._value(args[1]) if len(args) > 1 else True
+            return self._value(args[2]) if len(args) > 2 else False
+        if name == 'IFERROR':
+            if len(args) != 2:
+                return VALUE_ERR
+            v = self._value(args[0])
+            return self._value(args[1]) if isinstance(v, XlError) else v
+        if name in ('AND', 'OR'):
+            flags = []
+            for arg in args:
+                values = self._range_values(arg) if arg[0] == 'range' else [self._value(arg)]
+                for v in values:
+                    if v is None or (arg[0] == 'range' and isinstance(v, str) and not isinstance(v, XlError)):
+                        continue
+                    flag = _xl_bool(v)
+                    if isinstance(flag, XlError):
+                        return flag
+                    flags.append(flag)
+            if not flags:
+                return VALUE_ERR
+            return all(flags) if name == 'AND' else any(flags)
+        if name == 'NOT':
+            if len(args) != 1:
+                return VALUE_ERR
+            flag = _xl_bool(self._value(args[0]))
+            return flag if isinstance(flag, XlError) else not flag
+        if name in ('ROUND', 'ABS'):
+            if len(args) != (2 if name == 'ROUND' else 1):
+                return VALUE_ERR
+            x = _xl_number(self._value(args[0]))
+            if isinstance(x, XlError):
+                return x
+            if name == 'ABS':
+                return abs(x)
+            digits = _xl_number(self._value(args[1]))
+            if isinstance(digits, XlError):
+                return digits
+            return _xl_round(x, int(digits))
+        return NAME_ERR
+
+
+class _Book:
+    """Một workbook đang mở: dấu (mtime_ns, size) lúc load/save, cờ chưa lưu, trạng thái transaction"""
+    __slots__ = ('wb', 'stamp', 'dirty', 'tx', 'columns', 'index', 'formulas')
+
+    def __init__(self, wb, stamp):
+        self.wb = wb
+        self.stamp = stamp
+        self.dirty = False
+        self.tx = None      # None | 'active' | 'aborted'
+        self.columns = None  # SheetColumns của sheet active, bỏ đi mỗi khi workbook bị sửa
+        self.index = None    # SheetIndex (nếu file bật index), bỏ đi khi bị sửa bởi lệnh không @incremental
+        self.formulas = None  # FormulaEngine của sheet active, dựng khi cần, bỏ đi như index
+
+
+class WorkbookCache:
+    """
+    Workbook đang mở theo đường dẫn (LRU), để chuỗi lệnh trên cùng file chỉ load một lần và save một lần.
+    - File đổi mtime/size trên đĩa (chương trình khác ghi) -> load lại
+    - Workbook đã sửa được save khi: flush(), bị đẩy khỏi cache (quá max_books) hoặc khi thoát
+    - Workbook đang trong transaction không bị đẩy ra, không bị flush; chỉ commit mới ghi
+    - Mọi lần ghi đều qua atomic_save
+    - write_through: save ngay khi lệnh đánh dấu thay đổi (ngoài transaction). Dùng khi plugin chạy
+      trong worker process: mỗi worker có cache riêng, save dồn tới lúc thoát thì worker lưu sau
+      ghi đè thay đổi của worker khác; save ngay thì worker khác thấy file đổi và load lại
+    """
+
+    def __init__(self, max_books: int = 4, write_through: bool = False):
+        self.max_books = max_books
+        self.write_through = write_through
+        self._books = OrderedDict()   # abspath -> _Book
+        # Cột của file chưa mở (đọc read_only): abspath -> ((mtime_ns, size), SheetColumns)
+        self._columns = OrderedDict()
+        self._indexed = set()         # file bật index (excel index): index dựng lại khi workbook load lại
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def _stamp(path):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def get(self, path):
+        key = os.path.abspath(path)
+        with self._lock:
+            book = self._books.get(key)
+            if book is not None:
+                # Trong transaction workbook trong bộ nhớ là bản đúng, xung đột được kiểm tra khi commit
+                if book.tx or self._stamp(key) == book.stamp:
+                    self._books.move_to_end(key)
+                    return book.wb
+                if book.dirty:
+                    print(f"⚠️ {path} đã bị thay đổi bên ngoài, bỏ các thay đổi chưa lưu")
+                del self._books[key]
+        wb = load_workbook(key)
+        self.put(key, wb)
+        return wb
+
+    def peek(self, path):
+        """Workbook đang mở nếu bản trong bộ nhớ còn đúng (khớp file, chưa lưu hoặc trong transaction), ngược lại None"""
+        key = os.path.abspath(path)
+        with self._lock:
+            book = self._books.get(key)
+            if book is None:
+                return None
+            if book.tx or self._stamp(key) == book.stamp:
+                self._books.move_to_end(key)
+                return book.wb
+            if not book.dirty:
+                del self._books[key]
+                return None
+        return self.get(key)   # file đổi bên ngoài khi còn thay đổi chưa lưu: get() cảnh báo và load lại
+
+    def columns(self, path) -> SheetColumns:
+        """SheetColumns của sheet active: lấy từ workbook đang mở, hoặc trích từ file (giữ tới khi file đổi)"""
+        key = os.path.abspath(path)
+        wb = self.peek(key)
+        if wb is not None:
+            with self._lock:
+                book = self._books.get(key)
+                if book is not None and book.wb is wb and book.columns is not None:
+                    return book.columns
+            columns = SheetColumns(wb.active, formulas=lambda: self.formulas(key))
+            with self._lock:
+                book = self._books.get(key)
+                if book is not None and book.wb is wb:
+                    book.columns = columns
+            return columns
+        stamp = self._stamp(key)
+        with self._lock:
+            hit = self._columns.get(key)
+            if hit is not None and hit[0] == stamp:
+                self._columns.move_to_end(key)
+                return hit[1]
+        columns = self._sidecar_columns(key, stamp)
+        with self._lock:
+            self._columns[key] = (stamp, columns)
+            while len(self._columns) > self.max_books:
+                self._columns.popitem(last=False)
+        return columns
+
+    def _sidecar_columns(self, key, stamp, build=False) -> SheetColumns:
+        """
+        Cột của file trên đĩa, qua sidecar nếu file đã bật sidecar (hoặc build=True):
+        - sidecar khớp (mtime_ns, size) -> đọc luôn, không parse xlsx
+        - khác dấu nhưng cùng hash nội dung -> đọc, cập nhật dấu
+        - cũ -> trích lại từ xlsx và ghi đè sidecar
+        """
+        side = sidecar_path(key)
+        meta = SheetColumns.read_sidecar_meta(side) if os.path.exists(side) else None
+        digest = None
+        if meta is not None and not build:
+            fresh = stamp is not None and [meta.get('mtime_ns'), meta.get('size')] == list(stamp)
+            if not fresh:
+                digest = file_digest(key)
+                fresh = meta.get('digest') == digest
+            if fresh:
+                try:
+                    columns = SheetColumns.load_sidecar(side)
+                except Exception:
+                    columns = None
+                if columns is not None:
+                    if digest is not None:
+                        self._write_sidecar(side, columns, digest, stamp)
+                    return columns
+        columns = SheetColumns.from_rows(sheet_values(key))
+        if build or os.path.exists(side):
+            self._write_sidecar(side, columns, digest or file_digest(key), stamp)
+        return columns
+
+    @staticmethod
+    def _write_sidecar(side, columns, digest, stamp):
+        try:
+            columns.save_sidecar(side, {'digest': digest, 'mtime_ns': stamp[0], 'size': stamp[1]})
+        except OSError as e:   # thư mục chỉ đọc...: vẫn dùng được cột vừa trích
+            print(f"⚠️ Không ghi được sidecar {side}: {e}")
+
+    def build_sidecar(self, path):
+        """Bật sidecar cho file: trích cột từ bản trên đĩa và ghi .cols.npz, trả về đường dẫn sidecar"""
+        key = os.path.abspath(path)
+        stamp = self._stamp(key)
+        columns = self._sidecar_columns(key, stamp, build=True)
+        with self._lock:
+            self._columns[key] = (stamp, columns)
+            while len(self._columns) > self.max_books:
+                self._columns.popitem(last=False)
+        return sidecar_path(key)
+
+    # ---------- Chỉ mục find ----------
+    def is_indexed(self, path) -> bool:
+        return os.path.abspath(path) in self._indexed
+
+    def set_indexed(self, path, enabled: bool) -> None:
+        key = os.path.abspath(path)
+        with self._lock:
+            if enabled:
+                self._indexed.add(key)
+            else:
+                self._indexed.discard(key)
+                book = self._books.get(key)
+                if book is not None:
+                    book.index = None
+
+    def index(self, path) -> SheetIndex:
+        """SheetIndex của sheet active (mở workbook vào cache, dựng index nếu chưa có)"""
+        key = os.path.abspath(path)
+        wb = self.get(key)
+        with self._lock:
+            book = self._books.get(key)
+            if book is not None and book.wb is wb and book.index is not None:
+                return book.index
+        index = SheetIndex(wb.active)
+        with self._lock:
+            book = self._books.get(key)
+            if book is not None and book.wb is wb:
+                book.index = index
+        return index
+
+    def formulas(self, path) -> 'FormulaEngine':
+        """FormulaEngine của sheet active (mở workbook vào cache, dựng đồ thị công thức nếu chưa có)"""
+        key = os.path.abspath(path)
+        wb = self.get(key)
+        with self._lock:
+            book = self._books.get(key)
+            if book is not None and book.wb is wb and book.formulas is not None:
+                return book.formulas
+        engine = FormulaEngine.from_worksheet(wb.active)
+        with self._lock:
+            book = self._books.get(key)
+            if book is not None and book.wb is wb:
+                book.formulas = engine
+        return engine
+
+    def trackers(self, path, wb):
+        """Index / FormulaEngine đang có của workbook wb, để lệnh sửa ô báo từng ô đã ghi qua set()"""
+        book = self._books.get(os.path.abspath(path))
+        if book is not None and book.wb is wb:
+            return [t for t in (book.index, book.formulas) if t is not None]
+        return []
+
+    def put(self, path, wb) -> None:
+        """Đưa workbook (vừa load hoặc vừa save) vào cache"""
+        key = os.path.abspath(path)
+        with self._lock:
+            old = self._books.get(key)
+            book = _Book(wb, self._stamp(key))
+            if old is not None:
+                book.tx = old.tx
+            self._books[key] = book
+            self._books.move_to_end(key)
+            for old_key in list(self._books):
+                if len(self._books) <= self.max_books:
+                    break
+                old = self._books[old_key]
+                if old.tx:
+                    continue
+                del self._books[old_key]
+                if old.dirty:
+                    atomic_save(old.wb, old_key)
+                    print(f"💾 Đã lưu {old_key} (đóng bớt workbook)")
+
+    def is_dirty(self, path) -> bool:
+        book = self._books.get(os.path.abspath(path))
+        return bool(book and book.dirty)
+
+    def tx_state(self, path):
+        book = self._books.get(os.path.abspath(path))
+        return book.tx if book is not None else None
+
+    def mark_dirty(self, path, wb, incremental: bool = False) -> None:
+        """Đánh dấu cần save; incremental=True khi lệnh đã tự cập nhật index / công thức (@incremental)"""
+        key = os.path.abspath(path)
+        with self._lock:
+            book = self._books.get(key)
+            if book is not None and book.wb is wb:
+                book.dirty = True
+                book.columns = None
+                if not incremental:
+                    book.index = None
+                    book.formulas = None
+                if self.write_through and not book.tx:
+                    self.save(key)
+                return
+        # Workbook đã bị đẩy khỏi cache trong lúc lệnh chạy -> lưu luôn
+        atomic_save(wb, key)
+
+    def discard(self, path) -> None:
+        with self._lock:
+            self._books.pop(os.path.abspath(path), None)
+
+    def paths(self):
+        with self._lock:
+            return list(self._books)
+
+    def save(self, path) -> bool:
+        """Lưu một workbook nếu có thay đổi; trả về True nếu đã ghi file. Bỏ qua workbook đang trong transaction"""
+        key = os.path.abspath(path)
+        with self._lock:
+            book = self._books.get(key)
+            if book is None or not book.dirty:
+                return False
+            if book.tx:
+                print(f"⚠️ {key} đang trong transaction, chỉ ghi khi excel commit")
+                return False
+            atomic_save(book.wb, key)
+            book.stamp = self._stamp(key)
+            book.dirty = False
+            return True
+
+    def flush(self):
+        """Lưu mọi workbook có thay đổi, trả về danh sách file đã ghi"""
+        return [path for path in self.paths() if self.save(path)]
+
+    # ---------- Transaction ----------
+    def begin(self, path) -> None:
+        """Bắt đầu transaction: lưu thay đổi đang chờ để file trên đĩa là điểm rollback"""
+        key = os.path.abspath(path)
+        with self._lock:
+            if self.tx_state(key):
+                raise Exception(f"{path} đã có transaction chưa kết thúc (excel commit / excel rollback)")
+            self.save(key)
+            self.get(key)
+            self._books[key].tx = 'active'
+
+    def abort(self, path) -> None:
+        book = self._books.get(os.path.abspath(path))
+        if book is not None and book.tx:
+            book.tx = 'aborted'
+
+    def commit(self, path) -> bool:
+        """Ghi một lần (atomic) mọi thay đổi của transaction; trả về True nếu có ghi file"""
+        key = os.path.abspath(path)
+        with self._lock:
+            book = self._books.get(key)
+            if book is None or not book.tx:
+                raise Exception(f"Không có transaction nào trên {path} (dùng excel begin)")
+            if book.tx == 'aborted':
+                del self._books[key]
+                raise Exception(f"Transaction trên {path} có lệnh lỗi, đã rollback")
+            if self._stamp(key) != book.stamp:
+                del self._books[key]
+                raise Exception(f"{path} đã bị thay đổi bên ngoài trong lúc transaction, đã rollback")
+            book.tx = None
+            return self.save(key)
+
+    def rollback(self, path) -> None:
+        """Bỏ workbook trong bộ nhớ: lần sau load lại bản trên đĩa (bản lúc begin)"""
+        key = os.path.abspath(path)
+        with self._lock:
+            book = self._books.get(key)
+            if book is None or not book.tx:
+                raise Exception(f"Không có transaction nào trên {path} (dùng excel begin)")
+            del self._books[key]
+
+    def transactions(self):
+        with self._lock:
+            return [key for key, book in self._books.items() if book.tx]
+
+# ================== GOM NHÓM (GROUPBY / PIVOT) ==================
+
+AGGREGATES = ('sum', 'mean', 'count', 'min', 'max', 'first', 'last')
+
+
+def _agg_number(v):
+    """Số của ô cho sum/mean/min/max (chuỗi số cũng được tính, như stat), None nếu không phải số"""
+    if isinstance(v, (int, float)):
+        return v
+    if isinstance(v, str):
+        try:
+            return float(v)
+        except ValueError:
+            return None
+    return None
+
+
+def _key_part(v, mode):
+    """Giá trị khóa theo chế độ: date -> bỏ giờ (datetime -> date, chuỗi '2024-01-02 09:15' -> '2024-01-02')"""
+    if mode == 'date':
+        if isinstance(v, datetime.datetime):
+            return v.date()
+        if isinstance(v, str):
+            return v[:10]
+    return v
+
+
+def _group_order(key):
+    """Thứ tự in nhóm: theo _sort_value từng phần của khóa, ô trống cuối"""
+    parts = key if isinstance(key, tuple) else (key,)
+    return tuple((s is None, s or ()) for s in map(_sort_value, parts))
+
+
+class GroupAggregator:
+    """
+    Gom nhóm một lượt (hash theo khóa) trên các dòng đọc dần: chỉ giữ trạng thái từng nhóm,
+    nên bộ nhớ theo số nhóm chứ không theo số dòng.
+    - keys: [(cột từ 0, chế độ)] các cột khóa, nhiều cột -> khóa là tuple; chế độ 'date' bỏ phần giờ
+    - aggs: [(hàm, cột từ 0)]; sum/mean/min/max chỉ tính ô là số, count/first/last tính ô không trống
+    """
+
+    def __init__(self, keys, aggs):
+        self.keys = keys
+        self.aggs = aggs
+        self.groups = {}
+        self.rows = 0
+        self._init = [[0.0, 0] if agg == 'mean' else (0 if agg in ('sum', 'count') else None)
+                      for agg, _ in aggs]
+
+    def _key(self, row):
+        parts = tuple(_key_part(row[c] if c < len(row) else None, mode) for c, mode in self.keys)
+        return parts[0] if len(parts) == 1 else parts
+
+    def add(self, row):
+        self.rows += 1
+        key = self._key(row)
+        acc = self.groups.get(key)
+        if acc is None:
+            acc = self.groups[key] = [list(s) if isinstance(s, list) else s for s in self._init]
+        n = len(row)
+        for i, (agg, col) in enumerate(self.aggs):
+            v = row[col] if col < n else None
+            if v is None or v == '':
+                continue
+            if agg == 'count':
+                acc[i] += 1
+            elif agg == 'last':
+                acc[i] = v
+            elif agg == 'first':
+                if acc[i] is None:
+                    acc[i] = v
+            else:
+                x = _agg_number(v)
+                if x is None:
+                    continue
+                if agg == 'sum':
+                    acc[i] += x
+                elif agg == 'mean':
+                    acc[i][0] += x
+                    acc[i][1] += 1
+                elif agg == 'min':
+                    if acc[i] is None or x < acc[i]:
+                        acc[i] = x
+                elif acc[i] is None or x > acc[i]:
+                    acc[i] = x
+
+    def results(self):
+        """[(khóa, [giá trị từng hàm])] theo thứ tự khóa"""
+        out = []
+        for key in sorted(self.groups, key=_group_order):
+            values = [(s[0] / s[1] if s[1] else None) if agg == 'mean' else s
+                      for (agg, _), s in zip(self.aggs, self.groups[key])]
+            out.append((key, values))
+        return out
+
+
+def parse_key_spec(spec, header):
+    """'1' / 'Ticker' / '1,3' / 'Time:date,2' -> [(cột từ 0, chế độ khóa)]"""
+    keys = []
+    for part in spec.split(','):
+        part, _, mode = part.partition(':')
+        if mode not in ('', 'date'):
+            raise ValueError(f"Chế độ khóa không hỗ trợ: {mode} (có: date)")
+        keys.append((resolve_column(part, header) - 1, mode or None))
+    return keys
+
+
+def resolve_column(spec, header):
+    """Cột (từ 1) theo số hoặc tiêu đề dòng 1"""
+    if spec.isdigit():
+        return int(spec)
+    col = find_column(header, spec)
+    if col is None:
+        raise ValueError(f"Không có cột '{spec}' trong tiêu đề")
+    return col
+
+
+def parse_agg_spec(spec, header):
+    """'sum:3' / 'mean:Close' -> (hàm, cột từ 0)"""
+    agg, _, col = spec.partition(':')
+    agg = 'mean' if agg.lower() in ('avg', 'average') else agg.lower()
+    if agg not in AGGREGATES or not col:
+        raise ValueError(f"Hàm gộp không hợp lệ: {spec} (dạng <hàm>:<cột>, hàm: {', '.join(AGGREGATES)})")
+    return agg, resolve_column(col, header) - 1
+
+
+def _title(header, col):
+    title = header[col] if col < len(header) else None
+    return title if title is not None else get_column_letter(col + 1)
+
+
+# ================== CHỈ BÁO KỸ THUẬT ==================
+
+# Bố cục cột OHLCV mặc định (như getdata_chungkhoan.txt: header "Time" "Open" "High" "Low" "Close" "Volume"),
+# dùng khi hàng tiêu đề không có tên cột cần tìm
+OHLCV_LAYOUT = ('time', 'open', 'high', 'low', 'close', 'volume')
+
+
+def find_column(header, name, default=None):
+    """Cột (từ 1) có tiêu đề name (không phân biệt hoa thường), không có -> vị trí trong OHLCV_LAYOUT / default"""
+    name = name.casefold()
+    for i, title in enumerate(header, start=1):
+        if title is not None and title.strip().casefold() == name:
+            return i
+    if default is not None:
+        return default
+    return OHLCV_LAYOUT.index(name) + 1 if name in OHLCV_LAYOUT else None
+
+
+def _rolling(x, n, reduce):
+    """reduce(cửa sổ n phần tử, axis=1) cho từng vị trí, n-1 vị trí đầu là NaN"""
+    out = np.full(len(x), np.nan)
+    if 0 < n <= len(x):
+        out[n - 1:] = reduce(np.lib.stride_tricks.sliding_window_view(x, n), axis=1)
+    return out
+
+
+def sma(x, n):
+    """Trung bình trượt n phiên (qua cumsum)"""
+    out = np.full(len(x), np.nan)
+    if 0 < n <= len(x):
+        c = np.cumsum(np.insert(x, 0, 0.0))
+        out[n - 1:] = (c[n:] - c[:-n]) / n
+    return out
+
+
+def ewm(x, alpha):
+    """
+    Trung bình hàm mũ y[t] = alpha*x[t] + (1-alpha)*y[t-1], y[0] = x[0] (như pandas adjust=False).
+    Tính theo khối: trong khối dạng đóng y = w^(i+1)*y_trước + alpha*w^i*cumsum(x/w^k), khối đủ ngắn
+    để w^-k không tràn số, nên chỉ có vòng lặp theo khối chứ không theo phiên.
+    """
+    x = np.asarray(x, dtype=float)
+    out = np.empty(len(x))
+    if not len(x):
+        return out
+    w = 1.0 - alpha
+    if w <= 0:
+        out[:] = x
+        return out
+    block = int(max(1, min(256, 150 * math.log(10) / -math.log(w)))) if w < 1 else 256
+    powers = w ** np.arange(block + 1)
+    prev = x[0]
+    start = 0
+    while start < len(x):
+        chunk = x[start:start + block]
+        k = len(chunk)
+        scaled = np.cumsum(chunk / powers[:k]) * powers[:k]
+        out[start:start + k] = powers[1:k + 1] * prev + alpha * scaled
+        prev = out[start + k - 1]
+        start += k
+    return out
+
+
+def ema(x, n):
+    return ewm(x, 2.0 / (n + 1))
+
+
+def rsi(x, n=14):
+    """RSI Wilder: trung bình hàm mũ alpha=1/n của phần tăng / giảm; n phiên đầu là NaN"""
+    out = np.full(len(x), np.nan)
+    if len(x) <= n:
+        return out
+    diff = np.diff(x)
+    gain = ewm(np.clip(diff, 0, None), 1.0 / n)
+    loss = ewm(np.clip(-diff, 0, None), 1.0 / n)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        value = np.where(loss == 0, 100.0, 100.0 - 100.0 / (1.0 + gain / loss))
+    out[n:] = value[n - 1:]
+    return out
+
+
+def macd(x, fast=12, slow=26, signal=9):
+    """(MACD, signal, histogram)"""
+    line = ema(x, fast) - ema(x, slow)
+    sig = ema(line, signal)
+    return line, sig, line - sig
+
+
+def bollinger(x, n=20, k=2.0):
+    """(giữa, trên, dưới): SMA n ± k độ lệch chuẩn tổng thể của cửa sổ"""
+    mid = sma(x, n)
+    std = _rolling(x, n, np.std)
+    return mid, mid + k * std, mid - k * std
+
+
+def parse_indicator(spec):
+    """'sma:20' / 'macd:12:26:9' / 'bb:20:2' -> (tên, [tham số])"""
+    name, *params = spec.lower().split(':')
+    return name, [float(p) if '.' in p else int(p) for p in params]
+
+
+# Chỉ báo của excel indicators: tên -> (tham số mặc định, hàm(close, *tham_số) -> [(tiêu đề, mảng)])
+INDICATORS = {
+    'sma': ((20,), lambda x, n: [(f"SMA{n}", sma(x, n))]),
+    'ema': ((20,), lambda x, n: [(f"EMA{n}", ema(x, n))]),
+    'rsi': ((14,), lambda x, n: [(f"RSI{n}", rsi(x, n))]),
+    'macd': ((12, 26, 9), lambda x, f, s, g: list(zip(("MACD", "MACD_signal", "MACD_hist"), macd(x, f, s, g)))),
+    'bb': ((20, 2), lambda x, n, k: list(zip((f"BB{n}_mid", f"BB{n}_up", f"BB{n}_low"), bollinger(x, n, k)))),
+    'min': ((20,), lambda x, n: [(f"Min{n}", _rolling(x, n, np.min))]),
+    'max': ((20,), lambda x, n: [(f"Max{n}", _rolling(x, n, np.max))]),
+}
+DEFAULT_INDICATORS = ('sma:20', 'ema:20', 'rsi:14', 'macd', 'bb:20', 'min:20', 'max:20')
+
+
+def compute_indicators(close, specs):
+    """[(tiêu đề cột, mảng)] của các chỉ báo theo specs ('sma:20', 'macd'...), cùng độ dài với close"""
+    columns = []
+    for spec in specs:
+        name, params = parse_indicator(spec)
+        if name not in INDICATORS:
+            raise ValueError(f"Chỉ báo không hỗ trợ: {name} (có: {', '.join(INDICATORS)})")
+        defaults, func = INDICATORS[name]
+        columns.extend(func(close, *(tuple(params) + defaults[len(params):])))
+    return columns
+
+
+def write_column(ws, col, rows, values):
+    """
+    Ghi cả cột một lượt: values (mảng NumPy) vào các dòng rows của cột col; NaN -> ô trống.
+    Trong khoảng openpyxl đã kiểm thử (FAST_CELLS), như compact_sheet: dựng dict ô của cột rồi gộp vào
+    ws._cells một lần, không qua ws.cell() (kiểm tra tọa độ + ép kiểu giá trị cho từng ô); giá trị là
+    float nên gán thẳng kiểu 'n'. Ngoài khoảng đó ghi từng ô qua ws.cell.
+    Ô đã có được sửa tại chỗ để giữ định dạng; NaN không tạo ô trống mới.
+    """
+    if not FAST_CELLS:
+        # Ô ngoài vùng dữ liệu ban đầu chắc chắn chưa có: NaN ở đó bỏ qua, không làm sheet lớn ra
+        max_row, max_col = ws.max_row, ws.max_column
+        for r, v in zip(rows.tolist(), values.tolist()):
+            if v == v:
+                ws.cell(row=r, column=col).value = v
+            elif r <= max_row and col <= max_col:
+                ws.cell(row=r, column=col).value = None
+        return
+    cells = ws._cells
+    column = {}
+    for r, v in zip(rows.tolist(), values.tolist()):
+        cell = cells.get((r, col))
+        if cell is None:
+            if v != v:
+                continue
+            cell = column[r, col] = Cell(ws, row=r, column=col)
+        cell._value = None if v != v else v
+        cell.data_type = 'n'
+    cells.update(column)
+
+
+def rule_signals(close, rule):
+    """
+    Tín hiệu mua / bán (mảng bool) của luật backtest, tính trên cả chuỗi giá:
+    - sma:NHANH:CHẬM  mua khi SMA nhanh cắt lên SMA chậm, bán khi cắt xuống (mặc định 10:30)
+    - rsi:N:DƯỚI:TRÊN mua khi RSI < DƯỚI, bán khi RSI > TRÊN (mặc định 14:30:70)
+    - macd            mua khi MACD cắt lên signal, bán khi cắt xuống
+    - bb:N:K          mua khi giá dưới dải dưới, bán khi giá trên dải giữa (mặc định 20:2)
+    """
+    name, params = parse_indicator(rule)
+    if name == 'sma':
+        fast, slow = (tuple(params) + (10, 30)[len(params):])[:2]
+        above = sma(close, fast) > sma(close, slow)
+    elif name == 'macd':
+        line, sig, _ = macd(close, *params)
+        above = line > sig
+    elif name == 'rsi':
+        n, low, high = (tuple(params) + (14, 30, 70)[len(params):])[:3]
+        value = rsi(close, n)
+        return value < low, value > high
+    elif name == 'bb':
+        n, k = (tuple(params) + (20, 2)[len(params):])[:2]
+        mid, _, lower = bollinger(close, n, k)
+        return close < lower, close > mid
+    else:
+        raise ValueError(f"Luật không hỗ trợ: {name} (có: sma, rsi, macd, bb)")
+    prev = np.concatenate(([False], above[:-1]))
+    return above & ~prev, ~above & prev
+
+
+def backtest(close, buy, sell, fee=0.0):
+    """
+    Chạy luật trên cả lịch sử một lượt (không vòng lặp theo phiên):
+    - Vị thế sau mỗi phiên = tín hiệu gần nhất (mua -> giữ, bán -> không giữ), khớp ở giá đóng cửa phiên có tín hiệu
+    - Lợi nhuận phiên t = vị thế phiên t-1 * (close[t]/close[t-1] - 1), mỗi lần đổi vị thế mất phí (tỷ lệ)
+    Trả về dict: trades [(phiên mua, phiên bán, lợi nhuận)], holding (còn giữ ở phiên cuối), equity,
+    return, buy_hold, max_drawdown, exposure, win_rate.
+    """
+    n = len(close)
+    events = np.where(buy, 1, np.where(sell, -1, 0))
+    last = np.maximum.accumulate(np.where(events != 0, np.arange(n), -1))
+    position = np.where(last >= 0, events[np.maximum(last, 0)] == 1, False).astype(float)
+    changes = np.abs(np.diff(np.concatenate(([0.0], position))))
+    growth = np.ones(n)
+    growth[1:] += position[:-1] * (close[1:] / close[:-1] - 1.0)
+    equity = np.cumprod(growth * (1.0 - changes * fee))
+    drawdown = 1.0 - equity / np.maximum.accumulate(equity)
+
+    step = np.diff(np.concatenate(([0.0], position, [0.0])))
+    entries = np.flatnonzero(step > 0)
+    exits = np.flatnonzero(step < 0)
+    closed = exits < n
+    exits = np.minimum(exits, n - 1)   # còn giữ tới phiên cuối -> tính theo giá phiên cuối, chưa mất phí bán
+    gains = (close[exits] / close[entries]) * (1.0 - fee) ** (1 + closed) - 1.0
+    return {
+        'trades': list(zip(entries.tolist(), exits.tolist(), gains.tolist())),
+        'holding': bool(n and position[-1]),
+        'equity': equity,
+        'return': float(equity[-1] - 1.0) if n else 0.0,
+        'buy_hold': float(close[-1] / close[0] - 1.0) if n else 0.0,
+        'max_drawdown': float(drawdown.max()) if n else 0.0,
+        'exposure': float(position.mean()) if n else 0.0,
+        'win_rate': float((gains > 0).mean()) if len(gains) else 0.0,
+    }
+
+
+# ================== CHẠY NHIỀU FILE (GLOB) ==================
+
+# Tên module plugin trong process con của glob. Plugin được trợ lý load bằng spec_from_file_location
+# (không nằm trong sys.modules, không import lại được) nên process chính load thêm một bản dưới tên
+# cố định để hàm gửi sang (run_glob_task, _load_glob_module) pickle được theo tên, và process con
+# import lại được tên đó.
+GLOB_MODULE = os.path.splitext(os.path.basename(__file__))[0]
+
+
+def _load_glob_module(path):
+    """
+    Load file plugin dưới tên GLOB_MODULE (một lần mỗi process). Thư mục plugin được thêm vào cuối
+    sys.path: process con (spawn) nhận sys.path của process chính nên import được GLOB_MODULE.
+    """
+    folder = os.path.dirname(path)
+    if folder not in sys.path:
+        sys.path.append(folder)
+    if GLOB_MODULE not in sys.modules:
+        spec = importlib.util.spec_from_file_location(GLOB_MODULE, path)
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[spec.name] = module
+        spec.loader.exec_module(module)
+    return sys.modules[GLOB_MODULE]
+
+
+def is_glob(filename) -> bool:
+    """Tên file có ký tự glob (*, ?, [) và không phải file có thật"""
+    return any(ch in filename for ch in '*?[') and not os.path.exists(filename)
+
+
+def expand_glob(pattern):
+    """Các file khớp pattern (sắp xếp), bỏ file khóa ~$ của Excel"""
+    return [path for path in sorted(glob.glob(pattern, recursive=True))
+            if os.path.isfile(path) and not os.path.basename(path).startswith('~$')]
+
+
+class _GlobAssistant:
+    """Trợ lý tối thiểu cho handler chạy từng file của glob: context riêng, không pipeline"""
+
+    def __init__(self):
+        self.context = {}
+
+    def result(self, status='ok', data=None, message=None):
+        return data
+
+    def pipe_input(self):
+        return None
+
+    def emit(self, item):
+        return False
+
+
+_glob_handler = None   # handler trong process con, dùng lại (cache cột / sidecar) giữa các file
+
+
+def run_glob_task(path, cmd, args):
+    """
+    Chạy một lệnh excel trên một file trong process con của glob.
+    Trả về (data, output đã in, lỗi hoặc None).
+    """
+    global _glob_handler
+    if _glob_handler is None:
+        _glob_handler = ExcelProHandler(_GlobAssistant())
+    handler = _glob_handler
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):   # process con chỉ có một thread
+        try:
+            handler._local.file = path
+            return handler.commands[cmd](list(args)), out.getvalue(), None
         except Exception as e:
-            # Không save nếu có lỗi
-            raise e
-    return wrapper
+            return None, out.getvalue(), str(e)
+
+
+def _summary_of(values):
+    """{'count','sum','mean','min','max','min_file','max_file'} của các giá trị số theo file"""
+    nums = {f: v for f, v in values.items()
+            if isinstance(v, (int, float)) and not isinstance(v, bool) and not math.isnan(v)}
+    if not nums:
+        return None
+    total = float(sum(nums.values()))
+    return {'count': len(nums), 'sum': total, 'mean': total / len(nums),
+            'min': float(min(nums.values())), 'max': float(max(nums.values())),
+            'min_file': min(nums, key=nums.get), 'max_file': max(nums, key=nums.get)}
+
+
+def summarize_results(results):
+    """
+    Tổng hợp kết quả theo file của glob:
+    - kết quả là số -> count/sum/mean/min/max (kèm file min/max)
+    - kết quả là dict (vd stat) -> như trên cho từng khóa số
+    - kết quả khác (vd BUY/WAIT của auto) -> đếm số file theo từng giá trị
+    """
+    present = {f: v for f, v in results.items() if v is not None}
+    if present and all(isinstance(v, dict) for v in present.values()):
+        keys = list(dict.fromkeys(k for v in present.values() for k in v))
+        summary = {}
+        for key in keys:
+            part = _summary_of({f: v.get(key) for f, v in present.items()})
+            if part is not None:
+                summary[key] = part
+        return summary
+    numeric = _summary_of(present)
+    if numeric is not None:
+        return numeric
+    counts = {}
+    for value in present.values():
+        counts[str(value)] = counts.get(str(value), 0) + 1
+    return {'counts': counts}
+
+
+def _table_cell(value):
+    if isinstance(value, float):
+        return f"{value:.2f}"
+    return '' if value is None else str(value)
 
 
 class ExcelProHandler:
@@ -39,11 +2163,30 @@ class ExcelProHandler:
     Xử lý lệnh excel. Mọi chức năng đều là method có tên cmd_<tên_lệnh>.
     Tự động đăng ký khi khởi tạo.
     """
+    command_prefixes = ('excel',)
+    # Lệnh đọc dữ liệu từ stage trước của pipeline (regex trên cả lệnh; trợ lý lấy từ manifest, không cần
+    # import plugin): chỉ 'add -', -f <file> đứng trước hoặc sau
+    pipe_inputs = (r"""^excel(?:\s+(?:-f|--file)\s+(?:"[^"]*"|'[^']*'|\S+))?\s+add\s+-"""
+                   r"""(?:\s+(?:-f|--file)\s+(?:"[^"]*"|'[^']*'|\S+))?\s*$""",)
+    # Các lệnh chỉ đụng tới file của chính nó -> chạy đồng thời được, khóa theo resources()
+    thread_safe = True
+    # Lệnh không cần file mặc định
+    FILELESS_COMMANDS = ('setfile', 'flush')
+    # Số workbook giữ mở cùng lúc
+    MAX_OPEN_BOOKS = 4
+    # Số process khi chạy lệnh trên nhiều file (-f "data/*.xlsx"), None = số core
+    GLOB_WORKERS = None
 
     def __init__(self, assistant):
         self.assistant = assistant
-        self.file = None          # file mặc định
+        self._local = threading.local()   # file của lệnh đang chạy trên từng thread
+        self._file = None         # file mặc định
+        # Trong worker process (--process) lưu ngay sau mỗi lệnh, không giữ thay đổi tới lúc thoát
+        self.books = WorkbookCache(self.MAX_OPEN_BOOKS,
+                                   write_through=getattr(assistant, 'worker_process', False))
         self.commands = {}        # registry: tên lệnh -> method
+        self._glob_pool = None    # ProcessPoolExecutor cho lệnh glob, tạo ở lần dùng đầu
+        self._glob_lock = threading.Lock()
 
         # Tự động đăng ký tất cả method bắt đầu bằng 'cmd_'
         for attr_name in dir(self):
@@ -63,95 +2206,429 @@ class ExcelProHandler:
             if target in self.commands:
                 self.commands[alias] = self.commands[target]
 
+    @property
+    def file(self):
+        """File của lệnh đang chạy (riêng từng thread), mặc định là file đặt gần nhất"""
+        return getattr(self._local, 'file', self._file)
+
+    @file.setter
+    def file(self, value):
+        self._file = value
+        self._local.file = value
+
     def can_handle(self, command: str) -> bool:
         return command.startswith('excel')
 
+    @staticmethod
+    def _split_file_flag(args):
+        """Tách -f/--file khỏi tham số: trả về (filename, các tham số còn lại)"""
+        new_args = []
+        filename = None
+        i = 0
+        while i < len(args):
+            if args[i] in ('-f', '--file'):
+                if i + 1 < len(args):
+                    filename = args[i + 1]
+                    i += 2
+                    continue
+                raise ValueError("⚠️ Thiếu tên file sau -f/--file")
+            new_args.append(args[i])
+            i += 1
+        return filename, new_args
+
+    def resources(self, command: str):
+        """Tài nguyên lệnh đụng tới khi chạy đồng thời: file excel, thêm pyplot khi vẽ chart"""
+        try:
+            filename, args = self._split_file_flag(shlex.split(command)[1:])
+        except ValueError:
+            return []
+        filename = filename or self._file
+        files = expand_glob(filename) if filename and is_glob(filename) else [filename]
+        cmd = args[0].lower() if args else ''
+        if cmd == 'copy':
+            files += args[1:3]
+        elif cmd == 'flush':
+            files = args[1:2] or self.books.paths()
+        names = [f"file:{os.path.abspath(f)}" for f in files if f]
+        if cmd == 'chart':
+            names.append('pyplot')  # pyplot dùng trạng thái toàn cục và cùng ghi chart.png
+        return names
+
+    def is_pure(self, command: str) -> bool:
+        """Lệnh có được đánh dấu @pure không (để trợ lý cache kết quả)"""
+        try:
+            _, args = self._split_file_flag(shlex.split(command)[1:])
+        except ValueError:
+            return False
+        method = self.commands.get(args[0].lower()) if args else None
+        return getattr(method, 'pure', False)
+
     def handle(self, command: str):
+        self._local.file = self._file
         try:
             # Dùng shlex để parse chuỗi có dấu ngoặc kép
             parts = shlex.split(command)
             if len(parts) < 2:
-                print("❌ Lệnh excel thiếu tham số")
-                return
-
-            # Bỏ qua 'excel' ở đầu
-            args = parts[1:]
-
-            # Xử lý flag -f / --file
-            new_args = []
-            filename = None
-            i = 0
-            while i < len(args):
-                if args[i] in ('-f', '--file'):
-                    if i + 1 < len(args):
-                        filename = args[i + 1]
-                        i += 2
-                        continue
-                    else:
-                        print("⚠️ Thiếu tên file sau -f/--file")
-                        return
-                new_args.append(args[i])
-                i += 1
+                return self.assistant.result('error', message="❌ Lệnh excel thiếu tham số")
 
-            if filename:
-                self.file = filename
-            elif self.file is None:
-                print("⚠️ Chưa chỉ định file. Dùng -f <tên_file> hoặc lệnh setfile")
-                return
+            # Bỏ qua 'excel' ở đầu, xử lý flag -f / --file
+            try:
+                filename, new_args = self._split_file_flag(parts[1:])
+            except ValueError as e:
+                return self.assistant.result('error', message=str(e))
 
             if not new_args:
-                print("❌ Thiếu tên lệnh")
-                return
+                return self.assistant.result('error', message="❌ Thiếu tên lệnh")
 
             cmd = new_args[0].lower()
             cmd_args = new_args[1:] if len(new_args) > 1 else []
+            if filename and is_glob(filename):
+                # -f "data/*.xlsx": chạy trên mọi file khớp, file mặc định giữ nguyên
+                data = self._run_glob(filename, cmd, cmd_args)
+                return self.assistant.result('ok', data=data) if data is not None else None
+            if filename:
+                self.file = filename
+            elif self.file is None and cmd not in self.FILELESS_COMMANDS:
+                return self.assistant.result(
+                    'error', message="⚠️ Chưa chỉ định file. Dùng -f <tên_file> hoặc lệnh setfile")
 
             # Tìm method trong registry
             method = self.commands.get(cmd)
             if not method:
-                print(f"❌ Lệnh không hợp lệ: {cmd}")
-                return
+                return self.assistant.result('error', message=f"❌ Lệnh không hợp lệ: {cmd}")
 
             # Gọi method, có thể có hoặc không decorator @with_worksheet
             # Một số lệnh không cần worksheet (create, setfile, copy, manual...)
-            method(cmd_args)
+            # Lệnh trả về giá trị (stat, avg, find...) -> đưa vào data của kết quả
+            data = method(cmd_args)
+            if data is not None:
+                return self.assistant.result('ok', data=data)
 
         except Exception as e:
-            print(f"⚠️ Lỗi: {e}")
+            return self.assistant.result('error', message=f"⚠️ Lỗi: {e}")
 
     # ================== ĐỊNH NGHĨA CÁC LỆNH ==================
     # Mỗi lệnh là method cmd_<tên>, với tham số args (list)
     # Nếu lệnh cần worksheet, hãy dùng decorator @with_worksheet
     # và tham số đầu tiên là ws (worksheet)
 
+    def _run_glob(self, pattern, cmd, args):
+        """
+        Chạy lệnh trên mọi file khớp glob (-f "data/*.xlsx"), song song trên process pool:
+        - Chỉ lệnh đọc (@pure: stat, avg, auto, median...); lệnh sửa file vẫn chạy từng file
+        - File đang có thay đổi chưa lưu / transaction trong trợ lý chạy ngay ở đây (thấy bản trong bộ nhớ)
+        - Kết quả gộp thành một bảng; context['glob'] = kết quả theo file + tổng hợp (summarize_results)
+        """
+        method = self.commands.get(cmd)
+        if method is None:
+            raise Exception(f"Lệnh không hợp lệ: {cmd}")
+        if not getattr(method, 'pure', False):
+            raise Exception(f"Lệnh '{cmd}' sửa file, không chạy được trên nhiều file (glob); chỉ lệnh đọc như stat, avg, auto")
+        files = expand_glob(pattern)
+        if not files:
+            print(f"⚠️ Không có file nào khớp {pattern}")
+            return None
+        local = [f for f in files if self.books.is_dirty(f) or self.books.tx_state(f)]
+        remote = [f for f in files if not (self.books.is_dirty(f) or self.books.tx_state(f))]
+        outcomes = {}
+        if len(remote) > 1 and not multiprocessing.current_process().daemon:
+            outcomes.update(zip(remote, self._glob_map(remote, cmd, args)))
+        else:
+            # Một file, hoặc trợ lý chạy plugin trong worker process (daemon không tạo được process con)
+            local = remote + local
+        if local:
+            runner = ExcelProHandler(_GlobAssistant())
+            runner.books = self.books
+            for f in local:
+                runner._local.file = f
+                try:
+                    outcomes[f] = (runner.commands[cmd](list(args)), '', None)
+                except Exception as e:
+                    outcomes[f] = (None, '', str(e))
+
+        results = {f: outcomes[f][0] for f in files}
+        errors = {f: outcomes[f][2] for f in files if outcomes[f][2] is not None}
+        self._print_glob_table(cmd, files, outcomes)
+        summary = summarize_results(results)
+        self._print_glob_summary(summary, len(files), len(errors))
+        report = {'command': cmd, 'pattern': pattern, 'results': results, 'errors': errors, 'summary': summary}
+        self.assistant.context['glob'] = report
+        return report
+
+    def _glob_map(self, files, cmd, args):
+        """(data, output, lỗi) của từng file, chạy trên process pool"""
+        workers = self.GLOB_WORKERS or os.cpu_count() or 1
+        with self._glob_lock:
+            if self._glob_pool is None:
+                module = _load_glob_module(os.path.abspath(__file__))
+                self._glob_pool = ProcessPoolExecutor(
+                    max_workers=workers,
+                    mp_context=multiprocessing.get_context('spawn'),   # như worker của trợ lý: không fork
+                    initializer=module._load_glob_module, initargs=(os.path.abspath(__file__),))
+            pool = self._glob_pool
+        chunk = max(1, len(files) // (workers * 4))
+        task = sys.modules[GLOB_MODULE].run_glob_task
+        try:
+            return list(pool.map(task, files, itertools.repeat(cmd), itertools.repeat(tuple(args)), chunksize=chunk))
+        except Exception:
+            # Process con chết (BrokenProcessPool...): bỏ pool, lần sau tạo lại
+            with self._glob_lock:
+                if self._glob_pool is pool:
+                    self._glob_pool = None
+            pool.shutdown(wait=False, cancel_futures=True)
+            raise
+
+    @staticmethod
+    def _print_glob_table(cmd, files, outcomes):
+        keys = list(dict.fromkeys(k for data, _, _ in outcomes.values() if isinstance(data, dict) for k in data))
+        header = ['file'] + (keys or [cmd])
+        rows = []
+        for f in files:
+            data, output, error = outcomes[f]
+            if data is None:
+                lines = [line for line in output.splitlines() if line.strip()]
+                note = f"⚠️ {error}" if error else (lines[-1].strip() if lines else '')
+                rows.append([f, note] + [''] * (len(header) - 2))
+            elif isinstance(data, dict):
+                rows.append([f] + [_table_cell(data.get(k)) for k in keys])
+            else:
+                rows.append([f, _table_cell(data)] + [''] * (len(header) - 2))
+        widths = [max(len(str(row[i])) for row in rows + [header]) for i in range(len(header))]
+        print(f"📂 excel {cmd} trên {len(files)} file:")
+        for row in [header] + rows:
+            print("   " + " | ".join(str(v).ljust(w) for v, w in zip(row, widths)).rstrip())
+
+    @staticmethod
+    def _print_glob_summary(summary, n_files, n_errors):
+        if 'counts' in summary:
+            counts = ", ".join(f"{value}: {n}" for value, n in summary['counts'].items())
+            print(f"Σ {n_files} file ({n_errors} lỗi) - {counts or 'không có kết quả'}")
+            return
+        # Tổng hợp phẳng (kết quả số) hoặc theo từng khóa (kết quả dict, vd stat có cả khóa 'count')
+        parts = [('', summary)] if not isinstance(summary.get('count', {}), dict) else list(summary.items())
+        print(f"Σ {n_files} file ({n_errors} lỗi)")
+        for key, part in parts:
+            label = f"{key}: " if key else ''
+            print(f"   {label}TB {part['mean']:.2f} | min {_table_cell(part['min'])} ({part['min_file']})"
+                  f" | max {_table_cell(part['max'])} ({part['max_file']})")
+
+    def shutdown(self):
+        """Trợ lý gọi khi thoát: lưu các workbook còn thay đổi, transaction chưa commit bị bỏ"""
+        if self._glob_pool is not None:
+            self._glob_pool.shutdown(cancel_futures=True)
+            self._glob_pool = None
+        for path in self.books.transactions():
+            self.books.rollback(path)
+            print(f"↩️ Transaction chưa commit trên {path} đã bị rollback")
+        for path in self.books.flush():
+            print(f"💾 Đã lưu {path}")
+
+    def cmd_begin(self, args):
+        """Bắt đầu transaction trên file hiện tại: các lệnh sau chỉ sửa trong bộ nhớ tới khi commit"""
+        self.books.begin(self.file)
+        print(f"🔒 Bắt đầu transaction trên {self.file}")
+
+    def cmd_commit(self, args):
+        """Kết thúc transaction: ghi file một lần (file tạm rồi rename)"""
+        if self.books.commit(self.file):
+            print(f"💾 Đã commit transaction, lưu {self.file}")
+        else:
+            print(f"✅ Đã commit transaction (không có thay đổi) trên {self.file}")
+
+    def cmd_rollback(self, args):
+        """Hủy transaction: bỏ mọi thay đổi từ lúc begin"""
+        self.books.rollback(self.file)
+        print(f"↩️ Đã rollback transaction trên {self.file}")
+
+    def cmd_flush(self, args):
+        """Lưu workbook đang mở có thay đổi: flush [file] (mặc định: tất cả)"""
+        if args:
+            saved = [args[0]] if self.books.save(args[0]) else []
+        else:
+            saved = self.books.flush()
+        if saved:
+            for path in saved:
+                print(f"💾 Đã lưu {path}")
+        else:
+            print("✅ Không có thay đổi nào cần lưu")
+
+    def cmd_sidecar(self, args):
+        """
+        Sidecar .<file>.cols.npz: cột số đã trích lưu cạnh file, các lệnh tính toán (stat, avg, median...)
+        ở lần chạy sau đọc thẳng sidecar thay vì parse xlsx. Tự cập nhật khi file đổi.
+        Cú pháp: excel sidecar [on|off]
+        """
+        _check_readable(self)
+        mode = args[0].lower() if args else 'on'
+        side = sidecar_path(self.file)
+        if mode == 'off':
+            try:
+                os.remove(side)
+            except FileNotFoundError:
+                print(f"✅ {self.file} chưa bật sidecar")
+                return
+            print(f"🗑️ Đã xóa sidecar {side}")
+            return
+        if mode != 'on':
+            print("⚠️ excel sidecar [on|off]")
+            return
+        if self.books.is_dirty(self.file):
+            print(f"⚠️ {self.file} còn thay đổi chưa lưu, sidecar theo bản trên đĩa (dùng excel flush trước)")
+        self.books.build_sidecar(self.file)
+        print(f"⚡ Đã ghi sidecar {side} ({os.path.getsize(side)} bytes)")
+        return side
+
     def cmd_create(self, args):
         """Tạo file Excel mới"""
         wb = Workbook()
         wb.save(self.file)
+        self.books.put(self.file, wb)
         print(f"✅ Đã tạo file {self.file}")
 
+    @staticmethod
+    def _as_row(item):
+        """Giá trị nhận từ pipeline -> một dòng excel"""
+        if isinstance(item, (list, tuple)):
+            return list(item)
+        if isinstance(item, dict):
+            return list(item.values())
+        return [item]
+
+    def _append_tracked(self, ws, row, trackers):
+        """ws.append và báo các ô của dòng vừa thêm cho index / công thức (nếu có)"""
+        ws.append(row)
+        if trackers:
+            r = ws._current_row if FAST_CELLS else ws.max_row
+            for tracker in trackers:
+                for c, value in enumerate(row, start=1):
+                    tracker.set(r, c, value)
+
     @with_worksheet
+    @incremental
     def cmd_add(self, ws, args):
-        """Thêm dòng dữ liệu"""
+        """Thêm dòng dữ liệu: add <giá_trị1> <giá_trị2> ... | add - (nhận các dòng từ pipeline)"""
         if not args:
             print("⚠️ excel add <giá_trị1> <giá_trị2> ...")
             return
+        if args == ['-']:
+            rows = self.assistant.pipe_input()
+            if rows is None:
+                print("⚠️ 'excel add -' chỉ dùng sau dấu | (vd: excel -f a.xlsx find X | excel -f b.xlsx add -)")
+                return
+            trackers = self.books.trackers(self.file, ws.parent)
+            count = 0
+            for item in rows:
+                self._append_tracked(ws, self._as_row(item), trackers)
+                count += 1
+            print(f"✅ Đã thêm {count} dòng từ pipeline")
+            return {'rows': count}
         row = []
         for x in args:
             try:
                 row.append(float(x))
             except:
                 row.append(x)
-        ws.append(row)
+        self._append_tracked(ws, row, self.books.trackers(self.file, ws.parent))
         print(f"✅ Đã thêm: {row}")
 
+    # Tên dấu phân cách dùng được với import --sep
+    SEPARATORS = {'tab': '\t', '\\t': '\t', 'space': None, 'comma': ',', 'semicolon': ';'}
+
+    def cmd_import(self, args):
+        """
+        Nạp dữ liệu từ file văn bản (CSV/TSV/cách nhau bằng khoảng trắng) hoặc stdin, đọc một lượt.
+        Cú pháp: excel import <nguồn|-> [--sep ,|;|tab|space] [--skip N] [--new]
+        - File excel chưa có hoặc --new (ghi đè): dùng write-only, bộ nhớ không phụ thuộc số dòng
+        - File đã có: thêm vào cuối sheet active (qua cache workbook, theo transaction nếu có)
+        - Kiểu từng cột (int/float/chữ) đoán một lần từ IMPORT_SAMPLE_ROWS dòng đầu
+        """
+        usage = "excel import <nguồn|-> [--sep ,|;|tab|space] [--skip N] [--new]"
+        source, sep, skip, new = None, '', 0, False
+        i = 0
+        while i < len(args):
+            if args[i] == '--new':
+                new = True
+            elif args[i] in ('--sep', '--skip') and i + 1 < len(args):
+                if args[i] == '--sep':
+                    sep = self.SEPARATORS.get(args[i + 1].lower(), args[i + 1])
+                else:
+                    skip = int(args[i + 1])
+                i += 1
+            elif source is None:
+                source = args[i]
+            else:
+                print(f"⚠️ {usage}")
+                return
+            i += 1
+        if source is None:
+            print(f"⚠️ {usage}")
+            return
+        if source != '-' and not os.path.exists(source):
+            print(f"⚠️ File nguồn không tồn tại: {source}")
+            return
+        new = new or not os.path.exists(self.file)
+
+        f = None if source == '-' else open(source, 'r', encoding='utf-8-sig', newline='')
+        try:
+            # sys.stdin có thể đã bị plugin khác bọc lại (macro chỉ cài readline): đọc qua readline
+            lines = itertools.islice(iter(sys.stdin.readline, '') if f is None else f, skip, None)
+            first = next(lines, '')
+            if sep == '':
+                sep = _guess_separator(first, None if source == '-' else source)
+            rows = _text_rows(itertools.chain([first], lines), sep)
+            sample = list(itertools.islice(rows, IMPORT_SAMPLE_ROWS))
+            converters = [_column_converter(kind) for kind in _infer_column_kinds(sample)]
+            typed = (self._typed_row(row, converters) for row in itertools.chain(sample, rows))
+            if new:
+                count = self._import_new(typed)
+            else:
+                count = self._import_append(typed)
+        finally:
+            if f is not None:
+                f.close()
+        print(f"✅ Đã nạp {count} dòng từ {'stdin' if source == '-' else source} vào {self.file}")
+        return {'rows': count}
+
+    @staticmethod
+    def _typed_row(row, converters):
+        n = len(converters)
+        return [None if not text else text if j >= n or converters[j] is None else converters[j](text)
+                for j, text in enumerate(row)]
+
+    def _import_new(self, rows):
+        """Ghi file mới bằng Workbook(write_only=True): từng dòng được đẩy thẳng ra đĩa"""
+        if self.books.tx_state(self.file):
+            raise Exception(f"{self.file} đang trong transaction, không ghi đè được (bỏ --new để thêm dòng)")
+        if self.books.is_dirty(self.file):
+            print(f"⚠️ Bỏ các thay đổi chưa lưu của {self.file} (ghi đè bằng dữ liệu import)")
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet()
+        count = 0
+        for row in rows:
+            ws.append(row)
+            count += 1
+        atomic_save(wb, self.file)
+        self.books.discard(self.file)
+        return count
+
     @with_worksheet
+    def _import_append(self, ws, rows):
+        count = 0
+        for row in rows:
+            ws.append(row)
+            count += 1
+        return count
+
+    @read_worksheet
+    @pure
     def cmd_read(self, ws, args):
-        """Đọc nội dung"""
+        """Đọc nội dung (trong pipeline: gửi từng dòng sang lệnh sau)"""
         for row in ws.iter_rows(values_only=True):
-            print(row)
+            if not self.assistant.emit(row):
+                print(row)
 
     @with_worksheet
+    @incremental
     def cmd_update(self, ws, args):
         """Cập nhật ô: update <hàng> <cột> <giá_trị>"""
         if len(args) < 3:
@@ -160,27 +2637,39 @@ class ExcelProHandler:
         r, c = int(args[0]), int(args[1])
         val = args[2]
         ws.cell(row=r, column=c).value = val
+        for tracker in self.books.trackers(self.file, ws.parent):
+            tracker.set(r, c, val)
         print("✅ Đã cập nhật")
 
     @with_worksheet
     def cmd_delete(self, ws, args):
-        """Xóa dòng: delete <hàng>"""
+        """Xóa dòng: delete <hàng> [<hàng>|<đầu>-<cuối> ...] (số dòng tính theo sheet trước khi xóa)"""
         if not args:
-            print("⚠️ excel delete <hàng>")
+            print("⚠️ excel delete <hàng> [<hàng>|<đầu>-<cuối> ...]")
             return
-        ws.delete_rows(int(args[0]))
-        print("🗑 Đã xóa dòng")
+        rows = parse_index_ranges(args)
+        compact_sheet(ws, rows=rows)
+        print("🗑 Đã xóa dòng" if len(rows) == 1 else f"🗑 Đã xóa {len(set(rows))} dòng")
 
     @with_worksheet
     def cmd_delrows(self, ws, args):
-        """Xóa khoảng dòng: delrows <hàng_đầu> <hàng_cuối>"""
-        if len(args) < 2:
-            print("⚠️ excel delrows <hàng_đầu> <hàng_cuối>")
+        """
+        Xóa khoảng dòng: delrows <hàng_đầu> <hàng_cuối> [<đầu> <cuối> ...] (hoặc dạng <đầu>-<cuối>)
+        Mọi khoảng tính theo sheet trước khi xóa và được xóa trong một lượt.
+        """
+        if not args:
+            print("⚠️ excel delrows <hàng_đầu> <hàng_cuối> [<đầu> <cuối> ...]")
+            return
+        try:
+            rows = parse_index_ranges(args, pairs=True)
+        except ValueError as e:
+            print(f"⚠️ excel delrows <hàng_đầu> <hàng_cuối> [<đầu> <cuối> ...]: {e}")
             return
-        start, end = int(args[0]), int(args[1])
-        count = end - start + 1
-        ws.delete_rows(start, count)
-        print(f"🗑 Đã xóa dòng {start} đến {end}")
+        compact_sheet(ws, rows=rows)
+        if len(args) == 2:
+            print(f"🗑 Đã xóa dòng {args[0]} đến {args[1]}")
+        else:
+            print(f"🗑 Đã xóa {len(set(rows))} dòng")
 
     @with_worksheet
     def cmd_delcolrange(self, ws, args):
@@ -193,58 +2682,114 @@ class ExcelProHandler:
             ws.cell(row=row, column=col).value = None
         print(f"🗑 Đã xóa dữ liệu cột {col}, dòng {start}-{end}")
 
-    @with_worksheet
-    def cmd_find(self, ws, args):
-        """Tìm kiếm từ khóa"""
-        if not args:
-            print("⚠️ excel find <từ_khóa>")
+    # Chế độ so khớp của find: --exact (cả ô), --prefix (ô/từ bắt đầu bằng), mặc định chứa chuỗi con
+    FIND_MODES = ('exact', 'prefix', 'substring')
+
+    @pure
+    def cmd_find(self, args):
+        """
+        Tìm kiếm từ khóa: find <từ_khóa> [--exact|--prefix|--substring]
+        (trong pipeline: gửi từng dòng khớp sang lệnh sau thay vì in)
+        File bật index (excel index): tra chỉ mục, không duyệt cả sheet.
+        """
+        mode = 'substring'
+        words = []
+        for arg in args:
+            if arg.startswith('--') and arg[2:] in self.FIND_MODES:
+                mode = arg[2:]
+            else:
+                words.append(arg)
+        if not words:
+            print("⚠️ excel find <từ_khóa> [--exact|--prefix|--substring]")
             return
-        keyword = args[0]
-        found = False
-        for row in ws.iter_rows(values_only=True):
-            if any(keyword in str(cell) for cell in row):
+        keyword = words[0]
+        _check_readable(self)
+        found = []
+
+        def visit(row):
+            if not self.assistant.emit(row):
                 print("🔍", row)
-                found = True
-        if not found:
+                found.append(row)
+
+        if self.books.is_indexed(self.file):
+            count = self._find_indexed(keyword, mode, visit)
+        else:
+            count = self._find_scan(keyword, mode, visit)
+        if not count:
             print(f"Không tìm thấy '{keyword}'")
+        return found
 
-    @with_worksheet
-    def cmd_avg(self, ws, args):
-        """Tính trung bình tất cả số"""
-        nums = []
+    @read_worksheet
+    def _find_scan(self, ws, keyword, mode, visit):
+        """Duyệt cả sheet (stream nếu file chưa mở), gọi visit với từng dòng khớp"""
+        count = 0
         for row in ws.iter_rows(values_only=True):
-            for cell in row:
-                if isinstance(cell, (int, float)):
-                    nums.append(cell)
-        if nums:
-            avg = sum(nums) / len(nums)
+            if any(cell is not None and text_matches(str(cell), keyword, mode) for cell in row):
+                count += 1
+                visit(row)
+        return count
+
+    def _find_indexed(self, keyword, mode, visit):
+        """Dòng khớp qua SheetIndex: chỉ đọc các dòng có ô khớp"""
+        index = self.books.index(self.file)
+        ws = self.books.get(self.file).active
+        rows = sorted({r for r, _ in index.find(keyword, mode)})
+        max_col = ws.max_column   # tính một lần: iter_rows không có max_col sẽ duyệt mọi ô mỗi lần gọi
+        for r in rows:
+            visit(next(ws.iter_rows(min_row=r, max_row=r, max_col=max_col, values_only=True)))
+        return len(rows)
+
+    def cmd_index(self, args):
+        """
+        Chỉ mục ngược cho find / find_replace của file hiện tại (giữ trong bộ nhớ cùng workbook).
+        Cú pháp: excel index [on|off]
+        """
+        _check_readable(self)
+        mode = args[0].lower() if args else 'on'
+        if mode == 'off':
+            self.books.set_indexed(self.file, False)
+            print(f"🗑️ Đã tắt index cho {self.file}")
+            return
+        if mode != 'on':
+            print("⚠️ excel index [on|off]")
+            return
+        self.books.set_indexed(self.file, True)
+        index = self.books.index(self.file)
+        print(f"📇 Đã dựng index cho {self.file}: {len(index.texts)} ô, {len(index.tokens)} từ, {len(index.grams)} gram")
+        return {'cells': len(index.texts), 'tokens': len(index.tokens), 'grams': len(index.grams)}
+
+    @with_columns
+    @pure
+    def cmd_avg(self, cols, args):
+        """Tính trung bình tất cả số"""
+        nums = cols.values[cols.native]
+        if nums.size:
+            avg = float(nums.mean())
             self.assistant.context['avg'] = avg
             print(f"📊 AVG = {avg}")
+            return avg
         else:
             print("⚠️ Không có số nào")
 
-    @with_worksheet
-    def cmd_avg_range(self, ws, args):
+    @with_columns
+    @pure
+    def cmd_avg_range(self, cols, args):
         """Trung bình cột theo dòng: avg_range <cột> <hàng_đầu> <hàng_cuối>"""
         if len(args) < 3:
             print("⚠️ excel avg_range <cột> <hàng_đầu> <hàng_cuối>")
             return
         col, start, end = int(args[0]), int(args[1]), int(args[2])
-        nums = []
-        for row in range(start, end + 1):
-            val = ws.cell(row=row, column=col).value
-            try:
-                nums.append(float(val))
-            except:
-                continue
-        if nums:
-            avg = sum(nums) / len(nums)
+        values, numeric, _, _ = cols.column(col, start, end)
+        nums = values[numeric]
+        if nums.size:
+            avg = float(nums.mean())
             print(f"📊 AVG (cột {col}, dòng {start}-{end}) = {avg}")
             self.assistant.context['avg_range'] = avg
+            return avg
         else:
             print("⚠️ Không có dữ liệu số trong khoảng")
 
-    @with_worksheet
+    @read_worksheet
     def cmd_chart(self, ws, args):
         """Vẽ biểu đồ"""
         data = []
@@ -255,6 +2800,7 @@ class ExcelProHandler:
         if not data:
             print("⚠️ Không có dữ liệu số")
             return
+        import matplotlib.pyplot as plt   # import ở đây: pyplot mất ~0.5s, chỉ lệnh chart cần
         plt.figure()
         plt.plot(data)
         plt.title("Excel Data Chart")
@@ -262,24 +2808,264 @@ class ExcelProHandler:
         plt.close()
         print("📈 Đã lưu chart.png")
 
-    @with_worksheet
-    def cmd_auto(self, ws, args):
-        """Quyết định BUY/WAIT dựa trên số cuối"""
-        data = []
-        for row in ws.iter_rows(values_only=True):
-            for cell in row:
-                if isinstance(cell, (int, float)):
-                    data.append(cell)
-        if len(data) < 2:
+    @with_columns
+    @pure
+    def cmd_auto(self, cols, args):
+        """
+        Quyết định BUY/WAIT dựa trên số cuối: so với trung bình các giá đóng cửa trước đó nếu hàng
+        tiêu đề có cột Close, ngược lại với mọi số trong sheet
+        """
+        close_col = find_column(cols.header, 'close', default=0)
+        if close_col:
+            values, _, native, _ = cols.column(close_col, 2)
+            data = values[native]
+        else:
+            data = cols.values[cols.native]   # các số theo thứ tự đọc (từng dòng, trái sang phải)
+        if data.size < 2:
             print("⚠️ Không đủ dữ liệu (cần ít nhất 2 số)")
             return
-        avg_prev = sum(data[:-1]) / len(data[:-1])
-        last = data[-1]
+        avg_prev = float(data[:-1].mean())
+        last = float(data[-1])
         print(f"Trung bình (trừ số cuối): {avg_prev}")
         print(f"Số cuối: {last}")
         decision = "BUY" if last < avg_prev else "WAIT"
         print(f"🤖 Quyết định: {decision}")
         self.assistant.context['decision'] = decision
+        return decision
+
+    @staticmethod
+    def _close_series(cols, args):
+        """
+        Tách --close <cột> khỏi args; trả về (các tham số còn lại, dòng sheet, giá đóng cửa) chỉ gồm
+        các dòng có giá là số. Cột Close tìm theo tiêu đề dòng 1, không có thì theo OHLCV_LAYOUT.
+        """
+        rest, close_col, i = [], None, 0
+        while i < len(args):
+            if args[i] == '--close' and i + 1 < len(args):
+                close_col = int(args[i + 1])
+                i += 2
+                continue
+            rest.append(args[i])
+            i += 1
+        close_col = close_col or find_column(cols.header, 'close')
+        values, numeric, _, _ = cols.column(close_col, 2)
+        idx = np.flatnonzero(numeric)
+        return rest, idx + 2, values[idx]
+
+    @with_worksheet
+    def cmd_indicators(self, ws, args):
+        """
+        Chỉ báo kỹ thuật trên giá đóng cửa, tính cả cột một lượt bằng NumPy và ghi thành cột mới.
+        Cú pháp: excel indicators [sma:20 ema:20 rsi:14 macd:12:26:9 bb:20:2 min:20 max:20] [--close <cột>]
+        - Không ghi chỉ báo nào -> tính bộ mặc định DEFAULT_INDICATORS
+        - Cột đã có cùng tiêu đề (chạy lại) được ghi đè, cột mới thêm sau cột cuối
+        """
+        cols = self.books.columns(self.file)
+        specs, rows, close = self._close_series(cols, args)
+        if close.size < 2:
+            print("⚠️ Không đủ dữ liệu giá đóng cửa (cần ít nhất 2 phiên)")
+            return
+        try:
+            computed = compute_indicators(close, specs or DEFAULT_INDICATORS)
+        except ValueError as e:
+            print(f"⚠️ {e}")
+            return
+        existing = {title.strip().casefold(): i for i, title in enumerate(cols.header, start=1) if title}
+        next_col = max(ws.max_column, len(cols.header)) + 1
+        latest = {}
+        for title, series in computed:
+            col = existing.get(title.casefold())
+            if col is None:
+                col, next_col = next_col, next_col + 1
+            ws.cell(row=1, column=col).value = title
+            write_column(ws, col, rows, series)
+            last = series[-1]
+            latest[title] = None if np.isnan(last) else float(last)
+        print(f"✅ Đã ghi {len(computed)} cột chỉ báo cho {close.size} phiên")
+        print("   Phiên cuối: " + " | ".join(
+            f"{title} {'-' if v is None else f'{v:.2f}'}" for title, v in latest.items()))
+        self.assistant.context['indicators'] = latest
+        return latest
+
+    @with_columns
+    @pure
+    def cmd_backtest(self, cols, args):
+        """
+        Backtest một luật trên cả lịch sử giá đóng cửa (một lượt NumPy, không vòng lặp theo phiên).
+        Cú pháp: excel backtest [sma:10:30|rsi:14:30:70|macd:12:26:9|bb:20:2] [--fee <%>] [--close <cột>]
+        Mua / bán ở giá đóng cửa phiên có tín hiệu; --fee là phí mỗi lần mua hoặc bán (%, mặc định 0).
+        """
+        args, rows, close = self._close_series(cols, args)
+        fee = 0.0
+        if '--fee' in args:
+            i = args.index('--fee')
+            fee = float(args[i + 1]) / 100
+            del args[i:i + 2]
+        rule = args[0] if args else 'sma:10:30'
+        if close.size < 2:
+            print("⚠️ Không đủ dữ liệu giá đóng cửa (cần ít nhất 2 phiên)")
+            return
+        try:
+            buy, sell = rule_signals(close, rule)
+        except ValueError as e:
+            print(f"⚠️ {e}")
+            return
+        result = backtest(close, buy, sell, fee)
+        trades = [(int(rows[a]), int(rows[b]), gain) for a, b, gain in result['trades']]
+        summary = {'trades': len(trades), 'return': result['return'], 'buy_hold': result['buy_hold'],
+                   'max_drawdown': result['max_drawdown'], 'win_rate': result['win_rate'],
+                   'exposure': result['exposure']}
+        print(f"📈 Backtest {rule} trên {close.size} phiên (phí {fee * 100:g}%):")
+        print(f"   Lợi nhuận: {summary['return']:+.2%} | Mua & giữ: {summary['buy_hold']:+.2%}")
+        print(f"   Số lệnh: {len(trades)} | Thắng: {summary['win_rate']:.0%} | "
+              f"Sụt giảm tối đa: {summary['max_drawdown']:.2%} | Thời gian giữ: {summary['exposure']:.0%}")
+        for k, (buy_row, sell_row, gain) in enumerate(trades[-10:], start=max(len(trades) - 10, 0) + 1):
+            if k == len(trades) and result['holding']:
+                print(f"   Mua dòng {buy_row} → đang giữ (dòng {sell_row}): {gain:+.2%}")
+            else:
+                print(f"   Mua dòng {buy_row} → bán dòng {sell_row}: {gain:+.2%}")
+        if len(trades) > 10:
+            print("   ... (chỉ in 10 lệnh cuối)")
+        self.assistant.context['backtest'] = dict(summary, rule=rule, trade_list=trades, holding=result['holding'])
+        return summary
+
+    def _split_output(self, args, cmd):
+        """Tách --out <file> / --sheet <tên> khỏi args; mặc định ghi file <tên>_<cmd>.xlsx cạnh file nguồn"""
+        rest, out, sheet, i = [], None, None, 0
+        while i < len(args):
+            if args[i] in ('--out', '--sheet') and i + 1 < len(args):
+                if args[i] == '--out':
+                    out = args[i + 1]
+                else:
+                    sheet = args[i + 1]
+                i += 2
+                continue
+            rest.append(args[i])
+            i += 1
+        if sheet is None and out is None:
+            out = f"{os.path.splitext(self.file)[0]}_{cmd}.xlsx"
+        if out is not None and os.path.abspath(out) == os.path.abspath(self.file):
+            raise Exception("File kết quả trùng file nguồn, dùng --sheet để ghi vào sheet mới")
+        return rest, out, sheet
+
+    @read_worksheet
+    def _aggregate(self, ws, key_specs, agg_specs, pivot=False):
+        """
+        Đọc sheet một lượt (dòng 1 là header) qua GroupAggregator, trả về (bảng kết quả, số dòng, số nhóm).
+        pivot: key_specs = [cột_hàng, cột_cột], một hàm gộp -> bảng hàng x cột.
+        """
+        rows = ws.iter_rows(values_only=True)
+        header = [None if v is None else str(v) for v in next(rows, None) or ()]
+        keys = [key for spec in key_specs for key in parse_key_spec(spec, header)]
+        aggs = [parse_agg_spec(spec, header) for spec in agg_specs]
+        if pivot and (len(keys) != 2 or len(aggs) != 1):
+            raise ValueError("pivot cần đúng một cột hàng, một cột cột và một hàm gộp")
+        key_cols = [c for c, _ in keys]
+        aggregator = GroupAggregator(keys, aggs)
+        for row in rows:
+            aggregator.add(row)
+        results = aggregator.results()
+        if not pivot:
+            table = [[_title(header, c) for c in key_cols] + [f"{agg}({_title(header, c)})" for agg, c in aggs]]
+            for key, values in results:
+                table.append(list(key if isinstance(key, tuple) else (key,)) + values)
+            return table, aggregator.rows, len(results)
+        columns = sorted({key[1] for key, _ in results}, key=_group_order)
+        position = {k: i for i, k in enumerate(columns, start=1)}
+        agg, col = aggs[0]
+        table = [[f"{agg}({_title(header, col)}) {_title(header, key_cols[0])} \\ {_title(header, key_cols[1])}"] + columns]
+        row_index = {}
+        for (row_key, col_key), values in results:
+            line = row_index.get(row_key)
+            if line is None:
+                line = row_index[row_key] = [row_key] + [None] * len(columns)
+                table.append(line)
+            line[position[col_key]] = values[0]
+        return table, aggregator.rows, len(row_index)
+
+    def _write_table(self, table, out, sheet, title):
+        """Ghi bảng kết quả: file mới (write-only, atomic) hoặc sheet mới trong workbook hiện tại"""
+        if sheet is not None:
+            self._write_sheet(table, sheet)
+            return f"{self.file} (sheet {sheet})"
+        if self.books.tx_state(out):
+            raise Exception(f"{out} đang trong transaction, không ghi đè được")
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet(title)
+        for row in table:
+            ws.append(row)
+        atomic_save(wb, out)
+        self.books.discard(out)
+        return out
+
+    @with_worksheet
+    def _write_sheet(self, ws, table, name):
+        wb = ws.parent
+        if name in wb.sheetnames:
+            if wb[name] is ws:
+                raise Exception(f"Không ghi đè được sheet đang đọc: {name}")
+            del wb[name]
+        target = wb.create_sheet(name)
+        for row in table:
+            target.append(row)
+
+    def _print_table(self, table, limit=10):
+        """In thử tối đa limit dòng, limit cột đầu của bảng kết quả"""
+        for row in table[:limit + 1]:
+            more = " | ..." if len(row) > limit else ""
+            print("   " + " | ".join(_table_cell(v) for v in row[:limit]) + more)
+        if len(table) > limit + 1:
+            print(f"   ... ({len(table) - 1 - limit} dòng nữa)")
+
+    def cmd_groupby(self, args):
+        """
+        Gom nhóm theo cột khóa: một lượt đọc, hash theo khóa, bộ nhớ theo số nhóm chứ không theo số dòng.
+        Cú pháp: excel groupby <cột_khóa>[,<cột>...][:date] <hàm>:<cột> ... [--out <file.xlsx> | --sheet <tên>]
+        Hàm: sum, mean, count, min, max, first, last. Cột theo số hoặc tiêu đề dòng 1 (dòng 1 là header).
+        Vd: excel groupby ticker sum:volume mean:close last:close
+            excel groupby time:date count:1 --sheet theo_ngay
+        - Mặc định ghi file mới <tên>_groupby.xlsx (file nguồn chưa mở được đọc read-only, kết quả ghi write-only)
+        - --sheet: ghi vào sheet mới trong workbook hiện tại
+        """
+        _check_readable(self)
+        args, out, sheet = self._split_output(args, 'groupby')
+        if len(args) < 2:
+            print("⚠️ excel groupby <cột_khóa> <hàm>:<cột> ... [--out <file.xlsx> | --sheet <tên>]")
+            return
+        try:
+            table, n_rows, n_groups = self._aggregate([args[0]], args[1:])
+        except ValueError as e:
+            print(f"⚠️ {e}")
+            return
+        target = self._write_table(table, out, sheet, 'groupby')
+        print(f"✅ Đã gom {n_rows} dòng thành {n_groups} nhóm → {target}")
+        self._print_table(table)
+        summary = {'rows': n_rows, 'groups': n_groups, 'out': target}
+        self.assistant.context['groupby'] = summary
+        return summary
+
+    def cmd_pivot(self, args):
+        """
+        Bảng pivot: giá trị gộp theo từng cặp (cột_hàng, cột_cột), một lượt đọc như groupby.
+        Cú pháp: excel pivot <cột_hàng>[:date] <cột_cột> <hàm>:<cột> [--out <file.xlsx> | --sheet <tên>]
+        Vd: excel pivot time:date ticker sum:volume
+        """
+        _check_readable(self)
+        args, out, sheet = self._split_output(args, 'pivot')
+        if len(args) != 3:
+            print("⚠️ excel pivot <cột_hàng> <cột_cột> <hàm>:<cột> [--out <file.xlsx> | --sheet <tên>]")
+            return
+        try:
+            table, n_rows, n_groups = self._aggregate(args[:2], args[2:], pivot=True)
+        except ValueError as e:
+            print(f"⚠️ {e}")
+            return
+        target = self._write_table(table, out, sheet, 'pivot')
+        print(f"✅ Pivot {n_rows} dòng: {n_groups} hàng x {len(table[0]) - 1} cột → {target}")
+        self._print_table(table)
+        summary = {'rows': n_rows, 'groups': n_groups, 'out': target}
+        self.assistant.context['pivot'] = summary
+        return summary
 
     def cmd_copy(self, args):
         """Sao chép file: copy [nguồn] đích"""
@@ -294,8 +3080,9 @@ class ExcelProHandler:
         if not os.path.exists(source):
             print(f"⚠️ File nguồn không tồn tại: {source}")
             return
-        wb = load_workbook(source)
+        wb = self.books.get(source)   # gồm cả thay đổi chưa lưu của file nguồn
         wb.save(dest)
+        self.books.discard(dest)
         print(f"✅ Đã sao chép {source} -> {dest}")
 
     def cmd_setfile(self, args):
@@ -352,7 +3139,8 @@ class ExcelProHandler:
             print(f"⚠️ File {self.file} chưa tồn tại, sẽ tạo mới.")
             wb = Workbook()
             wb.save(self.file)
-        wb = load_workbook(self.file)
+            self.books.put(self.file, wb)
+        wb = self.books.get(self.file)
         ws = wb.active
         try:
             num_cols = int(input("Nhập số cột dữ liệu: "))
@@ -383,20 +3171,24 @@ class ExcelProHandler:
             row_count += 1
             print(f"✅ Đã thêm dòng {row_count}")
         if row_count > 0:
-            wb.save(self.file)
+            self.books.mark_dirty(self.file, wb)
+            self.books.save(self.file)
             print(f"💾 Đã lưu {row_count} dòng vào {self.file}")
         else:
             print("Không có dữ liệu nào được thêm.")
 
     @with_worksheet
     def cmd_delcol(self, ws, args):
-        """Xóa hẳn một cột: delcol <cột>"""
+        """Xóa hẳn cột: delcol <cột> [<cột>|<đầu>-<cuối> ...] (số cột tính theo sheet trước khi xóa)"""
         if not args:
-            print("⚠️ excel delcol <cột>")
+            print("⚠️ excel delcol <cột> [<cột>|<đầu>-<cuối> ...]")
             return
-        col = int(args[0])
-        ws.delete_cols(col)
-        print(f"🗑 Đã xóa cột {col}")
+        cols = parse_index_ranges(args)
+        compact_sheet(ws, cols=cols)
+        if len(cols) == 1:
+            print(f"🗑 Đã xóa cột {cols[0]}")
+        else:
+            print(f"🗑 Đã xóa cột {', '.join(map(str, sorted(set(cols))))}")
 
     @with_worksheet
     def cmd_autofit(self, ws, args):
@@ -412,28 +3204,28 @@ class ExcelProHandler:
                 print("⚠️ Tham số cột phải là số")
                 return
         else:
-            # Xác định cột cuối cùng có dữ liệu
-            max_col = 0
-            for row in ws.iter_rows(values_only=True):
-                for idx, cell in enumerate(row, start=1):
-                    if cell is not None and idx > max_col:
-                        max_col = idx
+            columns = None
+
+        # Một lượt qua toàn sheet: độ dài lớn nhất của mọi cột cùng lúc
+        lengths = [0] * ws.max_column
+        for row in ws.iter_rows(values_only=True):
+            for idx, val in enumerate(row):
+                if val is not None:
+                    length = len(str(val))
+                    if length > lengths[idx]:
+                        lengths[idx] = length
+        if columns is None:
+            # Các cột tới cột cuối cùng có dữ liệu
+            max_col = max((idx for idx, length in enumerate(lengths, start=1) if length), default=0)
             if max_col == 0:
                 print("⚠️ Không có dữ liệu")
                 return
             columns = list(range(1, max_col + 1))
 
         for col in columns:
-            max_length = 0
-            col_letter = ws.cell(row=1, column=col).column_letter
-            for row in range(1, ws.max_row + 1):
-                val = ws.cell(row=row, column=col).value
-                if val is not None:
-                    length = len(str(val))
-                    if length > max_length:
-                        max_length = length
+            max_length = lengths[col - 1] if col <= len(lengths) else 0
             adjusted_width = min(max(max_length + 2, 8), 50)
-            ws.column_dimensions[col_letter].width = adjusted_width
+            ws.column_dimensions[get_column_letter(col)].width = adjusted_width
         print(f"✅ Đã tự động khớp độ rộng cho {len(columns)} cột")
 
     @with_worksheet
@@ -446,27 +3238,17 @@ class ExcelProHandler:
             print("⚠️ excel colorminmax <cột>")
             return
         col = int(args[0])
-        min_val = None
-        max_val = None
-        min_cells = []
-        max_cells = []
-        for row in range(2, ws.max_row + 1):
-            cell = ws.cell(row=row, column=col)
-            val = cell.value
-            if isinstance(val, (int, float)):
-                if min_val is None or val < min_val:
-                    min_val = val
-                    min_cells = [cell]
-                elif val == min_val:
-                    min_cells.append(cell)
-                if max_val is None or val > max_val:
-                    max_val = val
-                    max_cells = [cell]
-                elif val == max_val:
-                    max_cells.append(cell)
-        if min_val is None:
+        values, _, native, _ = self.books.columns(self.file).column(col, 2)
+        if not native.any():
             print("⚠️ Không có dữ liệu số trong cột")
             return
+        nums = values[native]
+        # Vị trí min/max tìm trên mảng, chỉ chạm tới đúng các ô cần tô
+        min_rows = np.flatnonzero(native & (values == nums.min())) + 2
+        max_rows = np.flatnonzero(native & (values == nums.max())) + 2
+        min_cells = [ws.cell(row=int(r), column=col) for r in min_rows]
+        max_cells = [ws.cell(row=int(r), column=col) for r in max_rows]
+        min_val, max_val = min_cells[0].value, max_cells[0].value
         min_fill = PatternFill(start_color="90EE90", end_color="90EE90", fill_type="solid")
         max_fill = PatternFill(start_color="FFC0CB", end_color="FFC0CB", fill_type="solid")
         for cell in min_cells:
@@ -490,6 +3272,7 @@ class ExcelProHandler:
     # ================== THÊM CÁC CHỨC NĂNG QUAN TRỌNG KHÁC ==================
     
     @with_worksheet
+    @incremental
     def cmd_find_replace(self, ws, args):
         """
         Tìm và thay thế chuỗi trong toàn bộ worksheet.
@@ -501,11 +3284,19 @@ class ExcelProHandler:
         find_str = args[0].strip('"')
         replace_str = args[1].strip('"')
         count = 0
-        for row in ws.iter_rows():
-            for cell in row:
-                if cell.value and isinstance(cell.value, str) and find_str in cell.value:
-                    cell.value = cell.value.replace(find_str, replace_str)
-                    count += 1
+        index = self.books.index(self.file) if self.books.is_indexed(self.file) else None
+        trackers = self.books.trackers(self.file, ws.parent)
+        if index is not None:
+            # Chỉ đụng tới các ô index báo có chứa find_str
+            cells = (ws.cell(row=r, column=c) for r, c in index.find(find_str))
+        else:
+            cells = (cell for row in ws.iter_rows() for cell in row)
+        for cell in cells:
+            if cell.value and isinstance(cell.value, str) and find_str in cell.value:
+                cell.value = cell.value.replace(find_str, replace_str)
+                for tracker in trackers:
+                    tracker.set(cell.row, cell.column, cell.value)
+                count += 1
         print(f"✅ Đã thay thế '{find_str}' → '{replace_str}' trong {count} ô")
     
     
@@ -515,62 +3306,148 @@ class ExcelProHandler:
         Xóa tất cả các dòng hoàn toàn trống.
         Cú pháp: excel remove_empty_rows
         """
-        rows_to_delete = []
-        for row_idx in range(1, ws.max_row + 1):
-            is_empty = True
-            for col_idx in range(1, ws.max_column + 1):
-                if ws.cell(row=row_idx, column=col_idx).value is not None:
-                    is_empty = False
-                    break
-            if is_empty:
-                rows_to_delete.append(row_idx)
-        # Xóa từ dưới lên để tránh ảnh hưởng chỉ số
-        for row_idx in reversed(rows_to_delete):
-            ws.delete_rows(row_idx)
+        filled = filled_rows(ws)
+        rows_to_delete = [r for r in range(1, ws.max_row + 1) if r not in filled]
+        # Xóa tất cả trong một lượt: mỗi ô còn lại chỉ dời một lần
+        compact_sheet(ws, rows=rows_to_delete)
         print(f"🗑 Đã xóa {len(rows_to_delete)} dòng trống")
     
     
-    @with_worksheet
-    def cmd_sort(self, ws, args):
+    # Số dòng dữ liệu tối đa sắp xếp trong bộ nhớ; file lớn hơn dùng sắp xếp ngoài (--run N để đổi)
+    SORT_MEMORY_ROWS = 200000
+
+    def cmd_sort(self, args):
         """
-        Sắp xếp dữ liệu theo một cột (có header dòng 1).
-        Cú pháp: excel sort <cột> [asc|desc]
-        Mặc định: asc (tăng dần)
+        Sắp xếp dữ liệu theo một hoặc nhiều cột (có header dòng 1).
+        Cú pháp: excel sort <cột> [asc|desc] [<cột> [asc|desc] ...] [--run N]
+        Vd: excel sort 3 desc 1 -> cột 3 giảm dần, trùng thì cột 1 tăng dần. Mặc định: asc
+        So sánh theo kiểu như Excel: số < ngày < chữ < TRUE/FALSE, ô trống luôn ở cuối.
+        - Workbook đang mở hoặc không quá SORT_MEMORY_ROWS (hoặc N) dòng: sắp trong bộ nhớ, dời nguyên ô (cả style)
+        - File lớn hơn, một sheet, chưa mở: sắp xếp ngoài (run N dòng ra file tạm rồi merge), ghi lại chỉ giá trị
+        - Sheet có công thức, conditional formatting...: chỉ ghi lại giá trị theo thứ tự mới, định dạng đứng yên;
+          merged cell trong vùng dữ liệu (từ dòng 2) bị từ chối, file giữ nguyên
         """
-        if not args:
-            print("⚠️ excel sort <cột> [asc|desc]")
-            return
-        try:
-            col = int(args[0])
-        except ValueError:
-            print("⚠️ Cột phải là số")
+        usage = "excel sort <cột> [asc|desc] [<cột> [asc|desc] ...] [--run N]"
+        keys = []
+        run_rows = self.SORT_MEMORY_ROWS
+        i = 0
+        while i < len(args):
+            arg = args[i].lower()
+            if arg == '--run' and i + 1 < len(args):
+                run_rows = max(int(args[i + 1]), 1)
+                i += 2
+                continue
+            if arg in ('asc', 'desc'):
+                if not keys:
+                    print(f"⚠️ {usage}")
+                    return
+                keys[-1] = (keys[-1][0], arg == 'desc')
+            else:
+                col, _, order = arg.partition(':')
+                try:
+                    col = int(col)
+                except ValueError:
+                    print("⚠️ Cột phải là số")
+                    return
+                if col < 1:
+                    print("⚠️ Cột phải >= 1")
+                    return
+                keys.append((col, order == 'desc'))
+            i += 1
+        if not keys:
+            print(f"⚠️ {usage}")
             return
-        order = args[1].lower() if len(args) > 1 else 'asc'
-        reverse = (order == 'desc')
-        
-        # Lấy dữ liệu từ dòng 2 trở đi (bỏ qua header)
-        data_rows = []
-        for row in range(2, ws.max_row + 1):
-            cell_val = ws.cell(row=row, column=col).value
-            row_data = [ws.cell(row=row, column=c).value for c in range(1, ws.max_column + 1)]
-            data_rows.append((cell_val, row_data))
-        
-        # Sắp xếp
-        try:
-            data_rows.sort(key=lambda x: x[0] if x[0] is not None else '', reverse=reverse)
-        except TypeError:
-            # Nếu có mixed types, ép về string để so sánh
-            data_rows.sort(key=lambda x: str(x[0]) if x[0] is not None else '', reverse=reverse)
-        
-        # Ghi lại dữ liệu
-        for new_row_idx, (_, row_data) in enumerate(data_rows, start=2):
-            for col_idx, val in enumerate(row_data, start=1):
-                ws.cell(row=new_row_idx, column=col_idx).value = val
-        print(f"✅ Đã sắp xếp theo cột {col} ({order})")
-    
-    
+        _check_readable(self)
+        count = None
+        if self.books.peek(self.file) is None:
+            count = self._sort_external(keys, run_rows)
+        if count is None:
+            count = self._sort_in_memory(keys)
+        desc = ', '.join(f"{col} ({'desc' if d else 'asc'})" for col, d in keys)
+        print(f"✅ Đã sắp xếp theo cột {desc}")
+        return {'rows': count}
+
     @with_worksheet
-    def cmd_stat(self, ws, args):
+    def _sort_in_memory(self, ws, keys):
+        """
+        Gom ô theo dòng một lượt, sắp xếp khóa rồi dời mỗi ô một lần (như compact_sheet).
+        Sheet có coordinate_features (công thức, conditional formatting...): như sort trước đây, chỉ ghi lại
+        giá trị theo thứ tự mới, định dạng và các vùng theo tọa độ đứng yên (_sort_values).
+        """
+        by_row = {}
+        for (r, c), cell in sheet_cells(ws).items():
+            if r > 1:
+                by_row.setdefault(r, {})[c] = cell
+        items = []
+        for r in range(2, ws.max_row + 1):
+            cells = by_row.get(r, {})
+            values = [cells[col].value if col in cells else None for col, _ in keys]
+            values.append(r)
+            items.append(values)
+        sort_rows(items, [(i, desc) for i, (_, desc) in enumerate(keys)])
+        new_row = {item[-1]: r for r, item in enumerate(items, start=2)}
+        if coordinate_features(ws):
+            self._sort_values(ws, by_row, new_row)
+            return len(items)
+        if not FAST_CELLS:
+            _relocate(ws, lambda r, c: (new_row.get(r, r), c))
+            return len(items)
+        cells = {}
+        for (r, c), cell in ws._cells.items():
+            if r > 1:
+                r = cell.row = new_row[r]
+            cells[r, c] = cell
+        _place(ws, cells)
+        return len(items)
+
+    @staticmethod
+    def _sort_values(ws, by_row, new_row):
+        """Ghi lại giá trị các dòng dữ liệu theo thứ tự mới (by_row: dòng cũ -> {cột: ô}), ô giữ nguyên chỗ"""
+        for rng in ws.merged_cells.ranges:
+            if rng.max_row > 1:
+                raise Exception(f"Không thể sắp xếp: vùng dữ liệu có merged cell {rng.coord}")
+        max_col = ws.max_column
+        values = {r: {c: cell.value for c, cell in cells.items()} for r, cells in by_row.items()}
+        for r, nr in new_row.items():
+            if r == nr:
+                continue
+            row = values.get(r, {})
+            for c in range(1, max_col + 1):
+                v = row.get(c)
+                if v is not None or c in by_row.get(nr, {}):
+                    ws.cell(row=nr, column=c).value = v
+
+    def _sort_external(self, keys, run_rows):
+        """
+        Sắp xếp ngoài cho file lớn chưa mở: đọc read_only, external_sort, ghi write-only rồi atomic_save.
+        Trả về None nếu không dùng được (nhiều sheet, không quá run_rows dòng, không rõ kích thước).
+        """
+        wb = load_workbook(self.file, read_only=True)
+        try:
+            ws = wb.active
+            if len(wb.sheetnames) != 1 or not ws.max_row or ws.max_row - 1 <= run_rows:
+                return None
+            print(f"📦 {ws.max_row - 1} dòng > {run_rows}: sắp xếp ngoài (chỉ giữ giá trị, không giữ định dạng)")
+            rows = ws.iter_rows(values_only=True)
+            header = next(rows, None)
+            out = Workbook(write_only=True)
+            ws_out = out.create_sheet(ws.title)
+            if header is not None:
+                ws_out.append(header)
+            count = 0
+            for row in external_sort(rows, [(col - 1, desc) for col, desc in keys], run_rows):
+                ws_out.append(row)
+                count += 1
+        finally:
+            wb.close()
+        atomic_save(out, self.file)
+        self.books.discard(self.file)
+        return count
+
+
+    @with_columns
+    @pure
+    def cmd_stat(self, cols, args):
         """
         Thống kê cột (bỏ qua dòng header).
         Cú pháp: excel stat <cột>
@@ -580,25 +3457,17 @@ class ExcelProHandler:
             print("⚠️ excel stat <cột>")
             return
         col = int(args[0])
-        values = []
-        null_count = 0
-        for row in range(2, ws.max_row + 1):
-            val = ws.cell(row=row, column=col).value
-            if val is None:
-                null_count += 1
-            else:
-                try:
-                    values.append(float(val))
-                except (ValueError, TypeError):
-                    pass  # bỏ qua giá trị không phải số
-        if not values:
+        values, numeric, _, null = cols.column(col, 2)
+        nums = values[numeric]   # bỏ qua giá trị không phải số
+        null_count = int(null.sum())
+        if not nums.size:
             print("⚠️ Không có dữ liệu số trong cột")
             return
-        total = sum(values)
-        avg_val = total / len(values)
-        min_val = min(values)
-        max_val = max(values)
-        count = len(values)
+        total = float(nums.sum())
+        count = int(nums.size)
+        avg_val = total / count
+        min_val = float(nums.min())
+        max_val = float(nums.max())
         print(f"📊 Thống kê cột {col}:")
         print(f"   Tổng: {total}")
         print(f"   TB  : {avg_val:.2f}")
@@ -608,6 +3477,65 @@ class ExcelProHandler:
         print(f"   Ô trống: {null_count}")
         # Lưu vào context
         self.assistant.context[f'stat_col_{col}'] = {'sum': total, 'avg': avg_val, 'min': min_val, 'max': max_val}
+        return {'sum': total, 'avg': avg_val, 'min': min_val, 'max': max_val, 'count': count, 'null': null_count}
+
+    def _column_numbers(self, cols, args, usage):
+        """Các số của cột args[0] (bỏ dòng header), None nếu thiếu tham số / không có số"""
+        if not args:
+            print(f"⚠️ {usage}")
+            return None
+        values, numeric, _, _ = cols.column(int(args[0]), 2)
+        nums = values[numeric]
+        if not nums.size:
+            print("⚠️ Không có dữ liệu số trong cột")
+            return None
+        return nums
+
+    @with_columns
+    @pure
+    def cmd_median(self, cols, args):
+        """Trung vị của cột (bỏ dòng header): median <cột>"""
+        nums = self._column_numbers(cols, args, "excel median <cột>")
+        if nums is None:
+            return
+        value = float(np.median(nums))
+        print(f"📊 Trung vị cột {args[0]} = {value}")
+        self.assistant.context[f'median_col_{args[0]}'] = value
+        return value
+
+    @with_columns
+    @pure
+    def cmd_std(self, cols, args):
+        """Độ lệch chuẩn mẫu (như STDEV.S) của cột (bỏ dòng header): std <cột>"""
+        nums = self._column_numbers(cols, args, "excel std <cột>")
+        if nums is None:
+            return
+        if nums.size < 2:
+            print("⚠️ Cần ít nhất 2 số")
+            return
+        value = float(nums.std(ddof=1))
+        print(f"📊 Độ lệch chuẩn cột {args[0]} = {value}")
+        self.assistant.context[f'std_col_{args[0]}'] = value
+        return value
+
+    @with_columns
+    @pure
+    def cmd_percentile(self, cols, args):
+        """Phân vị p (0-100, nội suy tuyến tính như PERCENTILE.INC) của cột: percentile <cột> <p>"""
+        if len(args) < 2:
+            print("⚠️ excel percentile <cột> <p>")
+            return
+        nums = self._column_numbers(cols, args, "excel percentile <cột> <p>")
+        if nums is None:
+            return
+        p = float(args[1])
+        if not 0 <= p <= 100:
+            print("⚠️ p phải trong khoảng 0-100")
+            return
+        value = float(np.percentile(nums, p))
+        print(f"📊 Phân vị {p:g} cột {args[0]} = {value}")
+        self.assistant.context[f'percentile_col_{args[0]}'] = value
+        return value
     
     
     @with_worksheet
@@ -615,25 +3543,14 @@ class ExcelProHandler:
         """
         Chuyển vị dữ liệu (hàng thành cột, cột thành hàng).
         Cú pháp: excel transpose
+        Sheet có công thức, merged cell, conditional formatting...: chỉ chuyển vị giá trị như trước (xem transpose_sheet).
         """
         max_row = ws.max_row
         max_col = ws.max_column
         if max_row == 0 or max_col == 0:
             print("⚠️ Không có dữ liệu để chuyển vị")
             return
-        # Đọc toàn bộ dữ liệu
-        data = []
-        for r in range(1, max_row + 1):
-            row_data = []
-            for c in range(1, max_col + 1):
-                row_data.append(ws.cell(row=r, column=c).value)
-            data.append(row_data)
-        # Xóa nội dung cũ
-        ws.delete_rows(1, ws.max_row)
-        # Ghi dữ liệu đã chuyển vị
-        for new_c in range(1, len(data) + 1):
-            for new_r in range(1, len(data[0]) + 1):
-                ws.cell(row=new_r, column=new_c).value = data[new_c-1][new_r-1]
+        transpose_sheet(ws)
         print(f"✅ Đã chuyển vị ma trận {max_row}x{max_col} → {max_col}x{max_row}")
     
     
@@ -646,8 +3563,8 @@ class ExcelProHandler:
         if not args:
             print("⚠️ excel merge_sheets <tên_sheet1> <tên_sheet2> ...")
             return
-        wb = load_workbook(self.file)  # lấy lại workbook gốc
-        target_ws = wb.active  # sheet đang active
+        wb = ws.parent  # workbook chứa sheet hiện tại
+        target_ws = ws  # sheet đang active
         header = None
         # Dòng bắt đầu ghi (giả sử sheet hiện tại có thể có header)
         current_row = target_ws.max_row + 1 if target_ws.max_row > 0 else 1
@@ -673,10 +3590,10 @@ class ExcelProHandler:
                     val = src_ws.cell(row=r, column=c).value
                     target_ws.cell(row=current_row, column=c).value = val
                 current_row += 1
-        wb.save(self.file)
         print(f"✅ Đã hợp nhất {len(args)} sheet vào sheet hiện tại")
 
     @with_worksheet
+    @incremental
     def cmd_formula(self, ws, args):
         """
         Gán công thức cho một ô.
@@ -699,8 +3616,43 @@ class ExcelProHandler:
         if not formula.startswith('='):
             formula = '=' + formula
     
+        try:
+            parse_formula(formula)
+        except FormulaSyntaxError as e:
+            print(f"⚠️ Công thức không hợp lệ: {e}")
+            return
         ws.cell(row=row, column=col).value = formula
-        print(f"✅ Đã gán công thức '{formula}' vào ô ({row},{col})")
+        for tracker in self.books.trackers(self.file, ws.parent):
+            tracker.set(row, col, formula)
+        value = self.books.formulas(self.file).value(row, col)
+        print(f"✅ Đã gán công thức '{formula}' vào ô ({row},{col}) = {value}")
+        return value
+
+    @with_worksheet
+    @pure
+    def cmd_calc(self, ws, args):
+        """
+        Tính công thức trong bộ nhớ (openpyxl không tính công thức).
+        Cú pháp: excel calc            -> mọi ô công thức và giá trị
+                 excel calc <hàng> <cột> -> giá trị của một ô
+        Chỉ công thức bị ảnh hưởng bởi các ô đã sửa (update/add/formula) mới được tính lại.
+        """
+        engine = self.books.formulas(self.file)
+        if len(args) >= 2:
+            row, col = int(args[0]), int(args[1])
+            value = engine.value(row, col)
+            print(f"🧮 {get_column_letter(col)}{row} = {value}")
+            return value
+        engine.recalc()
+        if not engine.formulas:
+            print("📭 Sheet không có công thức")
+            return
+        values = {}
+        for (r, c) in sorted(engine.formulas):
+            ref = f"{get_column_letter(c)}{r}"
+            values[ref] = engine.values.get((r, c))
+            print(f"🧮 {ref} {ws.cell(row=r, column=c).value} = {values[ref]}")
+        return values
 
 def register(assistant):
     assistant.handlers.append(ExcelProHandler(assistant))
@@ -726,6 +3678,26 @@ plugin_info = {
         'excel -f data.xlsx comment 2 3 "Đây là ghi chú"',
         'excel -f data.xlsx manual',
         'excel setfile myfile.xlsx',
+        'excel flush',                          # lưu các workbook đang mở có thay đổi
+        'excel -f data.xlsx begin',             # transaction: các lệnh sau chỉ sửa trong bộ nhớ
+        'excel -f data.xlsx commit',            # ghi một lần (atomic)
+        'excel -f data.xlsx rollback',          # bỏ mọi thay đổi từ lúc begin
+        'excel -f data.xlsx median 3',          # trung vị cột 3
+        'excel -f data.xlsx std 3',             # độ lệch chuẩn cột 3
+        'excel -f data.xlsx percentile 3 90',   # phân vị 90 cột 3
+        'excel -f data.xlsx sidecar',           # lưu cột số cạnh file, lần chạy sau stat/avg không parse xlsx
+        'excel -f data.xlsx sidecar off',       # xóa sidecar
+        'excel -f data.xlsx import data.csv',   # nạp CSV/TSV/txt một lượt (file mới: write-only)
+        'excel -f bid.xlsx import bid.txt --skip 37 --new',  # bỏ 37 dòng đầu, ghi đè file
+        'excel -f data.xlsx import - --sep tab',  # đọc từ stdin
+        'excel -f data.xlsx delete 2 5 9-12',   # xóa nhiều dòng một lượt (số dòng theo sheet trước khi xóa)
+        'excel -f data.xlsx delrows 1 37 284 285',  # nhiều khoảng dòng
+        'excel -f data.xlsx delcol 7 8',        # xóa cột 7 và 8
+        'excel -f data.xlsx sort 3 desc 1',     # cột 3 giảm dần, trùng thì cột 1 tăng dần
+        'excel -f data.xlsx index',             # dựng chỉ mục cho find / find_replace
+        'excel -f data.xlsx find Hà --prefix',  # ô hoặc từ bắt đầu bằng "Hà" (--exact: đúng cả ô)
+        'excel -f data.xlsx find Hà | excel -f ha.xlsx add -',  # pipeline: dòng khớp thêm vào file khác
+        'excel -f big.xlsx sort 2 --run 50000', # file lớn: sắp xếp ngoài theo run 50000 dòng
         'excel copy backup.xlsx',
         'excel copy source.xlsx dest.xlsx',
         'excel -f data.xlsx autofit',           # tự động tất cả
@@ -750,6 +3722,17 @@ plugin_info = {
     'excel -f data.xlsx merge_sheets Sales Inventory'
         'excel -f data.xlsx formula 2 3 "=A1+B1"', # công thức cho ô
     'excel -f data.xlsx formula 4 1 "SUM(A2:A3)"', # công thức cho ô
+    'excel -f data.xlsx calc', # giá trị mọi ô công thức (tính trong bộ nhớ)
+    'excel -f data.xlsx calc 4 1', # giá trị ô công thức A4
+    'excel -f "data/*.xlsx" stat 5', # chạy trên mọi file khớp, song song theo số core
+    'excel -f "data/*.xlsx" auto',
+    'excel -f fpt.xlsx indicators', # SMA, EMA, RSI, MACD, Bollinger, min/max 20 phiên trên cột Close
+    'excel -f fpt.xlsx indicators sma:50 rsi:14 bb:20:2',
+    'excel -f fpt.xlsx backtest sma:10:30 --fee 0.15', # luật giao cắt SMA, phí 0.15%/lần
+    'excel -f "data/*.xlsx" backtest rsi:14:30:70',
+    'excel -f trades.xlsx groupby ticker sum:volume mean:price count:price', # -> trades_groupby.xlsx
+    'excel -f trades.xlsx groupby time:date first:price last:price --sheet theo_ngay',
+    'excel -f trades.xlsx pivot time:date ticker sum:volume --out pivot.xlsx',
 
 
     ],
@@ -7,6 +7,7 @@ import time
 import builtins
 import random
 import re
+import threading
 from abc import ABC, abstractmethod
 from typing import List, Dict, Any, Optional, Tuple, Callable
 
@@ -15,7 +16,25 @@ from typing import List, Dict, Any, Optional, Tuple, Callable
 # ==============================
 macro_folder = 'macros'
 os.makedirs(macro_folder, exist_ok=True)
-recorder_is_playing = False
+recorder_is_playing = 0   # số macro đang chạy (có thể chạy đồng thời trên nhiều thread)
+_playing_lock = threading.Lock()
+# Hàng đợi INPUT của macro đang chạy trên từng thread; builtins.input được thay bằng
+# _playback_input trong lúc có macro chạy để mỗi thread lấy đúng hàng đợi của mình
+_playback = threading.local()
+_saved_input: Callable = builtins.input
+
+def _playback_input(prompt: str = '') -> str:
+    helper = getattr(_playback, 'auto_input', None)
+    if helper is None:
+        return _saved_input(prompt)
+    return helper.get_input(prompt)
+
+def _current_input() -> Callable:
+    """input dự phòng cho macro mới: hàng đợi của macro ngoài (cùng thread) hoặc input gốc"""
+    helper = getattr(_playback, 'auto_input', None)
+    if helper is not None:
+        return helper.get_input
+    return _saved_input if builtins.input is _playback_input else builtins.input
 
 # ==============================
 # 1b. Exception cho break/continue
@@ -1218,22 +1237,31 @@ class MacroExecutor:
         self.ctx = ctx
 
     def execute(self, root: BlockCommand) -> None:
-        global recorder_is_playing
-        recorder_is_playing = True
+        global recorder_is_playing, _saved_input
+        with _playing_lock:
+            if recorder_is_playing == 0:
+                _saved_input = builtins.input
+                builtins.input = _playback_input
+            recorder_is_playing += 1
+        outer = getattr(_playback, 'auto_input', None)
+        _playback.auto_input = self.ctx.auto_input
         try:
-            original_input = builtins.input
-            builtins.input = self.ctx.auto_input.get_input
             root.execute(self.ctx)
         except AssertionFailedError as e:
             print(f"❌ ASSERT lỗi: {e}")
         finally:
-            builtins.input = original_input
-            recorder_is_playing = False
+            _playback.auto_input = outer
+            with _playing_lock:
+                recorder_is_playing -= 1
+                if recorder_is_playing == 0:
+                    builtins.input = _saved_input
 
 # ==============================
 # 9. MacroCommandHandler
 # ==============================
 class MacroCommandHandler:
+    command_prefixes = ('ghi macro ', 'dừng ghi macro', 'chạy macro ')
+
     def __init__(self, assistant):
         self.assistant = assistant
         self._original_input = sys.stdin
@@ -1252,6 +1280,27 @@ class MacroCommandHandler:
     def can_handle(self, command: str) -> bool:
         return command.startswith(('ghi macro ', 'dừng ghi macro', 'chạy macro '))
 
+    @staticmethod
+    def _parse_play(rest: str) -> Tuple[str, float]:
+        """'<tên macro> [delay]' -> (tên, delay)"""
+        delay = 1.0
+        macro_name = rest
+        if ' ' in rest:
+            parts = rest.split()
+            try:
+                delay = float(parts[-1])
+                macro_name = rest[:rest.rfind(parts[-1])].strip()
+            except ValueError:
+                delay = 1.0
+        return macro_name, delay
+
+    def resources(self, command: str) -> List[str]:
+        """Khi chạy đồng thời: mỗi macro (theo tên) chạy một lần tại một thời điểm, recorder dùng chung"""
+        if command.startswith('chạy macro '):
+            macro_name, _ = self._parse_play(command[11:].strip())
+            return [f'macro:{macro_name}']
+        return ['macro-recorder']
+
     def handle(self, command: str) -> bool:
         if command.startswith('ghi macro '):
             recorder.start(command[10:].strip())
@@ -1264,15 +1313,7 @@ class MacroCommandHandler:
             if not rest:
                 print('❌ Thiếu tên macro.')
                 return True
-            delay = 1.0
-            macro_name = rest
-            if ' ' in rest:
-                parts = rest.split()
-                try:
-                    delay = float(parts[-1])
-                    macro_name = rest[:rest.rfind(parts[-1])].strip()
-                except ValueError:
-                    delay = 1.0
+            macro_name, delay = self._parse_play(rest)
             self._play_macro(macro_name, delay)
             return True
         return False
@@ -1286,7 +1327,7 @@ class MacroCommandHandler:
         with open(path, 'r', encoding='utf-8') as f:
             raw_lines = f.readlines()
         root_command, functions = MacroParser.parse(raw_lines)
-        ctx = MacroContext(self.assistant, delay, builtins.input)
+        ctx = MacroContext(self.assistant, delay, _current_input())
         ctx.functions = functions
         executor = MacroExecutor(ctx)
         executor.execute(root_command)
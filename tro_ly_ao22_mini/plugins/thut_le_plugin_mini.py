@@ -3,6 +3,8 @@ import os
 
 
 class IndentVisualizerHandler:
+    command_prefixes = ('hiển thị thụt lề', 'indent', 'phục hồi thụt lề',
+        'restore indent')
 
     def can_handle(self, command: str) -> bool:
         return command.startswith('hiển thị thụt lề') or command.startswith(
@@ -0,0 +1,59 @@
+import os
+import sys
+import shutil
+import subprocess
+import importlib.util
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PLUGINS = os.path.join(ROOT, 'plugins')
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+
+def load_plugin(name):
+    """Load plugin theo đường dẫn, giống PluginLoader._import_plugin"""
+    spec = importlib.util.spec_from_file_location(f"plugin_{name}", os.path.join(PLUGINS, f"{name}.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture(scope='session')
+def excel_crud():
+    return load_plugin('excel_crud')
+
+
+@pytest.fixture
+def workdir(tmp_path):
+    """
+    Bản sao trợ lý + plugins trong thư mục tạm: plugin tạo backup_plugins/, macros/, _manifest.json
+    theo thư mục hiện tại nên chạy trợ lý thật ở đây, không bẩn repo.
+    """
+    shutil.copy(os.path.join(ROOT, 'asistanst86_mini.py'), tmp_path)
+    os.makedirs(tmp_path / 'plugins')
+    for name in os.listdir(PLUGINS):
+        if name.endswith('.py'):
+            shutil.copy(os.path.join(PLUGINS, name), tmp_path / 'plugins')
+    return tmp_path
+
+
+def run_batch(workdir, commands, *args, stdin=None, timeout=300):
+    """Chạy trợ lý --batch với file lệnh trong workdir, trả về CompletedProcess"""
+    script = workdir / 'commands.txt'
+    script.write_text('\n'.join(commands) + '\n', encoding='utf-8')
+    env = dict(os.environ, PYTHONIOENCODING='utf-8')
+    return subprocess.run([sys.executable, 'asistanst86_mini.py', '--batch', str(script), *args],
+                          cwd=workdir, input=stdin, capture_output=True, encoding='utf-8',
+                          env=env, timeout=timeout)
+
+
+@pytest.fixture
+def assistant(tmp_path, monkeypatch):
+    """VirtualAssistant trong thư mục tạm, chưa nạp plugin nào (test tự thêm handler)"""
+    import asistanst86_mini
+    monkeypatch.chdir(tmp_path)
+    va = asistanst86_mini.VirtualAssistant()
+    yield va
+    va.shutdown()
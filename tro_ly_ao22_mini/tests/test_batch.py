@@ -0,0 +1,53 @@
+import json
+
+import pytest
+from openpyxl import Workbook
+
+from conftest import run_batch
+
+COMMANDS = [
+    '# chú thích và dòng trống bị bỏ qua',
+    '',
+    'excel -f a.xlsx add 1',
+    'excel -f khong_co.xlsx read',
+    'khong co lenh nay',
+    'excel -f a.xlsx add 2',
+]
+
+
+@pytest.fixture
+def book(workdir):
+    Workbook().save(workdir / 'a.xlsx')
+    return workdir
+
+
+def records(proc):
+    """Mọi dòng stdout phải là JSON (output lúc nạp/đóng plugin đi sang stderr)"""
+    return [json.loads(line) for line in proc.stdout.splitlines()]
+
+
+def test_batch_stops_at_first_error(book):
+    proc = run_batch(book, COMMANDS, '--jsonl')
+    assert proc.returncode == 1, proc.stderr
+    lines = records(proc)
+    assert [(r['line'], r['status']) for r in lines] == [(3, 'ok'), (4, 'error')]
+    assert 'khong_co.xlsx' in lines[1]['error'] and 'output' in lines[0]
+    assert '2 lệnh, 1 lỗi' in proc.stderr
+
+
+@pytest.mark.parametrize('jobs', [[], ['--jobs', '2']], ids=['serial', 'jobs'])
+def test_batch_keep_going_reports_every_line(book, jobs):
+    proc = run_batch(book, COMMANDS, '--jsonl', '--keep-going', *jobs)
+    assert proc.returncode == 1, proc.stderr
+    lines = records(proc)
+    assert [(r['line'], r['status']) for r in lines] == [(3, 'ok'), (4, 'error'), (5, 'unknown'), (6, 'ok')]
+    assert all(r['command'] == COMMANDS[r['line'] - 1] for r in lines)
+    assert '4 lệnh, 2 lỗi' in proc.stderr
+
+
+def test_batch_exit_code_zero_and_exit_stops(book):
+    proc = run_batch(book, ['excel -f a.xlsx add 1', 'exit', 'khong co lenh nay'], '--jsonl')
+    assert proc.returncode == 0, proc.stderr
+    assert [r['status'] for r in records(proc)] == ['ok', 'exit']
+    proc = run_batch(book, ['excel -f a.xlsx add 1'], '--quiet')
+    assert proc.returncode == 0 and proc.stdout == ''
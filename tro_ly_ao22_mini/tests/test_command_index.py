@@ -0,0 +1,96 @@
+import pytest
+
+from conftest import load_plugin
+
+
+class Prefixed:
+    """Handler khai báo command_prefixes; can_handle khắt khe hơn tiền tố"""
+    def __init__(self, name, prefixes, words=None):
+        self.name = name
+        self.command_prefixes = prefixes
+        self.words = words
+
+    def can_handle(self, command):
+        return any(command.startswith(p) for p in self.command_prefixes) and (
+            self.words is None or any(w in command for w in self.words))
+
+    def handle(self, command):
+        return self.name
+
+
+class Unprefixed:
+    """Handler kiểu cũ, không khai báo tiền tố: chỉ mục phải hỏi can_handle cho mọi lệnh"""
+    def __init__(self, name, test):
+        self.name = name
+        self.test = test
+
+    def can_handle(self, command):
+        return self.test(command)
+
+    def handle(self, command):
+        return self.name
+
+
+class CanHandleOnly:
+    """Có can_handle nhưng không có handle: được duyệt nhưng không xử lý lệnh"""
+    command_prefixes = ('excel',)
+
+    def can_handle(self, command):
+        return command.startswith('excel')
+
+
+COMMANDS = ['excel -f a.xlsx read', 'excel', 'ex', 'exc', 'ex read', 'echo hi', 'echo', 'e', '',
+            'indent 4', 'hiển thị thụt lề x', 'phục hồi thụt lề', 'read excel', 'calc 1+1',
+            'x calc', 'stats', 'Excel add', 'excelsior', ' excel']
+
+
+def linear_scan(handlers, command):
+    """Cách dò cũ: hỏi can_handle từng handler theo thứ tự danh sách"""
+    return [h for h in handlers if hasattr(h, 'can_handle') and h.can_handle(command)]
+
+
+def first_handler(handlers):
+    return next((h for h in handlers if hasattr(h, 'handle')), None)
+
+
+@pytest.fixture
+def va(assistant):
+    assistant.handlers.extend([
+        CanHandleOnly(),
+        Prefixed('excel', ('excel',)),
+        Unprefixed('calc-anywhere', lambda c: 'calc' in c),
+        Prefixed('ex-read', ('ex', 'e'), words=('read',)),
+        object(),   # không có can_handle: cả hai cách đều bỏ qua
+        Unprefixed('everything', lambda c: True),
+        Prefixed('echo', ('echo',)),
+        Prefixed('empty-prefix', ()),   # tuple rỗng = không khai báo tiền tố
+    ])
+    return assistant
+
+
+def assert_same_routing(va):
+    for command in COMMANDS:
+        linear = linear_scan(va.handlers, command)
+        assert list(va.match_handlers(command)) == linear, command
+        assert first_handler(va.match_handlers(command)) is first_handler(linear), command
+
+
+def test_index_matches_linear_scan(va):
+    assert_same_routing(va)
+    assert first_handler(va.match_handlers('echo hi')).name == 'everything'
+    assert first_handler(va.match_handlers('ex read')).name == 'ex-read'
+    assert first_handler(va.match_handlers('excel read')).name == 'excel'
+
+
+def test_index_follows_register_insert_at_front(va):
+    assert_same_routing(va)   # chỉ mục đã dựng, sau đó plugin chèn handler vào vị trí 1
+    load_plugin('thut_le_plugin_mini').plugin_info['register'](va)
+    va.handlers.insert(1, Unprefixed('late-echo', lambda c: c.startswith('echo')))
+    va.handlers.insert(1, Prefixed('late-excel', ('excel -f',)))
+    assert_same_routing(va)
+    assert first_handler(va.match_handlers('echo hi')).name == 'late-echo'
+    assert first_handler(va.match_handlers('excel -f a.xlsx read')).name == 'late-excel'
+    assert type(first_handler(va.match_handlers('indent 4'))).__name__ == 'IndentVisualizerHandler'
+    del va.handlers[1:4]
+    assert_same_routing(va)
+    assert first_handler(va.match_handlers('excel -f a.xlsx read')).name == 'excel'
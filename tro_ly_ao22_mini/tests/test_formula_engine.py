@@ -0,0 +1,40 @@
+import pytest
+from openpyxl import Workbook
+
+
+@pytest.fixture(params=[True, False], ids=['fast', 'public'])
+def excel_crud(request, excel_crud, monkeypatch):
+    monkeypatch.setattr(excel_crud, 'FAST_CELLS', request.param)
+    return excel_crud
+
+
+def test_engine_reads_live_worksheet(excel_crud):
+    ws = Workbook().active
+    for i in range(1, 4):
+        ws.append([i, f'=A{i}*10'])
+    ws['C1'] = '=SUM(B1:B3)'
+    engine = excel_crud.FormulaEngine.from_worksheet(ws)
+    engine.recalc()
+    assert engine.value(1, 3) == 60
+    ws['A2'] = 5
+    engine.set(2, 1, 5)
+    assert engine.value(2, 2) == 50 and engine.value(1, 3) == 90
+    ws['A4'] = 1
+    ws['B4'] = '=A4*10'
+    engine.set(4, 1, 1)
+    engine.set(4, 2, '=A4*10')
+    ws['C1'] = '=SUM(B1:B4)'
+    engine.set(1, 3, '=SUM(B1:B4)')
+    assert engine.value(1, 3) == 100
+
+
+def test_engine_reports_cycles_and_missing_cells(excel_crud):
+    ws = Workbook().active
+    ws['A1'] = '=B1+1'
+    ws['B1'] = '=A1+1'
+    ws['C1'] = '=Z99+1'
+    engine = excel_crud.FormulaEngine.from_worksheet(ws)
+    engine.recalc()
+    assert engine.value(1, 1) == excel_crud.CIRC_ERR
+    assert engine.value(1, 3) == 1
+    assert ws.max_row == 1 and ws.max_column == 3
@@ -0,0 +1,36 @@
+import sys
+
+import pytest
+from openpyxl import Workbook
+
+
+@pytest.fixture
+def books(tmp_path):
+    for i, numbers in enumerate([[1, 2, 3], [10, 20], [5]]):
+        wb = Workbook()
+        for n in numbers:
+            wb.active.append([n])
+        wb.save(tmp_path / f"s{i}.xlsx")
+    return tmp_path
+
+
+def test_glob_runs_on_process_pool(assistant, excel_crud, books):
+    handler = excel_crud.ExcelProHandler(assistant)
+    handler.GLOB_WORKERS = 2
+    try:
+        report = handler.handle(f'excel -f "{books}/*.xlsx" avg').data
+        assert handler._glob_pool is not None
+    finally:
+        handler.shutdown()
+    assert sorted(report['results'].values()) == [2.0, 5.0, 15.0] and report['errors'] == {}
+    assert report['summary']['count'] == 3 and report['summary']['max'] == 15.0
+    # Process chính có bản plugin dưới tên GLOB_MODULE (initializer không chạy chuỗi nguồn qua exec)
+    module = sys.modules[excel_crud.GLOB_MODULE]
+    assert module.__file__ == excel_crud.__file__
+    assert module._load_glob_module(excel_crud.__file__) is module
+
+
+def test_glob_refuses_commands_that_write(assistant, excel_crud, books):
+    handler = excel_crud.ExcelProHandler(assistant)
+    result = handler.handle(f'excel -f "{books}/*.xlsx" add 1')
+    assert result.status == 'error' and 'glob' in result.message
@@ -0,0 +1,110 @@
+import datetime
+
+import pytest
+from openpyxl import Workbook, load_workbook
+
+ROWS = [
+    ['Time', 'Ticker', 'Close', 'Volume'],
+    [datetime.datetime(2024, 1, 2, 9, 15), 'FPT', 100, 10],
+    ['2024-01-02 10:00', 'VNM', 50, '5'],
+    [datetime.datetime(2024, 1, 2, 14, 30), 'FPT', 104, 30],
+    [datetime.datetime(2024, 1, 3, 9, 15), 'FPT', 'n/a', 20],
+    [datetime.datetime(2024, 1, 3, 9, 15), 'VNM', 48, None],
+    [None, 'FPT', 98, ''],
+]
+
+
+def make_book(path, rows=ROWS):
+    wb = Workbook()
+    for row in rows:
+        wb.active.append(list(row))
+    wb.save(path)
+    return str(path)
+
+
+def disk_rows(path, sheet=None):
+    wb = load_workbook(path)
+    ws = wb[sheet] if sheet else wb.active
+    return [list(row) for row in ws.iter_rows(values_only=True)]
+
+
+@pytest.fixture
+def excel(assistant, excel_crud, tmp_path):
+    handler = excel_crud.ExcelProHandler(assistant)
+    yield handler, make_book(tmp_path / 'gia.xlsx')
+    handler.shutdown()
+
+
+def test_aggregator_functions(excel_crud):
+    aggs = [(agg, 2) for agg in excel_crud.AGGREGATES]
+    agg = excel_crud.GroupAggregator([(1, None)], aggs)
+    for row in ROWS[1:]:
+        agg.add(row)
+    results = dict(agg.results())
+    # sum/mean/min/max bỏ ô không phải số ('n/a'); count/first/last tính mọi ô không trống
+    names = list(excel_crud.AGGREGATES)
+    assert dict(zip(names, results['FPT'])) == {
+        'sum': 302, 'mean': 302 / 3, 'count': 4, 'min': 98, 'max': 104, 'first': 100, 'last': 98}
+    assert dict(zip(names, results['VNM'])) == {
+        'sum': 98, 'mean': 49.0, 'count': 2, 'min': 48, 'max': 50, 'first': 50, 'last': 48}
+    assert agg.rows == 6
+
+
+def test_aggregator_numeric_strings_and_empty_groups(excel_crud):
+    agg = excel_crud.GroupAggregator([(1, None)], [('sum', 3), ('mean', 3), ('min', 3), ('count', 3)])
+    for row in ROWS[1:]:
+        agg.add(row)
+    results = dict(agg.results())
+    assert results['VNM'] == [5.0, 5.0, 5.0, 1]     # chuỗi số '5' được tính, ô None bỏ qua
+    assert results['FPT'] == [60, 20.0, 10, 3]      # ô '' không tính
+    empty = excel_crud.GroupAggregator([(0, None)], [('mean', 1), ('min', 1), ('first', 1)])
+    empty.add(['a', 'chữ'])
+    assert empty.results() == [('a', [None, None, 'chữ'])]
+
+
+def test_date_key_drops_time_and_sorts_blank_last(excel_crud):
+    agg = excel_crud.GroupAggregator([(0, 'date')], [('count', 1)])
+    for row in ROWS[1:]:
+        agg.add(row)
+    # Khóa ngày trước khóa chữ (cùng thứ tự như sort), ô trống cuối
+    assert agg.results() == [(datetime.date(2024, 1, 2), [2]), (datetime.date(2024, 1, 3), [2]),
+                             ('2024-01-02', [1]), (None, [1])]
+
+
+def test_groupby_writes_new_file(excel):
+    handler, path = excel
+    summary = handler.handle(f'excel -f {path} groupby Ticker sum:Volume last:3').data
+    out = path.replace('.xlsx', '_groupby.xlsx')
+    assert summary == {'rows': 6, 'groups': 2, 'out': out}
+    assert disk_rows(out) == [['Ticker', 'sum(Volume)', 'last(Close)'], ['FPT', 60, 98], ['VNM', 5, 48]]
+    assert disk_rows(path) == [list(r) if r[3] != '' else list(r[:3]) + [None] for r in ROWS]
+
+
+def test_pivot_layout(excel, tmp_path):
+    handler, path = excel
+    out = str(tmp_path / 'pivot.xlsx')
+    summary = handler.handle(f'excel -f {path} pivot Ticker Time:date count:Close --out {out}').data
+    assert summary == {'rows': 6, 'groups': 2, 'out': out}
+    rows = disk_rows(out)
+    assert rows[0][0] == 'count(Close) Ticker \\ Time'
+    assert rows[0][1:] == [datetime.datetime(2024, 1, 2), datetime.datetime(2024, 1, 3), '2024-01-02', None]
+    assert rows[1:] == [['FPT', 2, 1, None, 1], ['VNM', None, 1, 1, None]]
+
+
+def test_pivot_needs_one_row_column_and_aggregate(excel, capsys):
+    handler, path = excel
+    assert handler.handle(f'excel -f {path} pivot Ticker Time sum:3 max:3') is None
+    assert handler.handle(f'excel -f {path} pivot Ticker Time:hour sum:3') is None
+    assert 'không hỗ trợ: hour' in capsys.readouterr().out
+
+
+def test_groupby_to_sheet_and_refuses_overwriting_source(excel):
+    handler, path = excel
+    result = handler.handle(f'excel -f {path} groupby Ticker count:1 --out {path}')
+    assert result.status == 'error' and 'trùng file nguồn' in result.message
+    result = handler.handle(f'excel -f {path} groupby Ticker count:1 --sheet Sheet')
+    assert result.status == 'error' and 'sheet đang đọc' in result.message
+    handler.handle(f'excel -f {path} groupby Ticker count:1 --sheet nhom')
+    handler.books.flush()
+    assert disk_rows(path, 'nhom') == [['Ticker', 'count(Time)'], ['FPT', 3], ['VNM', 2]]
+    assert len(disk_rows(path)) == len(ROWS)
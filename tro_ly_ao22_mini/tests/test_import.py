@@ -0,0 +1,57 @@
+import pytest
+from openpyxl import Workbook, load_workbook
+
+from conftest import run_batch
+
+
+def disk_rows(path):
+    return [list(row) for row in load_workbook(path).active.iter_rows(values_only=True)]
+
+
+@pytest.fixture
+def excel(assistant, excel_crud):
+    assistant.handlers.append(excel_crud.ExcelProHandler(assistant))
+    return assistant
+
+
+def test_import_new_file_infers_column_types(excel, tmp_path):
+    (tmp_path / 'data.csv').write_text('ma,gia,kl\nfpt,95.5,1200\nvnm,70,800\n', encoding='utf-8')
+    result = excel.execute('excel -f out.xlsx import data.csv')
+    assert result.status == 'ok' and result.data == {'rows': 3}
+    assert disk_rows(tmp_path / 'out.xlsx') == [['ma', 'gia', 'kl'], ['fpt', 95.5, 1200], ['vnm', 70.0, 800]]
+
+
+def test_import_skip_and_whitespace_separator(excel, tmp_path):
+    text = 'Báo cáo giá\n\nnguồn: sàn\n1 10.5 100\n2 11 200\n'
+    (tmp_path / 'bid.txt').write_text(text, encoding='utf-8')
+    result = excel.execute('excel -f bid.xlsx import bid.txt --skip 3')
+    assert result.data == {'rows': 2}
+    assert disk_rows(tmp_path / 'bid.xlsx') == [[1, 10.5, 100], [2, 11.0, 200]]
+
+
+def test_import_appends_to_existing_workbook(excel, tmp_path):
+    wb = Workbook()
+    wb.active.append(['a', 'b'])
+    wb.save(tmp_path / 'out.xlsx')
+    (tmp_path / 'more.tsv').write_text('1\t2\n3\t4\n', encoding='utf-8')
+    assert excel.execute('excel -f out.xlsx import more.tsv').data == {'rows': 2}
+    excel.execute('excel flush')
+    assert disk_rows(tmp_path / 'out.xlsx') == [['a', 'b'], [1, 2], [3, 4]]
+
+
+def test_import_new_overwrites(excel, tmp_path):
+    wb = Workbook()
+    wb.active.append(['old'])
+    wb.save(tmp_path / 'out.xlsx')
+    (tmp_path / 'data.csv').write_text('x,1\n', encoding='utf-8')
+    excel.execute('excel -f out.xlsx import data.csv --new')
+    assert disk_rows(tmp_path / 'out.xlsx') == [['x', 1]]
+
+
+def test_import_from_stdin_with_macro_plugin(workdir):
+    """Plugin macro bọc sys.stdin bằng wrapper chỉ có readline: import - vẫn đọc được"""
+    proc = run_batch(workdir, ['excel -f out.xlsx import - --sep comma'], '--jsonl',
+                     stdin='ten,diem\nan,8\nbinh,9.5\n')
+    assert proc.returncode == 0, proc.stdout + proc.stderr
+    assert '"rows": 3' in proc.stdout
+    assert disk_rows(workdir / 'out.xlsx') == [['ten', 'diem'], ['an', 8.0], ['binh', 9.5]]
@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+from openpyxl import Workbook, load_workbook
+
+
+@pytest.fixture(params=[True, False], ids=['bulk', 'public'])
+def excel_crud(request, excel_crud, monkeypatch):
+    """Ghi cột gộp thẳng vào ws._cells (FAST_CELLS) và ghi từng ô qua ws.cell"""
+    monkeypatch.setattr(excel_crud, 'FAST_CELLS', request.param)
+    return excel_crud
+
+
+@pytest.fixture
+def handler(assistant, excel_crud):
+    return excel_crud.ExcelProHandler(assistant)
+
+
+def make_prices(path, closes, setup=None):
+    wb = Workbook()
+    ws = wb.active
+    ws.append(['ngay', 'close'])
+    for i, close in enumerate(closes, start=1):
+        ws.append([i, close])
+    if setup:
+        setup(ws)
+    wb.save(path)
+    return str(path)
+
+
+def test_indicator_column_values_and_types(handler, tmp_path):
+    closes = [10, 11, 12, 13, 14, 15]
+    path = make_prices(tmp_path / 'p.xlsx', closes)
+    assert handler.handle(f'excel -f {path} indicators sma:3').data == {'SMA3': 14.0}
+    handler.books.flush()
+    ws = load_workbook(path).active
+    assert [ws.cell(row=r, column=3).value for r in range(1, 8)] == ['SMA3', None, None, 11, 12, 13, 14]
+    assert ws['C4'].data_type == 'n'
+    assert ws.max_row == 7
+
+
+def test_rerun_keeps_cell_format_and_clears_warmup_rows(handler, tmp_path):
+    def setup(ws):
+        ws['C1'] = 'SMA2'
+        for r in range(2, 6):
+            ws.cell(row=r, column=3, value=-1).number_format = '0.00'
+    path = make_prices(tmp_path / 'p.xlsx', [1, 3, 5, 7], setup)
+    handler.handle(f'excel -f {path} indicators sma:2')
+    handler.books.flush()
+    ws = load_workbook(path).active
+    assert [ws.cell(row=r, column=3).value for r in range(2, 6)] == [None, 2, 4, 6]
+    assert ws['C3'].number_format == '0.00'
+    assert ws.max_column == 3
+
+
+def test_write_column_nan_creates_no_cells(excel_crud):
+    ws = Workbook().active
+    for row in ([1, 'a'], [2, 'b'], [3, 'c']):
+        ws.append(row)
+    ws['C3'] = 'cũ'
+    excel_crud.write_column(ws, 3, np.array([1, 2, 3]), np.array([np.nan, 1.5, np.nan]))
+    if excel_crud.FAST_CELLS:
+        assert (1, 3) not in ws._cells   # ws.cell tạo ô trống trong vùng dữ liệu (không được lưu ra file)
+    assert [ws.cell(row=r, column=3).value for r in (2, 3)] == [1.5, None]
+    excel_crud.write_column(ws, 4, np.array([1, 2]), np.array([np.nan, np.nan]))
+    assert ws.max_column == 3
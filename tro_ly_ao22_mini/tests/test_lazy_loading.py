@@ -0,0 +1,60 @@
+import json
+import os
+import subprocess
+import sys
+import textwrap
+
+# backup_plugins chạy watcher thread vô hạn theo thư mục hiện tại: mỗi kịch bản chạy trong process riêng
+SCRIPT = '''
+import json, os, sys
+import asistanst86_mini
+
+def report(va):
+    print(json.dumps({{
+        'loaded': sorted(va.loader.profile),
+        'deferred': sorted(f for f, _ in va.loader.deferred),
+        'modules': [m for m in ('openpyxl', 'numpy') if m in sys.modules],
+        'dirs': [d for d in ('backup_plugins', 'code_snapshots') if os.path.isdir(d)],
+    }}), flush=True)
+
+va = asistanst86_mini.VirtualAssistant(lazy_plugins={lazy})
+va.loader.load_plugins(va)
+report(va)
+for command in {commands!r}:
+    va.execute(command)
+    report(va)
+os._exit(0)
+'''
+
+
+def run_scenario(workdir, lazy, commands=()):
+    script = workdir / 'scenario.py'
+    script.write_text(textwrap.dedent(SCRIPT.format(lazy=lazy, commands=list(commands))), encoding='utf-8')
+    env = dict(os.environ, PYTHONIOENCODING='utf-8')
+    proc = subprocess.run([sys.executable, str(script)], cwd=workdir, capture_output=True,
+                          encoding='utf-8', env=env, timeout=120)
+    assert proc.returncode == 0, proc.stdout + proc.stderr
+    return [json.loads(line) for line in proc.stdout.splitlines() if line.startswith('{')]
+
+
+def test_lazy_start_imports_nothing(workdir):
+    start, = run_scenario(workdir, lazy=True)
+    assert start == {'loaded': [], 'deferred': ['backup_plugins.py', 'code_version_tracker_plugin_mini.py'],
+                     'modules': [], 'dirs': []}
+    manifest = json.loads((workdir / 'plugins' / '_manifest.json').read_text(encoding='utf-8'))
+    assert manifest['excel_crud.py']['prefixes'] == ['excel']
+    assert manifest['backup_plugins.py']['defer'] and not manifest['backup_plugins.py']['prefixes']
+
+
+def test_deferred_plugins_start_on_first_command(workdir):
+    start, first, second = run_scenario(workdir, lazy=True, commands=['không có lệnh này', 'lệnh khác'])
+    assert start['dirs'] == []
+    assert first == second == {'loaded': ['backup_plugins.py', 'code_version_tracker_plugin_mini.py'],
+                               'deferred': [], 'modules': [], 'dirs': ['backup_plugins', 'code_snapshots']}
+
+
+def test_eager_mode_runs_everything_at_start(workdir):
+    start, = run_scenario(workdir, lazy=False)
+    assert start['deferred'] == []
+    assert 'excel_crud.py' in start['loaded'] and 'openpyxl' in start['modules']
+    assert start['dirs'] == ['backup_plugins', 'code_snapshots']
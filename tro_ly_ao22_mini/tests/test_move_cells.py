@@ -0,0 +1,155 @@
+import pytest
+from openpyxl import Workbook, load_workbook
+from openpyxl.comments import Comment
+from openpyxl.formatting.rule import CellIsRule
+from openpyxl.styles import Font
+from openpyxl.worksheet.datavalidation import DataValidation
+
+
+def disk_rows(path):
+    return [list(row) for row in load_workbook(path).active.iter_rows(values_only=True)]
+
+
+def make_book(path, rows, setup=None):
+    wb = Workbook()
+    for row in rows:
+        wb.active.append(list(row))
+    if setup:
+        setup(wb.active)
+    wb.save(path)
+    return str(path)
+
+
+@pytest.fixture(params=[True, False], ids=['fast', 'public'])
+def handler(request, assistant, excel_crud, monkeypatch):
+    """Chạy mỗi test với cả đường sửa ws._cells và đường chỉ dùng API công khai"""
+    monkeypatch.setattr(excel_crud, 'FAST_CELLS', request.param)
+    return excel_crud.ExcelProHandler(assistant)
+
+
+def run(handler, command):
+    result = handler.handle(command)
+    handler.books.flush()
+    return result
+
+
+def test_delete_rows_moves_style_comment_and_hyperlink(handler, tmp_path):
+    def setup(ws):
+        ws['A4'].font = Font(bold=True)
+        ws['A4'].comment = Comment('ghi chú', 'test')
+        ws['B4'].hyperlink = 'https://example.com'
+    path = make_book(tmp_path / 'a.xlsx', [['h', 'x'], [1, 'a'], [2, 'b'], [3, 'c']], setup)
+    run(handler, f'excel -f {path} delete 2 3')
+    assert disk_rows(path) == [['h', 'x'], [3, 'c']]
+    ws = load_workbook(path).active
+    assert ws['A2'].font.bold and ws['A2'].comment.text == 'ghi chú'
+    assert ws['B2'].hyperlink.target == 'https://example.com'
+    assert ws['B2'].hyperlink.ref == 'B2'
+    run(handler, f'excel -f {path} add 4')
+    assert disk_rows(path)[-1] == [4.0, None]
+
+
+def test_delcol_and_remove_empty_rows(handler, tmp_path):
+    path = make_book(tmp_path / 'a.xlsx', [[1, 2, 3], [], [4, 5, 6], [], [7, 8, 9]])
+    run(handler, f'excel -f {path} delcol 2')
+    run(handler, f'excel -f {path} remove_empty_rows')
+    assert disk_rows(path) == [[1, 3], [4, 6], [7, 9]]
+
+
+COORDINATE_SETUPS = {
+    'merged': lambda ws: ws.merge_cells('A6:B6'),
+    'formula': lambda ws: ws.__setitem__('C1', '=SUM(A2:A5)'),
+    'validation': lambda ws: ws.add_data_validation(DataValidation(type='whole', sqref='A2:A5')),
+}
+
+
+@pytest.mark.parametrize('feature', COORDINATE_SETUPS)
+def test_coordinate_bound_sheet_deletes_like_openpyxl(handler, tmp_path, feature):
+    """Sheet có merged cell / công thức / data validation: xóa qua delete_rows/delete_cols như trước"""
+    rows = [['h', 'x'], [1, 'a'], [], [3, 'c'], [4, 'd'], ['tổng', None]]
+    setup = COORDINATE_SETUPS[feature]
+    path = make_book(tmp_path / 'a.xlsx', rows, setup)
+    expected = make_book(tmp_path / 'b.xlsx', rows, setup)
+    wb = load_workbook(expected)
+    wb.active.delete_rows(4, 2)
+    wb.active.delete_rows(2)
+    wb.active.delete_cols(2)
+    wb.active.delete_rows(2)   # dòng trống (dòng 3 ban đầu)
+    wb.save(expected)
+    assert run(handler, f'excel -f {path} delete 2 4-5') is None
+    assert run(handler, f'excel -f {path} delcol 2') is None
+    assert run(handler, f'excel -f {path} remove_empty_rows') is None
+    assert disk_rows(path) == disk_rows(expected)
+    got, want = load_workbook(path).active, load_workbook(expected).active
+    assert got.merged_cells.ranges == want.merged_cells.ranges
+
+
+SORT_ROWS = [['ma', 'gia']] + [[f'm{i % 7}', None if i % 5 == 0 else (i * 37) % 11] for i in range(30)]
+
+
+def test_external_sort_matches_in_memory_sort(handler, tmp_path, capsys):
+    small = make_book(tmp_path / 'small.xlsx', SORT_ROWS)
+    big = make_book(tmp_path / 'big.xlsx', SORT_ROWS)
+    run(handler, f'excel -f {small} sort 2 desc 1')
+    capsys.readouterr()
+    assert run(handler, f'excel -f {big} sort 2 desc 1 --run 7').data == {'rows': 30}
+    assert 'sắp xếp ngoài' in capsys.readouterr().out
+    rows = disk_rows(big)
+    assert rows == disk_rows(small)
+    gia = [row[1] for row in rows[1:]]
+    assert gia == sorted(v for v in gia if v is not None)[::-1] + [None] * 6
+
+
+@pytest.mark.parametrize('run_arg', ['', ' --run 1'], ids=['in-memory', 'external'])
+def test_sort_with_formulas_rewrites_values(handler, tmp_path, run_arg):
+    """Sheet có công thức: sắp xếp như trước, giá trị (cả chuỗi công thức) đổi dòng, định dạng đứng yên"""
+    def setup(ws):
+        ws['A2'].font = Font(bold=True)
+    path = make_book(tmp_path / 'a.xlsx', [['x', 'y'], [3, '=A2*2'], [1, 'a'], [2, None]], setup)
+    assert run(handler, f'excel -f {path} sort 1{run_arg}').data == {'rows': 3}
+    assert disk_rows(path) == [['x', 'y'], [1, 'a'], [2, None], [3, '=A2*2']]
+    if not run_arg:
+        assert load_workbook(path).active['A2'].font.bold
+
+
+def test_sort_refuses_merged_cells_in_data_rows(handler, tmp_path):
+    path = make_book(tmp_path / 'a.xlsx', [['x', 'y'], [2, 'b'], [1, 'a']],
+                     lambda ws: ws.merge_cells('A3:B3'))
+    result = run(handler, f'excel -f {path} sort 1')
+    assert result.status == 'error' and 'A3:B3' in result.message
+    assert disk_rows(path) == [['x', 'y'], [2, 'b'], [1, None]]
+
+
+def test_sort_keeps_merged_header(handler, tmp_path):
+    path = make_book(tmp_path / 'a.xlsx', [['tiêu đề', None], [2, 'b'], [1, 'a']],
+                     lambda ws: ws.merge_cells('A1:B1'))
+    run(handler, f'excel -f {path} sort 1 desc')
+    assert disk_rows(path) == [['tiêu đề', None], [2, 'b'], [1, 'a']]
+    run(handler, f'excel -f {path} sort 1')
+    assert disk_rows(path) == [['tiêu đề', None], [1, 'a'], [2, 'b']]
+    assert [r.coord for r in load_workbook(path).active.merged_cells.ranges] == ['A1:B1']
+
+
+def test_transpose_moves_values_and_style(handler, tmp_path):
+    path = make_book(tmp_path / 'a.xlsx', [['a', 'b', 'c'], [1, 2]],
+                     lambda ws: setattr(ws['C1'], 'font', Font(italic=True)))
+    run(handler, f'excel -f {path} transpose')
+    assert disk_rows(path) == [['a', 1], ['b', 2], ['c', None]]
+    assert load_workbook(path).active['A3'].font.italic
+    run(handler, f'excel -f {path} add d')
+    assert disk_rows(path)[-1] == ['d', None]
+
+
+@pytest.mark.parametrize('feature', ['cf', 'formula'])
+def test_transpose_coordinate_bound_sheet_moves_values(handler, tmp_path, feature):
+    """Sheet có conditional formatting / công thức: chuyển vị giá trị như trước, vùng CF đứng yên"""
+    rule = CellIsRule(operator='greaterThan', formula=['1'], font=Font(bold=True))
+    setups = {'cf': lambda ws: ws.conditional_formatting.add('A1:B2', rule),
+              'formula': lambda ws: ws.__setitem__('C1', '=A1+B1')}
+    path = make_book(tmp_path / 'a.xlsx', [[1, 2], [3, 4]], setups[feature])
+    assert run(handler, f'excel -f {path} transpose') is None
+    if feature == 'cf':
+        assert disk_rows(path) == [[1, 3], [2, 4]]
+        assert [str(cf.sqref) for cf in load_workbook(path).active.conditional_formatting] == ['A1:B2']
+    else:
+        assert disk_rows(path) == [[1, 3], [2, 4], ['=A1+B1', None]]
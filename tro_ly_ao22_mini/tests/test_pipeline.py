@@ -0,0 +1,73 @@
+import os
+import shutil
+
+import pytest
+from openpyxl import Workbook, load_workbook
+
+
+def disk_rows(path):
+    return [list(row) for row in load_workbook(path).active.iter_rows(values_only=True)]
+
+
+@pytest.fixture
+def excel(assistant, excel_crud, tmp_path):
+    assistant.handlers.append(excel_crud.ExcelProHandler(assistant))
+    for name, rows in (('a.xlsx', [['ten'], ['hà'], ['huế'], ['hà nội']]), ('b.xlsx', [])):
+        wb = Workbook()
+        for row in rows:
+            wb.active.append(row)
+        wb.save(tmp_path / name)
+    return assistant
+
+
+def test_pipe_into_add_dash(excel, tmp_path):
+    result = excel.execute('excel -f a.xlsx find hà | excel -f b.xlsx add -')
+    assert result.status == 'ok' and result.data == {'rows': 2}
+    excel.execute('excel flush')
+    assert [row[-1] for row in disk_rows(tmp_path / 'b.xlsx')] == ['hà', 'hà nội']
+
+
+def test_bar_is_data_when_next_stage_takes_no_input(excel, tmp_path):
+    assert excel._pipeline_stages('excel -f a.xlsx add x | y') is None
+    excel.execute('excel -f a.xlsx add x | y')
+    excel.execute('excel flush')
+    assert disk_rows(tmp_path / 'a.xlsx')[-1] == ['x', '|', 'y']
+
+
+def test_only_add_dash_accepts_pipe(excel):
+    assert excel._pipeline_stages('excel -f a.xlsx read | excel -f b.xlsx add -') == [
+        'excel -f a.xlsx read', 'excel -f b.xlsx add -']
+    assert excel._pipeline_stages('excel -f a.xlsx read | excel -f b.xlsx read') is None
+    assert excel._pipeline_stages('excel -f a.xlsx read | khong co lenh') is None
+    assert excel._pipeline_stages('excel -f a.xlsx add "x | y"') is None
+
+
+@pytest.fixture
+def lazy_excel(tmp_path, monkeypatch):
+    """Trợ lý lazy chỉ có plugin excel_crud (chưa import)"""
+    import asistanst86_mini
+    from conftest import PLUGINS
+    os.makedirs(tmp_path / 'plugins')
+    shutil.copy(os.path.join(PLUGINS, 'excel_crud.py'), tmp_path / 'plugins')
+    monkeypatch.chdir(tmp_path)
+    va = asistanst86_mini.VirtualAssistant(lazy_plugins=True)
+    va.loader.load_plugins(va)
+    yield va
+    va.shutdown()
+
+
+def test_pipe_check_does_not_import_lazy_plugin(lazy_excel):
+    assert lazy_excel._pipeline_stages('khong co lenh | excel -f b.xlsx read') is None
+    assert lazy_excel._pipeline_stages('khong co lenh | excel add - -f b.xlsx') == [
+        'khong co lenh', 'excel add - -f b.xlsx']
+    assert lazy_excel.execute('khong co lenh | excel -f b.xlsx read').status == 'unknown'
+    assert lazy_excel.loader.profile == {}
+
+
+def test_lazy_pipeline_loads_plugin_when_it_runs(lazy_excel, tmp_path):
+    Workbook().save(tmp_path / 'a.xlsx')
+    Workbook().save(tmp_path / 'b.xlsx')
+    lazy_excel.execute('excel -f a.xlsx add x')
+    result = lazy_excel.execute('excel -f a.xlsx find x | excel -f b.xlsx add -')
+    assert result.data == {'rows': 1}
+    assert 'excel_crud.py' in lazy_excel.loader.profile
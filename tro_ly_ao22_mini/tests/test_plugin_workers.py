@@ -0,0 +1,79 @@
+import textwrap
+
+import pytest
+
+import asistanst86_mini
+from asistanst86_mini import PluginWorkerPool, RemoteHandler
+
+COUNTER_PLUGIN = '''
+import os
+
+class CounterHandler:
+    command_prefixes = ('count',)
+    stateless = {stateless}
+
+    def __init__(self):
+        self.count = 0
+
+    def can_handle(self, command):
+        return command.startswith('count')
+
+    def handle(self, command):
+        self.count += 1
+        return [os.getpid(), self.count]
+
+plugin_info = {{
+    'enabled': True,
+    'register': lambda assistant: assistant.handlers.append(CounterHandler()),
+}}
+'''
+
+
+@pytest.fixture
+def counter_plugin(tmp_path):
+    def make(stateless):
+        folder = tmp_path / 'plugins'
+        folder.mkdir(exist_ok=True)
+        (folder / 'counter.py').write_text(textwrap.dedent(COUNTER_PLUGIN.format(stateless=stateless)))
+        return str(folder)
+    return make
+
+
+@pytest.fixture
+def pools():
+    started = []
+    yield started
+    for pool in started:
+        pool.shutdown()
+
+
+def test_stateful_plugin_runs_on_one_worker(counter_plugin, pools, assistant, capsys):
+    pool = PluginWorkerPool(counter_plugin(False), 'counter.py', size=3)
+    pools.append(pool)
+    assert len(pool.workers) == 1
+    assert 'chỉ chạy 1 worker process' in capsys.readouterr().out
+    handler = RemoteHandler(pool, 0, pool.handlers[0], assistant)
+    results = [handler.handle('count') for _ in range(5)]
+    assert len({pid for pid, _ in results}) == 1
+    assert [n for _, n in results] == [1, 2, 3, 4, 5]
+
+
+def test_stateless_plugin_gets_all_workers(counter_plugin, pools):
+    pool = PluginWorkerPool(counter_plugin(True), 'counter.py', size=2)
+    pools.append(pool)
+    assert len(pool.workers) == 2
+    assert pool.handlers[0]['stateless']
+
+
+def test_dead_worker_is_restarted(counter_plugin, pools, assistant):
+    pool = PluginWorkerPool(counter_plugin(False), 'counter.py')
+    pools.append(pool)
+    handler = RemoteHandler(pool, 0, pool.handlers[0], assistant)
+    pid, _ = handler.handle('count')
+    pool.workers[0].process.kill()
+    pool.workers[0].process.join()
+    result = handler.handle('count')
+    assert isinstance(result, asistanst86_mini.CommandResult) and result.status == 'error'
+    assert pool.restarts == 1
+    new_pid, count = handler.handle('count')
+    assert new_pid != pid and count == 1
@@ -0,0 +1,54 @@
+import pytest
+from openpyxl import Workbook
+
+
+@pytest.fixture
+def formula_book(tmp_path):
+    wb = Workbook()
+    ws = wb.active
+    ws.append(['x', 'y', 'z'])
+    for i in range(1, 5):
+        ws.append([i, f'=A{i + 1}*2', f'=VLOOKUP(A{i + 1},A2:A5,1,FALSE)'])
+    path = tmp_path / 'f.xlsx'
+    wb.save(path)
+    return str(path)
+
+
+@pytest.fixture
+def handler(assistant, excel_crud):
+    return excel_crud.ExcelProHandler(assistant)
+
+
+def run_both_ways(handler, command, path, capsys):
+    """(kết quả, output) khi đọc thẳng từ file và khi workbook đang mở trong cache"""
+    capsys.readouterr()
+    streamed = handler.handle(command)
+    streamed_out = capsys.readouterr().out
+    assert handler.books.peek(path) is None
+    handler.books.get(path)
+    cached = handler.handle(command)
+    cached_out = capsys.readouterr().out
+    return (streamed, streamed_out), (cached, cached_out)
+
+
+def test_read_shows_formulas_with_or_without_cache(handler, formula_book, capsys):
+    streamed, cached = run_both_ways(handler, f'excel -f {formula_book} read', formula_book, capsys)
+    assert streamed == cached
+    assert "=A2*2" in streamed[1]
+
+
+def test_find_matches_formula_text_with_or_without_cache(handler, formula_book, capsys):
+    streamed, cached = run_both_ways(handler, f'excel -f {formula_book} find =A3', formula_book, capsys)
+    assert streamed[0].data == cached[0].data == [(2, '=A3*2', '=VLOOKUP(A3,A2:A5,1,FALSE)')]
+
+
+def test_stat_uses_computed_values_with_or_without_cache(handler, formula_book, capsys):
+    streamed, cached = run_both_ways(handler, f'excel -f {formula_book} stat 2', formula_book, capsys)
+    assert streamed[0].data == cached[0].data
+    assert streamed[0].data['sum'] == 20.0
+
+
+def test_unsupported_function_is_not_numeric_with_or_without_cache(handler, formula_book, capsys):
+    streamed, cached = run_both_ways(handler, f'excel -f {formula_book} stat 3', formula_book, capsys)
+    assert streamed == cached
+    assert streamed[0] is None and 'Không có dữ liệu số' in streamed[1]
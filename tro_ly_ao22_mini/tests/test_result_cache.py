@@ -0,0 +1,118 @@
+import os
+
+import pytest
+
+import asistanst86_mini
+
+
+class FileHandler:
+    """'file read <path>' (thuần) / 'file write <path> <text>' (ghi), đếm số lần chạy thật"""
+    command_prefixes = ('file ',)
+
+    def __init__(self, assistant):
+        self.assistant = assistant
+        self.runs = 0
+
+    def can_handle(self, command):
+        return command.startswith('file ')
+
+    def resources(self, command):
+        return [f"file:{command.split()[2]}"]
+
+    def is_pure(self, command):
+        return command.split()[1] == 'read'
+
+    def handle(self, command):
+        self.runs += 1
+        _, op, path, *text = command.split()
+        if op == 'write':
+            with open(path, 'a', encoding='utf-8') as f:
+                f.write(' '.join(text))
+            return None
+        with open(path, encoding='utf-8') as f:
+            content = f.read()
+        print(f"📄 {content}")
+        self.assistant.context['last_read'] = content
+        return content
+
+
+@pytest.fixture
+def files(assistant, tmp_path):
+    handler = FileHandler(assistant)
+    assistant.handlers.append(handler)
+    assistant.enable_cache()
+    path = tmp_path / 'a.txt'
+    path.write_text('một', encoding='utf-8')
+    return handler, str(path)
+
+
+def test_hit_replays_value_output_and_context(assistant, files, capsys):
+    handler, path = files
+    assert assistant.execute(f'file read {path}').data == 'một'
+    assistant.context.pop('last_read')
+    capsys.readouterr()
+    assert assistant.execute(f'file  read   {path}').data == 'một'   # khóa chuẩn hóa khoảng trắng
+    assert handler.runs == 1
+    assert '📄 một' in capsys.readouterr().out
+    assert assistant.context['last_read'] == 'một'
+    assert assistant.cache.to_dict()['hits'] == 1
+
+
+def test_miss_after_mtime_or_size_change(assistant, files):
+    handler, path = files
+    assistant.execute(f'file read {path}')
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000_000))   # cùng size, khác mtime
+    assistant.execute(f'file read {path}')
+    assert handler.runs == 2
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write('!')
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000_000))   # cùng mtime, khác size
+    assert assistant.execute(f'file read {path}').data == 'một!'
+    assert handler.runs == 3
+
+
+def test_impure_command_invalidates_same_file(assistant, files, tmp_path):
+    handler, path = files
+    other = tmp_path / 'b.txt'
+    other.write_text('hai', encoding='utf-8')
+    assistant.execute(f'file read {path}')
+    assistant.execute(f'file read {other}')
+    # Ghi giữ nguyên mtime/size (vd đồng hồ thô): chỉ invalidate mới biết kết quả cũ sai
+    st = os.stat(path)
+    assistant.execute(f'file write {path} x')
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('bốn')
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns))
+    assert os.path.getsize(path) == st.st_size
+    assert assistant.cache.to_dict()['entries'] == 1
+    assert assistant.cache.to_dict()['evictions'] == 1
+    assert assistant.execute(f'file read {path}').data == 'bốn'
+    assistant.execute(f'file read {other}')
+    assert handler.runs == 4   # read a, read b, write, read a; read b là hit
+
+
+def make_cache(**limits):
+    cache = asistanst86_mini.ResultCache(**limits)
+    for i in range(3):
+        cache.put(('cmd', i), 'x' * 100, '', {})
+    return cache
+
+
+def test_lru_evicts_least_recent_entry_over_entry_cap():
+    cache = make_cache(max_entries=3)
+    assert cache.get(('cmd', 0)) is not None   # 0 thành mục mới dùng nhất
+    cache.put(('cmd', 3), 'y', '', {})
+    assert cache.get(('cmd', 1)) is None
+    assert all(cache.get(('cmd', i)) is not None for i in (0, 2, 3))
+    assert cache.to_dict()['evictions'] == 1 and cache.to_dict()['entries'] == 3
+
+
+def test_lru_evicts_over_byte_cap():
+    entry = asistanst86_mini._approx_size('x' * 100) + asistanst86_mini._approx_size({})
+    cache = make_cache(max_bytes=entry * 2)
+    assert cache.get(('cmd', 0)) is None and cache.get(('cmd', 2)) is not None
+    info = cache.to_dict()
+    assert info['entries'] == 2 and info['bytes'] == entry * 2 and info['evictions'] == 1
+    cache.put(('big',), 'z' * (entry * 2), '', {})   # lớn hơn cả giới hạn: không cache, không đẩy mục cũ
+    assert cache.get(('big',)) is None and cache.to_dict()['entries'] == 2
@@ -0,0 +1,71 @@
+import asyncio
+import json
+import os
+
+import asistanst86_mini
+
+
+class ContextHandler:
+    """'set <khóa> <giá trị>' ghi vào context, 'get <khóa>' đọc lại, 'boom' báo lỗi"""
+    command_prefixes = ('set ', 'get ', 'boom')
+    thread_safe = True
+
+    def __init__(self, assistant):
+        self.assistant = assistant
+
+    def can_handle(self, command):
+        return command.startswith(self.command_prefixes)
+
+    def handle(self, command):
+        if command == 'boom':
+            raise ValueError('hỏng')
+        op, key, *value = command.split(' ', 2)
+        if op == 'set':
+            self.assistant.context[key] = value[0]
+            print(f"đã đặt {key}")
+            return None
+        return self.assistant.context.get(key)
+
+
+async def talk(path, commands):
+    """Một client: gửi từng dòng lệnh, đọc mỗi lệnh một dòng JSON"""
+    reader, writer = await asyncio.open_unix_connection(path)
+    records = []
+    for command in commands:
+        writer.write(command.encode('utf-8') + b'\n')
+        await writer.drain()
+        records.append(json.loads(await reader.readline()))
+    writer.close()
+    await writer.wait_closed()
+    return records
+
+
+def test_socket_round_trip_with_session_contexts(assistant, tmp_path):
+    assistant.handlers.append(ContextHandler(assistant))
+    path = str(tmp_path / 'asi.sock')
+    server = asistanst86_mini.AssistantServer(assistant, path=path, workers=4)
+
+    async def scenario():
+        task = asyncio.create_task(server.serve())
+        while not os.path.exists(path):
+            await asyncio.sleep(0.01)
+        a, b = await asyncio.gather(
+            talk(path, ['set ten an', 'get ten', 'boom', 'không có lệnh', 'get ten']),
+            talk(path, ['set ten bình', 'get ten']))
+        c = await talk(path, ['get ten', 'exit'])
+        task.cancel()
+        return a, b, c
+
+    try:
+        a, b, c = asyncio.run(scenario())
+    finally:
+        server.pool.shutdown(wait=True)
+    assert [r['command'] for r in a] == ['set ten an', 'get ten', 'boom', 'không có lệnh', 'get ten']
+    assert a[0]['status'] == 'ok' and a[0]['output'] == 'đã đặt ten\n'
+    assert a[1]['result'] == 'an' and a[4]['result'] == 'an'   # session khác không ghi đè
+    assert a[2]['status'] == 'error' and 'hỏng' in a[2]['error']
+    assert a[3]['status'] == 'unknown'
+    assert b[1]['result'] == 'bình'
+    assert c[0]['result'] is None and c[1]['status'] == 'exit'   # kết nối mới: context trống
+    assert 'ten' not in assistant.context                       # không lọt vào context chung
+    assert all(isinstance(r['elapsed_ms'], float) for r in a + b + c)
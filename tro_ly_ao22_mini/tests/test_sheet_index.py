@@ -0,0 +1,30 @@
+import pytest
+from openpyxl import Workbook
+
+
+@pytest.fixture(params=[True, False], ids=['fast', 'public'])
+def excel_crud(request, excel_crud, monkeypatch):
+    monkeypatch.setattr(excel_crud, 'FAST_CELLS', request.param)
+    return excel_crud
+
+
+def make_sheet():
+    ws = Workbook().active
+    ws.append(['mã', 'tên'])
+    ws.append(['HPG', 'Hòa Phát'])
+    ws.append(['HSG', 'Hoa Sen'])
+    ws['D5'] = 'Hòa Bình'
+    return ws
+
+
+def test_index_finds_cells_in_every_mode(excel_crud):
+    index = excel_crud.SheetIndex(make_sheet())
+    assert index.find('Hòa') == [(2, 2), (5, 4)]
+    assert index.find('H', 'prefix') == [(2, 1), (2, 2), (3, 1), (3, 2), (5, 4)]
+    assert index.find('Hoa Sen', 'exact') == [(3, 2)]
+
+
+def test_index_follows_set(excel_crud):
+    index = excel_crud.SheetIndex(make_sheet())
+    index.set(3, 2, 'Hòa Sen')
+    assert index.find('Hòa') == [(2, 2), (3, 2), (5, 4)]
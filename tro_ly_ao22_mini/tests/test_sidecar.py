@@ -0,0 +1,106 @@
+import json
+import os
+
+import numpy as np
+import pytest
+from openpyxl import Workbook
+
+ROWS = [['ngày', 'Close'], ['d1', 10], ['d2', '11.5'], ['d3', None], ['d4', 'x']]
+
+
+def make_book(path, rows):
+    wb = Workbook()
+    for row in rows:
+        wb.active.append(list(row))
+    wb.save(path)
+    return str(path)
+
+
+@pytest.fixture
+def calls(excel_crud, monkeypatch):
+    """Đếm số lần parse xlsx (sheet_values) và hash file (file_digest)"""
+    counts = {'parse': 0, 'digest': 0}
+
+    def counted(name, func):
+        def wrapper(*args):
+            counts[name] += 1
+            return func(*args)
+        return wrapper
+    monkeypatch.setattr(excel_crud, 'sheet_values', counted('parse', excel_crud.sheet_values))
+    monkeypatch.setattr(excel_crud, 'file_digest', counted('digest', excel_crud.file_digest))
+    return counts
+
+
+def columns(excel_crud, path):
+    """Cột qua một WorkbookCache mới, như một lần chạy trợ lý mới"""
+    return excel_crud.WorkbookCache().columns(path)
+
+
+def meta(path):
+    with np.load(path) as data:
+        return json.loads(str(data['meta']))
+
+
+def assert_same(a, b):
+    assert a.header == b.header
+    np.testing.assert_array_equal(a.values, b.values)
+    for name in ('numeric', 'native', 'null'):
+        np.testing.assert_array_equal(getattr(a, name), getattr(b, name))
+
+
+def test_loads_sidecar_when_stamp_matches(excel_crud, tmp_path, calls):
+    path = make_book(tmp_path / 'a.xlsx', ROWS)
+    side = excel_crud.WorkbookCache().build_sidecar(path)
+    assert os.path.basename(side) == '.a.xlsx.cols.npz'
+    built = calls['parse']
+    cols = columns(excel_crud, path)
+    assert calls['parse'] == built and calls['digest'] == 1   # chỉ hash lúc build
+    assert_same(cols, excel_crud.SheetColumns.from_rows(excel_crud.sheet_values(path)))
+    assert cols.header == ['ngày', 'Close'] and cols.values[2, 1] == 11.5
+
+
+def test_rehashes_and_restamps_when_only_mtime_changed(excel_crud, tmp_path, calls):
+    path = make_book(tmp_path / 'a.xlsx', ROWS)
+    side = excel_crud.WorkbookCache().build_sidecar(path)
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 5_000_000_000))   # copy / checkout: cùng nội dung
+    parses = calls['parse']
+    columns(excel_crud, path)
+    assert calls['parse'] == parses and calls['digest'] == 2
+    assert meta(side)['mtime_ns'] == os.stat(path).st_mtime_ns
+    columns(excel_crud, path)   # dấu đã cập nhật: không hash lại
+    assert calls['parse'] == parses and calls['digest'] == 2
+
+
+def test_rebuilds_after_content_change(excel_crud, tmp_path, calls):
+    path = make_book(tmp_path / 'a.xlsx', ROWS)
+    side = excel_crud.WorkbookCache().build_sidecar(path)
+    old = meta(side)['digest']
+    make_book(path, ROWS + [['d5', 99]])
+    parses = calls['parse']
+    cols = columns(excel_crud, path)
+    assert calls['parse'] == parses + 1 and cols.values[5, 1] == 99
+    assert meta(side)['digest'] != old and meta(side)['size'] == os.path.getsize(path)
+
+
+@pytest.mark.parametrize('damage', ['corrupt', 'old-version'])
+def test_rebuilds_bad_sidecar(excel_crud, tmp_path, calls, monkeypatch, damage):
+    path = make_book(tmp_path / 'a.xlsx', ROWS)
+    side = excel_crud.sidecar_path(path)
+    if damage == 'corrupt':
+        with open(side, 'wb') as f:
+            f.write(b'PK\x03\x04 not an npz')
+    else:
+        # Sidecar phiên bản trước, dấu vẫn khớp: phải bị bỏ qua, không đọc nhầm định dạng cũ
+        with monkeypatch.context() as m:
+            m.setattr(excel_crud.SheetColumns, 'SIDECAR_VERSION', excel_crud.SheetColumns.SIDECAR_VERSION - 1)
+            excel_crud.WorkbookCache().build_sidecar(path)
+    assert excel_crud.SheetColumns.read_sidecar_meta(side) is None
+    parses = calls['parse']
+    cols = columns(excel_crud, path)
+    assert calls['parse'] == parses + 1
+    assert_same(cols, excel_crud.SheetColumns.from_rows(excel_crud.sheet_values(path)))
+    assert meta(side)['version'] == excel_crud.SheetColumns.SIDECAR_VERSION
+    parses = calls['parse']
+    columns(excel_crud, path)
+    assert calls['parse'] == parses
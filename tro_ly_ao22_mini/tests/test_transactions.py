@@ -0,0 +1,91 @@
+import os
+import stat
+import time
+
+import pytest
+from openpyxl import Workbook, load_workbook
+
+
+def make_book(path, rows):
+    wb = Workbook()
+    for row in rows:
+        wb.active.append(list(row))
+    wb.save(path)
+    return str(path)
+
+
+def disk_rows(path):
+    return [list(row) for row in load_workbook(path).active.iter_rows(values_only=True)]
+
+
+@pytest.fixture
+def excel(assistant, excel_crud, tmp_path):
+    handler = excel_crud.ExcelProHandler(assistant)
+    path = make_book(tmp_path / 'a.xlsx', [[1]])
+    yield handler, path
+    handler.shutdown()
+
+
+def test_rollback_restores_file(excel):
+    handler, path = excel
+    handler.handle(f'excel -f {path} add 2')   # thay đổi chưa lưu trước begin: begin ghi nó làm điểm rollback
+    handler.handle(f'excel -f {path} begin')
+    before = os.stat(path).st_mtime_ns
+    handler.handle(f'excel -f {path} add 3')
+    handler.handle(f'excel -f {path} delete 1')
+    handler.books.flush()   # flush bỏ qua workbook đang trong transaction
+    assert disk_rows(path) == [[1], [2]] and os.stat(path).st_mtime_ns == before
+    assert handler.handle(f'excel -f {path} rollback') is None
+    assert handler.books.tx_state(path) is None and not handler.books.is_dirty(path)
+    handler.books.flush()
+    assert disk_rows(path) == [[1], [2]] and os.stat(path).st_mtime_ns == before
+
+
+def test_failed_command_aborts_transaction(excel):
+    handler, path = excel
+    handler.handle(f'excel -f {path} begin')
+    handler.handle(f'excel -f {path} add 2')
+    assert handler.handle(f'excel -f {path} delete abc').status == 'error'
+    for command in ('add 3', 'read', 'stat 1'):
+        result = handler.handle(f'excel -f {path} {command}')
+        assert result.status == 'error' and 'rollback' in result.message, command
+    result = handler.handle(f'excel -f {path} commit')
+    assert result.status == 'error' and 'đã rollback' in result.message
+    assert disk_rows(path) == [[1]]
+    handler.handle(f'excel -f {path} add 4')   # transaction đã đóng: lệnh chạy lại bình thường
+    handler.books.flush()
+    assert disk_rows(path) == [[1], [4]]
+
+
+def test_commit_refused_after_external_change(excel):
+    handler, path = excel
+    handler.handle(f'excel -f {path} begin')
+    handler.handle(f'excel -f {path} add 2')
+    time.sleep(0.01)
+    make_book(path, [['bên ngoài']])
+    result = handler.handle(f'excel -f {path} commit')
+    assert result.status == 'error' and 'bên ngoài' in result.message
+    assert disk_rows(path) == [['bên ngoài']]
+    assert handler.books.tx_state(path) is None
+
+
+def test_commit_writes_once(excel):
+    handler, path = excel
+    handler.handle(f'excel -f {path} begin')
+    handler.handle(f'excel -f {path} add 2')
+    handler.handle(f'excel -f {path} add 3')
+    assert disk_rows(path) == [[1]]
+    assert handler.handle(f'excel -f {path} commit') is None
+    assert disk_rows(path) == [[1], [2], [3]]
+    assert not handler.books.is_dirty(path)
+
+
+def test_atomic_save_keeps_mode_and_leaves_no_temp(excel_crud, tmp_path):
+    path = make_book(tmp_path / 'a.xlsx', [[1]])
+    os.chmod(path, 0o640)
+    wb = load_workbook(path)
+    wb.active.append([2])
+    excel_crud.atomic_save(wb, path)
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o640
+    assert disk_rows(path) == [[1], [2]]
+    assert os.listdir(tmp_path) == ['a.xlsx']
@@ -0,0 +1,95 @@
+import os
+
+from openpyxl import Workbook, load_workbook
+
+from conftest import run_batch
+
+
+def make_book(path, rows=()):
+    wb = Workbook()
+    for row in rows:
+        wb.active.append(list(row))
+    wb.save(path)
+    return str(path)
+
+
+def disk_rows(path):
+    return [list(row) for row in load_workbook(path).active.iter_rows(values_only=True)]
+
+
+def test_changes_stay_in_memory_until_flush(excel_crud, tmp_path):
+    path = make_book(tmp_path / 'a.xlsx', [[1]])
+    books = excel_crud.WorkbookCache()
+    wb = books.get(path)
+    wb.active.append([2])
+    books.mark_dirty(path, wb)
+    assert disk_rows(path) == [[1]]
+    assert books.get(path) is wb
+    assert books.flush() == [os.path.abspath(path)]
+    assert disk_rows(path) == [[1], [2]]
+    assert not books.is_dirty(path)
+    assert books.flush() == []
+
+
+def test_eviction_saves_least_recently_used(excel_crud, tmp_path):
+    paths = [make_book(tmp_path / f'{i}.xlsx', [[i]]) for i in range(3)]
+    books = excel_crud.WorkbookCache(max_books=2)
+    for i, path in enumerate(paths):
+        wb = books.get(path)
+        wb.active.append([i * 10])
+        books.mark_dirty(path, wb)
+    assert books.paths() == [os.path.abspath(p) for p in paths[1:]]
+    assert disk_rows(paths[0]) == [[0], [0]]
+    assert disk_rows(paths[2]) == [[2]]
+
+
+def test_transaction_is_not_evicted_or_flushed(excel_crud, tmp_path):
+    paths = [make_book(tmp_path / f'{i}.xlsx', [[i]]) for i in range(3)]
+    books = excel_crud.WorkbookCache(max_books=1)
+    books.begin(paths[0])
+    wb = books.get(paths[0])
+    wb.active.append(['tx'])
+    books.mark_dirty(paths[0], wb)
+    books.get(paths[1])
+    books.get(paths[2])
+    assert os.path.abspath(paths[0]) in books.paths()
+    assert books.flush() == []
+    assert disk_rows(paths[0]) == [[0]]
+    assert books.commit(paths[0])
+    assert disk_rows(paths[0]) == [[0], ['tx']]
+
+
+def test_external_change_reloads(excel_crud, tmp_path):
+    path = make_book(tmp_path / 'a.xlsx', [[1]])
+    books = excel_crud.WorkbookCache()
+    first = books.get(path)
+    make_book(path, [[1], [2], [3]])
+    second = books.get(path)
+    assert second is not first
+    assert second.active.max_row == 3
+
+
+def test_write_through_saves_each_change(excel_crud, tmp_path):
+    path = make_book(tmp_path / 'a.xlsx', [[1]])
+    books = excel_crud.WorkbookCache(write_through=True)
+    wb = books.get(path)
+    wb.active.append([2])
+    books.mark_dirty(path, wb)
+    assert disk_rows(path) == [[1], [2]]
+    assert not books.is_dirty(path)
+    books.begin(path)
+    wb.active.append([3])
+    books.mark_dirty(path, wb)
+    assert disk_rows(path) == [[1], [2]]
+    books.commit(path)
+    assert disk_rows(path) == [[1], [2], [3]]
+
+
+def test_worker_pool_keeps_every_write(workdir):
+    """Lệnh ghi cùng file chạy đồng thời qua nhiều worker process: không mất dòng nào"""
+    make_book(workdir / 'a.xlsx')
+    commands = [f'excel -f a.xlsx add {i}' for i in range(1, 21)]
+    proc = run_batch(workdir, commands, '--jobs', '4', '--process', 'excel_crud=2')
+    assert proc.returncode == 0, proc.stdout + proc.stderr
+    values = sorted(row[0] for row in disk_rows(workdir / 'a.xlsx') if row[0] is not None)
+    assert values == [float(i) for i in range(1, 21)]